@@ -0,0 +1,76 @@
+"""
+Admission control for database queries
+
+Each query class (see database.QUERY_CLASSES) gets a FairLimiter with a
+fixed number of concurrent slots. When every slot is busy, callers queue
+per session and slots are handed out round-robin across sessions, so one
+session firing many searches cannot starve another. A caller that waits
+longer than its queue timeout gets DatabaseBusy instead of hanging.
+"""
+
+import threading
+from collections import OrderedDict, deque
+
+class QueryRejected(Exception):
+    """A query was refused or cut short to protect the database; the message is user-facing"""
+
+class DatabaseBusy(QueryRejected):
+    pass
+
+class QueryTimeout(QueryRejected):
+    pass
+
+class FairLimiter:
+    def __init__(self, name, slots):
+        self.name = name
+        self.slots = slots
+        self.active = 0
+        self.rejected = 0
+        self._queues = OrderedDict()  # session -> deque of waiting tickets, in turn order
+        self._condition = threading.Condition()
+
+    def _next_ticket(self):
+        for queue in self._queues.values():
+            return queue[0]
+        return None
+
+    def _remove(self, session, ticket):
+        queue = self._queues[session]
+        queue.remove(ticket)
+        if queue:
+            # The session goes to the back of the line for its next query
+            self._queues.move_to_end(session)
+        else:
+            del self._queues[session]
+
+    def acquire(self, session, timeout):
+        ticket = object()
+        with self._condition:
+            if self.active < self.slots and not self._queues:
+                self.active += 1
+                return
+            self._queues.setdefault(session, deque()).append(ticket)
+            granted = self._condition.wait_for(
+                lambda: self.active < self.slots and self._next_ticket() is ticket,
+                timeout
+            )
+            self._remove(session, ticket)
+            # The head of the line changed: waiters that checked while this
+            # ticket was still ahead of them must look again
+            self._condition.notify_all()
+            if not granted:
+                self.rejected += 1
+                raise DatabaseBusy(
+                    "The archive is busy right now. Please try again in a moment, "
+                    "or narrow your search with a date range."
+                )
+            self.active += 1
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify_all()
+
+    def waiting(self):
+        with self._condition:
+            return sum(len(queue) for queue in self._queues.values())
@@ -0,0 +1,190 @@
+"""
+Shared client for the RepLadies Archive API
+
+One keep-alive session for every page, uniform error handling, and two ways
+to read a response:
+
+- get_json() decodes the whole body at once (with orjson when installed)
+- stream_results() decodes a large response incrementally, yielding the
+  elements of its "results" array as they arrive so callers can consume
+  them without ever holding the full document or object graph
+
+Usage:
+    from api_client import get_json, stream_results
+    post = get_json(f"/api/posts/{post_id}")
+    results = stream_results(f"/api/posts/{post_id}/comments", params={"limit": 10000})
+    for comment in results:
+        ...
+    results.meta["total_comments"]
+"""
+
+import codecs
+import json
+
+import requests
+
+import cache
+from singleflight import SingleFlight
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+API_BASE_URL = "https://m6njm571hh.execute-api.us-east-2.amazonaws.com"
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+_session = requests.Session()
+
+# Identical concurrent requests from different sessions share one call
+flights = SingleFlight()
+
+class ApiError(Exception):
+    """Non-200 response from the API"""
+
+    def __init__(self, status_code, message):
+        super().__init__(f"API Error ({status_code}): {message}")
+        self.status_code = status_code
+        self.message = message
+
+def _check(response):
+    if response.status_code != 200:
+        message = response.text
+        try:
+            error_data = response.json()
+            if 'detail' in error_data:
+                message = error_data['detail']
+        except ValueError:
+            pass
+        response.close()
+        raise ApiError(response.status_code, message)
+
+def get_json(path, params=None, timeout=10, cache_ttl=None):
+    """
+    GET an API path and decode the whole JSON body. With cache_ttl, the
+    response is kept in the persistent cache shared by all app processes.
+    Concurrent identical requests are coalesced into one call.
+    """
+    parts = ("get_json", path, sorted((params or {}).items()))
+    if cache_ttl:
+        try:
+            hit, data = cache.get("api", parts)
+            if hit:
+                return data
+        except Exception:
+            pass
+    def fetch():
+        response = _session.get(f"{API_BASE_URL}{path}", params=params, timeout=timeout)
+        _check(response)
+        return _loads(response.content)
+
+    data = flights.do(parts, fetch, timeout=timeout)
+    if cache_ttl:
+        try:
+            cache.put("api", parts, data, cache_ttl)
+        except Exception:
+            pass
+    return data
+
+def stream_results(path, params=None, timeout=10, key="results"):
+    """GET an API path and decode its `key` array incrementally"""
+    response = _session.get(f"{API_BASE_URL}{path}", params=params, timeout=timeout, stream=True)
+    _check(response)
+    return StreamingResults(response, key)
+
+class StreamingResults:
+    """
+    Iterates over the elements of one top-level array of a JSON object while
+    the response is still downloading. Other top-level fields are collected
+    in .meta as they are parsed (all of them once iteration has finished).
+    """
+
+    _WHITESPACE = " \t\n\r"
+
+    def __init__(self, response, key="results"):
+        self.meta = {}
+        self._response = response
+        self._key = key
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._done = False
+
+    def _chunks(self):
+        decoder = codecs.getincrementaldecoder(self._response.encoding or "utf-8")(errors="replace")
+        for chunk in self._response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+            text = decoder.decode(chunk)
+            if text:
+                yield text
+        tail = decoder.decode(b"", final=True)
+        if tail:
+            yield tail
+
+    def _more(self):
+        """Append the next chunk to the unparsed part of the buffer"""
+        chunk = next(self._stream, None)
+        if chunk is None:
+            self._done = True
+            return False
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _peek(self):
+        """Next non-whitespace character, without consuming it"""
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in self._WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._more():
+                raise ValueError("Unexpected end of JSON response")
+
+    def _expect(self, characters):
+        character = self._peek()
+        if character not in characters:
+            raise ValueError(f"Expected one of {characters!r} in JSON response, got {character!r}")
+        self._pos += 1
+        return character
+
+    def _value(self):
+        """Decode the next complete JSON value"""
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+                # A number at the very end of the buffer may continue in the next chunk
+                if end < len(self._buffer) or self._done:
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._done:
+                    raise
+            self._more()
+
+    def __iter__(self):
+        self._stream = self._chunks()
+        try:
+            self._expect("{")
+            if self._peek() == "}":
+                return
+            while True:
+                name = self._value()
+                self._expect(":")
+                if name == self._key and self._peek() == "[":
+                    self._expect("[")
+                    if self._peek() == "]":
+                        self._pos += 1
+                    else:
+                        while True:
+                            yield self._value()
+                            if self._expect(",]") == "]":
+                                break
+                else:
+                    self.meta[name] = self._value()
+                if self._expect(",}") == "}":
+                    return
+        finally:
+            self._response.close()
@@ -0,0 +1,128 @@
+"""
+Per-author aggregates behind the Profile View header
+
+- author_stats: post/comment counts, score totals and first/last activity,
+  one row per author
+- author_monthly: posts and comments per author per month
+- author_threads: the threads each author commented on most (top
+  TOP_THREADS_PER_AUTHOR only)
+
+Kept current by ingest.py (see DERIVED_TABLES): an incremental batch
+recomputes the authors whose posts or comments it touched, through the
+author indexes, including an author whose rows were reassigned (e.g. to
+"[deleted]"); a bulk load rebuilds every author in one pass. Deleted
+accounts are not tracked.
+"""
+
+TOP_THREADS_PER_AUTHOR = 10
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS author_stats (
+        author text PRIMARY KEY,
+        post_count integer NOT NULL,
+        comment_count integer NOT NULL,
+        post_score bigint NOT NULL,
+        comment_score bigint NOT NULL,
+        first_utc bigint,
+        last_utc bigint
+    );
+
+    CREATE TABLE IF NOT EXISTS author_monthly (
+        author text NOT NULL,
+        month date NOT NULL,
+        posts integer NOT NULL,
+        comments integer NOT NULL,
+        PRIMARY KEY (author, month)
+    );
+
+    CREATE TABLE IF NOT EXISTS author_threads (
+        author text NOT NULL,
+        submission_id text NOT NULL,
+        comments integer NOT NULL,
+        score bigint NOT NULL,
+        PRIMARY KEY (author, submission_id)
+    );
+
+    CREATE INDEX IF NOT EXISTS submissions_author_idx ON submissions (author);
+    CREATE INDEX IF NOT EXISTS comments_author_idx ON comments (author);
+"""
+
+MONTH = "date_trunc('month', to_timestamp(created_utc) AT TIME ZONE 'UTC')::date"
+
+def _recompute(cur, authors=None):
+    """Replace the aggregates of the given authors, or of everyone"""
+    if authors is None:
+        condition = "author IS NOT NULL AND author <> '[deleted]'"
+        params = {}
+        for table in ("author_stats", "author_monthly", "author_threads"):
+            cur.execute(f"TRUNCATE {table}")
+    else:
+        condition = "author = ANY(%(authors)s)"
+        params = {"authors": authors}
+        for table in ("author_stats", "author_monthly", "author_threads"):
+            cur.execute(f"DELETE FROM {table} WHERE {condition}", params)
+
+    cur.execute(f"""
+        WITH post_totals AS (
+            SELECT author, count(*) AS n, COALESCE(sum(score), 0) AS score,
+                MIN(created_utc) AS first_utc, MAX(created_utc) AS last_utc
+            FROM submissions WHERE {condition} GROUP BY author
+        ), comment_totals AS (
+            SELECT author, count(*) AS n, COALESCE(sum(score), 0) AS score,
+                MIN(created_utc) AS first_utc, MAX(created_utc) AS last_utc
+            FROM comments WHERE {condition} GROUP BY author
+        )
+        INSERT INTO author_stats
+            (author, post_count, comment_count, post_score, comment_score, first_utc, last_utc)
+        SELECT author, COALESCE(p.n, 0), COALESCE(c.n, 0), COALESCE(p.score, 0), COALESCE(c.score, 0),
+            LEAST(p.first_utc, c.first_utc), GREATEST(p.last_utc, c.last_utc)
+        FROM post_totals p FULL JOIN comment_totals c USING (author)
+    """, params)
+
+    cur.execute(f"""
+        INSERT INTO author_monthly (author, month, posts, comments)
+        SELECT author, month, count(*) FILTER (WHERE is_post), count(*) FILTER (WHERE NOT is_post)
+        FROM (
+            SELECT author, {MONTH} AS month, true AS is_post FROM submissions WHERE {condition}
+            UNION ALL
+            SELECT author, {MONTH}, false FROM comments WHERE {condition}
+        ) activity
+        GROUP BY author, month
+    """, params)
+
+    cur.execute(f"""
+        INSERT INTO author_threads (author, submission_id, comments, score)
+        SELECT author, submission_id, comments, score
+        FROM (
+            SELECT author, submission_id, count(*) AS comments, COALESCE(sum(score), 0) AS score,
+                row_number() OVER (PARTITION BY author ORDER BY count(*) DESC, submission_id) AS rank
+            FROM comments WHERE {condition}
+            GROUP BY author, submission_id
+        ) ranked
+        WHERE rank <= {TOP_THREADS_PER_AUTHOR}
+    """, params)
+
+def refresh_author_stats(cur, table):
+    """
+    Ingest hook: recompute the authors of the rows changed by the current
+    batch - both the current author and, when an edit changed it (e.g. to
+    "[deleted]"), the previous one, who loses that activity
+    """
+    cur.execute(f"""
+        SELECT DISTINCT author
+        FROM (
+            SELECT t.author
+            FROM ingest_changed ch
+            JOIN {table} t ON t.id = ch.id AND t.created_utc = ch.created_utc
+            UNION
+            SELECT previous_author FROM ingest_changed
+        ) authors
+        WHERE author IS NOT NULL AND author <> '[deleted]'
+    """)
+    authors = [row[0] for row in cur.fetchall()]
+    if authors:
+        _recompute(cur, authors)
+
+def rebuild_author_stats(cur, table):
+    """Ingest hook: recompute every author after a bulk load"""
+    _recompute(cur)
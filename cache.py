@@ -0,0 +1,221 @@
+"""
+Persistent response cache shared by every app process on a host
+
+A SQLite file (WAL mode) holds API responses and query results, so they
+survive restarts and deploys and are shared by all replicas running on the
+same machine, unlike st.cache_data which is per process.
+
+- Entries expire after their TTL
+- The file is kept under MAX_BYTES by evicting expired entries first, then
+  the least recently used ones
+- Keys include CACHE_VERSION and a per-namespace version: bump one when a
+  schema or API change makes old entries wrong, and they are never read
+  again (and are purged on the next start)
+- Hits and misses are counted per namespace (see stats())
+
+Reads stay reads: hit/miss counters are kept in memory and flushed every
+FLUSH_SECONDS, and an entry's accessed_at (for LRU eviction) is only
+rewritten when it is more than TOUCH_SECONDS old, so hits from many
+processes don't queue on SQLite's single writer lock.
+
+Usage:
+    import cache
+
+    hit, value = cache.get("api", parts)
+    if not hit:
+        value = fetch()
+        cache.put("api", parts, value, ttl=3600)
+"""
+
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+CACHE_VERSION = 1
+
+# Bump a namespace's version to invalidate only its entries
+NAMESPACE_VERSIONS = {
+    "api": 1,
+    "query": 1,
+}
+
+CACHE_PATH = os.environ.get("ARCHIVE_CACHE_PATH", os.path.join(".cache", "archive_cache.sqlite3"))
+MAX_BYTES = int(os.environ.get("ARCHIVE_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+# Eviction runs after this many writes rather than after every one
+EVICT_EVERY = 100
+
+# Counters are written at most this often; LRU times are this coarse
+FLUSH_SECONDS = 30
+TOUCH_SECONDS = 60
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS entries (
+        key TEXT PRIMARY KEY,
+        namespace TEXT NOT NULL,
+        version INTEGER NOT NULL,
+        value BLOB NOT NULL,
+        size INTEGER NOT NULL,
+        expires_at REAL NOT NULL,
+        accessed_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at);
+    CREATE TABLE IF NOT EXISTS counters (
+        namespace TEXT PRIMARY KEY,
+        hits INTEGER NOT NULL DEFAULT 0,
+        misses INTEGER NOT NULL DEFAULT 0
+    );
+"""
+
+_local = threading.local()
+_writes = 0
+_initialized = False
+_init_lock = threading.Lock()
+
+# namespace -> [hits, misses] not yet written to the counters table
+_pending = {}
+_pending_lock = threading.Lock()
+_flushed_at = time.monotonic()
+
+def _version(namespace):
+    return CACHE_VERSION * 1000 + NAMESPACE_VERSIONS.get(namespace, 1)
+
+def _connection():
+    """One connection per thread; SQLite handles locking between processes"""
+    global _initialized
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        directory = os.path.dirname(CACHE_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(CACHE_PATH, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
+        with _init_lock:
+            if not _initialized:
+                conn.executescript(SCHEMA)
+                _purge_old_versions(conn)
+                _initialized = True
+    return conn
+
+def _purge_old_versions(conn):
+    for namespace in NAMESPACE_VERSIONS:
+        conn.execute(
+            "DELETE FROM entries WHERE namespace = ? AND version != ?",
+            (namespace, _version(namespace))
+        )
+
+def make_key(namespace, parts):
+    digest = hashlib.sha256(repr(parts).encode()).hexdigest()
+    return f"{_version(namespace)}:{namespace}:{digest}"
+
+def _count(namespace, hit):
+    with _pending_lock:
+        _pending.setdefault(namespace, [0, 0])[0 if hit else 1] += 1
+
+def flush_counters(conn=None):
+    """Add the in-memory hit/miss counts to the counters table"""
+    global _flushed_at
+    with _pending_lock:
+        pending = list(_pending.items())
+        _pending.clear()
+        _flushed_at = time.monotonic()
+    if not pending:
+        return
+    conn = conn or _connection()
+    with conn:
+        conn.executemany(
+            "INSERT INTO counters (namespace, hits, misses) VALUES (?, ?, ?) "
+            "ON CONFLICT (namespace) DO UPDATE SET hits = hits + excluded.hits, misses = misses + excluded.misses",
+            [(namespace, hits, misses) for namespace, (hits, misses) in pending]
+        )
+
+def get(namespace, parts):
+    """(True, value) for a live entry, (False, None) otherwise"""
+    conn = _connection()
+    key = make_key(namespace, parts)
+    now = time.time()
+    row = conn.execute(
+        "SELECT value, accessed_at FROM entries WHERE key = ? AND expires_at > ?", (key, now)
+    ).fetchone()
+    _count(namespace, row is not None)
+    if row is not None and now - row[1] > TOUCH_SECONDS:
+        conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+    if time.monotonic() - _flushed_at > FLUSH_SECONDS:
+        flush_counters(conn)
+    if row is None:
+        return False, None
+    return True, pickle.loads(row[0])
+
+def put(namespace, parts, value, ttl):
+    """Store a value for ttl seconds"""
+    global _writes
+    conn = _connection()
+    data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    now = time.time()
+    conn.execute(
+        "INSERT OR REPLACE INTO entries (key, namespace, version, value, size, expires_at, accessed_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (make_key(namespace, parts), namespace, _version(namespace), data, len(data), now + ttl, now)
+    )
+    _writes += 1
+    if _writes % EVICT_EVERY == 0:
+        evict(conn)
+
+def evict(conn=None):
+    """Drop expired entries, then least recently used ones until under MAX_BYTES"""
+    conn = conn or _connection()
+    with conn:
+        conn.execute("DELETE FROM entries WHERE expires_at <= ?", (time.time(),))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= MAX_BYTES:
+            return
+        # Free a little more than needed so eviction doesn't run on every write
+        to_free = total - MAX_BYTES * 0.9
+        freed = 0
+        victims = []
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed_at"):
+            victims.append((key,))
+            freed += size
+            if freed >= to_free:
+                break
+        conn.executemany("DELETE FROM entries WHERE key = ?", victims)
+
+def clear(namespace=None):
+    conn = _connection()
+    with conn:
+        if namespace:
+            conn.execute("DELETE FROM entries WHERE namespace = ?", (namespace,))
+        else:
+            conn.execute("DELETE FROM entries")
+            conn.execute("DELETE FROM counters")
+            with _pending_lock:
+                _pending.clear()
+
+def stats():
+    """Per-namespace entry counts, sizes, hits, misses and hit rate"""
+    conn = _connection()
+    flush_counters(conn)
+    rows = conn.execute("""
+        SELECT c.namespace, COALESCE(e.entries, 0), COALESCE(e.bytes, 0), c.hits, c.misses
+        FROM counters c
+        LEFT JOIN (
+            SELECT namespace, COUNT(*) AS entries, SUM(size) AS bytes FROM entries GROUP BY namespace
+        ) e ON e.namespace = c.namespace
+        ORDER BY c.namespace
+    """).fetchall()
+    return [
+        {
+            "namespace": namespace,
+            "entries": entries,
+            "size_mb": round(size / 1024 / 1024, 2),
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(100 * hits / (hits + misses), 1) if hits + misses else None,
+        }
+        for namespace, entries, size, hits, misses in rows
+    ]
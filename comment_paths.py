@@ -0,0 +1,79 @@
+"""
+Materialized thread paths for comments
+
+Each comment stores one sortable path per comment sort order plus its depth.
+A path is the parent's path, '/', then a fixed-width sort key and the
+comment id, so ordering a post's comments by path (with the "C" collation)
+yields display order: every parent first, its replies right after it in the
+chosen order. With an index on (submission_id, path) a whole thread, one
+subtree or the first N top-level threads is a single index range scan.
+
+Paths are computed with a recursive CTE when comments are ingested (see
+DERIVED_TABLES in ingest.py). path_top depends on score, so it is recomputed
+for every thread whose comments were touched by an incremental load.
+"""
+
+# Fixed-width (10 digit) sort keys; the id breaks ties and makes paths unique.
+# Columns are the values of queries.COMMENT_PATH_ORDERS.
+PATH_KEYS = {
+    "path_top": "lpad((2147483647 - COALESCE({c}.score, 0))::text, 10, '0') || {c}.id",
+    "path_new": "lpad((9999999999 - {c}.created_utc)::text, 10, '0') || {c}.id",
+    "path_old": "lpad({c}.created_utc::text, 10, '0') || {c}.id",
+}
+
+SCHEMA = "\n".join(
+    [f"ALTER TABLE comments ADD COLUMN IF NOT EXISTS {column} text COLLATE \"C\";" for column in PATH_KEYS]
+    + ["ALTER TABLE comments ADD COLUMN IF NOT EXISTS depth smallint;"]
+    + [
+        f"CREATE INDEX IF NOT EXISTS comments_thread_{column[5:]}_idx ON comments (submission_id, {column});"
+        for column in PATH_KEYS
+    ]
+)
+
+def _paths_sql(where):
+    columns = list(PATH_KEYS)
+    root_paths = ", ".join(f"{PATH_KEYS[column].format(c='c')} AS {column}" for column in columns)
+    child_paths = ", ".join(
+        f"t.{column} || '/' || {PATH_KEYS[column].format(c='c')}" for column in columns
+    )
+    return f"""
+        WITH RECURSIVE tree AS (
+            SELECT c.id, c.submission_id, 0 AS depth, {root_paths}
+            FROM comments c
+            WHERE c.parent_id = c.submission_id {where}
+            UNION ALL
+            SELECT c.id, c.submission_id, t.depth + 1, {child_paths}
+            FROM comments c
+            JOIN tree t ON c.parent_id = t.id AND c.submission_id = t.submission_id
+        )
+        UPDATE comments c
+        SET depth = tree.depth, {', '.join(f'{column} = tree.{column}' for column in columns)}
+        FROM tree
+        WHERE c.id = tree.id AND c.submission_id = tree.submission_id
+            AND (c.depth, {', '.join(f'c.{column}' for column in columns)})
+                IS DISTINCT FROM (tree.depth, {', '.join(f'tree.{column}' for column in columns)})
+    """
+
+def update_thread_paths(cur, submission_ids):
+    """Recompute paths and depths for every comment of the given posts"""
+    cur.execute(_paths_sql("AND c.submission_id = ANY(%s)"), (list(submission_ids),))
+    return cur.rowcount
+
+def refresh_comment_paths(cur, table):
+    """Ingest hook: recompute the threads touched by the current batch"""
+    if table != "comments":
+        return
+    cur.execute("""
+        SELECT DISTINCT c.submission_id
+        FROM ingest_changed ch
+        JOIN comments c ON c.id = ch.id AND c.created_utc = ch.created_utc
+    """)
+    submission_ids = [row[0] for row in cur.fetchall()]
+    if submission_ids:
+        update_thread_paths(cur, submission_ids)
+
+def rebuild_comment_paths(cur, table):
+    """Ingest hook: compute paths for the whole archive after a bulk load"""
+    if table != "comments":
+        return
+    cur.execute(_paths_sql(""))
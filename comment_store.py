@@ -0,0 +1,122 @@
+"""
+Compact, read-only storage for the comments of one thread
+
+Comments are kept column-wise instead of one dict per comment: parallel
+lists for the text fields, typed arrays for numbers, and integer indexes
+(first child / next sibling) for the tree. Author names are interned so a
+prolific commenter is stored once per process. A built store is never
+mutated, so one instance can be cached and shared by every session viewing
+the same (post, sort).
+
+Usage:
+    store = CommentStore.build(comments, post_id)
+    for index, depth in store.walk():
+        store.authors[index], store.bodies[index]
+"""
+
+import sys
+from array import array
+
+class CommentStore:
+    __slots__ = (
+        "post_id", "ids", "authors", "bodies", "dates", "scores",
+        "parents", "first_child", "next_sibling", "reply_counts", "roots", "positions",
+    )
+
+    def __init__(self, post_id):
+        self.post_id = post_id
+        self.ids = []
+        self.authors = []
+        self.bodies = []
+        self.dates = []
+        self.scores = array("i")
+        self.parents = array("i")
+        self.first_child = array("i")
+        self.next_sibling = array("i")
+        self.reply_counts = array("i")
+        self.roots = array("i")
+        self.positions = {}
+
+    @classmethod
+    def build(cls, comments, post_id):
+        """
+        Build a store from an iterable of comment dicts (id, parent_id, author,
+        body, score, formatted_date) in display order. Comments whose parent is
+        missing from the thread are dropped, as before.
+        """
+        store = cls(post_id)
+        parent_ids = []
+        for comment in comments:
+            store.positions[comment['id']] = len(store.ids)
+            store.ids.append(comment['id'])
+            store.authors.append(sys.intern(comment['author'] or '[deleted]'))
+            store.bodies.append(comment['body'])
+            store.dates.append(comment.get('formatted_date', ''))
+            store.scores.append(comment['score'] or 0)
+            parent_ids.append(comment['parent_id'])
+
+        count = len(store.ids)
+        store.parents = array("i", [-1]) * count
+        store.first_child = array("i", [-1]) * count
+        store.next_sibling = array("i", [-1]) * count
+        store.reply_counts = array("i", [0]) * count
+        last_child = array("i", [-1]) * count
+
+        # Link children in input order, whatever order parents arrived in
+        for index, parent_id in enumerate(parent_ids):
+            if parent_id == post_id:
+                store.roots.append(index)
+                continue
+            parent = store.positions.get(parent_id)
+            if parent is None:
+                continue
+            store.parents[index] = parent
+            store.reply_counts[parent] += 1
+            if last_child[parent] == -1:
+                store.first_child[parent] = index
+            else:
+                store.next_sibling[last_child[parent]] = index
+            last_child[parent] = index
+        return store
+
+    def __len__(self):
+        return len(self.ids)
+
+    def top_level(self):
+        """Indexes of the top-level comments in order"""
+        return iter(self.roots)
+
+    def children(self, index):
+        """Indexes of the direct replies to a comment in order"""
+        child = self.first_child[index]
+        while child != -1:
+            yield child
+            child = self.next_sibling[child]
+
+    def walk(self):
+        """(index, depth) of every reachable comment in display order, without recursion"""
+        stack = [(index, 0) for index in reversed(list(self.top_level()))]
+        while stack:
+            index, depth = stack.pop()
+            yield index, depth
+            stack.extend((child, depth + 1) for child in reversed(list(self.children(index))))
+
+    def ancestors(self, comment_id):
+        """Indexes from the top-level comment down to comment_id, or [] if unknown"""
+        index = self.positions.get(comment_id, -1)
+        chain = []
+        while index != -1:
+            chain.append(index)
+            index = self.parents[index]
+        chain.reverse()
+        return chain
+
+    def comment(self, index):
+        """One comment as a dict, for code that needs the old shape"""
+        return {
+            'id': self.ids[index],
+            'author': self.authors[index],
+            'body': self.bodies[index],
+            'score': self.scores[index],
+            'formatted_date': self.dates[index],
+        }
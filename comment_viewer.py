@@ -0,0 +1,322 @@
+"""
+Virtualized comment viewer for the Post View
+
+Instead of pre-rendering every comment (and every hidden reply) as nested
+HTML, the thread is sent to the browser once as a compact column-wise JSON
+tree. A small script flattens the currently expanded part of the tree and
+only creates DOM nodes for the rows inside the scroll window, so the DOM
+stays a few dozen rows deep however large the thread is. Subtrees are
+expanded on demand from the data already in the page.
+
+Usage:
+    tree = tree_json(store)  # cache per (post, sort)
+    render_comment_viewer(tree, highlight_path=store.ancestors(comment_id))
+"""
+
+import json
+
+import streamlit.components.v1 as components
+
+def tree_json(store):
+    """
+    Serialize a CommentStore to the viewer's compact JSON: one array per
+    column, authors de-duplicated, and the tree as first-child / next-sibling
+    indexes instead of nested objects.
+    """
+    author_indexes = {}
+    authors = []
+    for author in store.authors:
+        if author not in author_indexes:
+            author_indexes[author] = len(authors)
+            authors.append(author)
+    tree = {
+        "ids": store.ids,
+        "names": authors,
+        "author": [author_indexes[author] for author in store.authors],
+        "body": [body.strip() for body in store.bodies],
+        "score": store.scores.tolist(),
+        "date": store.dates,
+        "first": store.first_child.tolist(),
+        "next": store.next_sibling.tolist(),
+        "replies": store.reply_counts.tolist(),
+        "roots": store.roots.tolist(),
+    }
+    # Safe to embed in a <script> element
+    return json.dumps(tree, separators=(",", ":")).replace("</", "<\\/")
+
+VIEWER_CSS = """
+    <style>
+        body {
+            margin: 0;
+            font-family: "Source Sans Pro", sans-serif;
+        }
+        .comments-container {
+            color: white;
+            max-width: 1200px;
+            margin: 0 auto;
+            overflow-y: auto;
+            position: relative;
+        }
+        .comments-spacer {
+            position: relative;
+        }
+        .comment-row {
+            position: absolute;
+            left: 0;
+            right: 0;
+            padding-bottom: 1.4em;
+        }
+        .comment-row[data-level="0"] {
+            padding-bottom: 2em;
+        }
+        .comment {
+            padding: 18px 22px;
+            border-left: 3px solid #666;
+            position: relative;
+            line-height: 1.6;
+        }
+        .nested-comment {
+            background-color: rgba(255, 255, 255, 0.015);
+            border-left: 3px solid #555;
+        }
+        .comment[data-level="2"] {
+            background-color: rgba(255, 255, 255, 0.022);
+        }
+        .comment[data-level="3"] {
+            background-color: rgba(255, 255, 255, 0.029);
+        }
+        .highlighted {
+            border-left-color: #ff4b4b;
+        }
+        .comment-header {
+            margin-bottom: 1em;
+            padding-bottom: 8px;
+            border-bottom: 1px solid rgba(255, 255, 255, 0.08);
+        }
+        .author-line {
+            display: flex;
+            align-items: center;
+            gap: 8px;
+            margin-bottom: 4px;
+        }
+        .author {
+            color: #fff;
+            font-weight: 500;
+            font-size: 0.95em;
+        }
+        .level-label {
+            color: #888;
+            font-style: italic;
+            font-size: 0.9em;
+        }
+        .metadata {
+            color: #777;
+            font-size: 0.85em;
+        }
+        .comment-body {
+            margin: 0;
+            padding: 5px 0 10px 0;
+            white-space: pre-wrap;
+            font-size: 0.95em;
+            color: rgba(255, 255, 255, 0.9);
+            letter-spacing: 0.2px;
+            word-spacing: 0.5px;
+        }
+        button.expand-button {
+            background: none;
+            border: none;
+            color: #888;
+            cursor: pointer;
+            font-size: 0.85em;
+            padding: 6px 0;
+            margin-top: 8px;
+            font-family: monospace;
+            letter-spacing: 0.5px;
+            opacity: 0.9;
+            margin-left: -3px;
+        }
+    </style>
+"""
+
+VIEWER_JS = """
+    <script>
+    const tree = JSON.parse(document.getElementById('comment-tree').textContent);
+    const highlightPath = JSON.parse(document.getElementById('highlight-path').textContent);
+    const highlighted = highlightPath.length ? highlightPath[highlightPath.length - 1] : -1;
+    const container = document.getElementById('comments');
+    const spacer = document.getElementById('spacer');
+    const INDENT = 52;
+    const OVERSCAN = 6;
+
+    const count = tree.ids.length;
+    const expanded = new Uint8Array(count);
+    const heights = new Float64Array(count);  // measured row heights, 0 = not measured yet
+    for (const index of highlightPath.slice(0, -1)) {
+        expanded[index] = 1;
+    }
+
+    let rows = [];     // comment indexes of the visible (expanded) rows in display order
+    let levels = [];
+    let offsets = [];  // top of each row; offsets[rows.length] is the total height
+
+    function estimate(index) {
+        return 140 + Math.ceil(tree.body[index].length / 110) * 24;
+    }
+
+    function flatten() {
+        rows = [];
+        levels = [];
+        const stack = [];
+        for (let i = tree.roots.length - 1; i >= 0; i--) {
+            stack.push([tree.roots[i], 0]);
+        }
+        while (stack.length) {
+            const [index, level] = stack.pop();
+            rows.push(index);
+            levels.push(level);
+            if (expanded[index]) {
+                const children = [];
+                for (let child = tree.first[index]; child !== -1; child = tree.next[child]) {
+                    children.push(child);
+                }
+                for (let i = children.length - 1; i >= 0; i--) {
+                    stack.push([children[i], level + 1]);
+                }
+            }
+        }
+        layout();
+    }
+
+    function layout() {
+        offsets = new Array(rows.length + 1);
+        let top = 0;
+        for (let i = 0; i < rows.length; i++) {
+            offsets[i] = top;
+            top += heights[rows[i]] || estimate(rows[i]);
+        }
+        offsets[rows.length] = top;
+        spacer.style.height = top + 'px';
+    }
+
+    function firstRowAt(position) {
+        let low = 0, high = rows.length - 1;
+        while (low < high) {
+            const middle = (low + high + 1) >> 1;
+            if (offsets[middle] <= position) low = middle; else high = middle - 1;
+        }
+        return Math.max(0, low);
+    }
+
+    function levelLabel(level) {
+        if (level === 0) return 'Reply to Original Post (Level 1)';
+        if (level === 1) return 'Reply to Original Comment (Level 2)';
+        return 'Level ' + (level + 1) + ' Reply';
+    }
+
+    function rowHtml(position) {
+        const index = rows[position];
+        const level = levels[position];
+        let label = levelLabel(level);
+        if (index === highlighted) label += ' 🔍 (Comment From Search)';
+        const replyCount = tree.replies[index];
+        let button = '';
+        if (replyCount) {
+            button = '<button class="expand-button" data-index="' + index + '">' +
+                (expanded[index] ? '[-] ' : '[+] ') + replyCount +
+                (replyCount === 1 ? ' reply' : ' replies') + '</button>';
+        }
+        return '<div class="comment-row" data-level="' + level + '" data-index="' + index +
+            '" style="top: ' + offsets[position] + 'px">' +
+            '<div class="comment' + (level > 0 ? ' nested-comment' : '') +
+            (index === highlighted ? ' highlighted' : '') + '" data-level="' + level +
+            '" style="margin-left: ' + (level * INDENT) + 'px">' +
+            '<div class="comment-header"><div class="author-line">' +
+            '<span class="author">u/' + tree.names[tree.author[index]] + '</span>' +
+            '<span class="level-label">- ' + label + '</span></div>' +
+            '<div class="metadata">Score: ' + tree.score[index] + ' | Posted on: ' + tree.date[index] + '</div>' +
+            '</div><div class="comment-body">' + tree.body[index] + '</div>' + button +
+            '</div></div>';
+    }
+
+    function render() {
+        if (!rows.length) {
+            spacer.innerHTML = '';
+            return;
+        }
+        const top = container.scrollTop;
+        const bottom = top + container.clientHeight;
+        const first = Math.max(0, firstRowAt(top) - OVERSCAN);
+        let last = firstRowAt(bottom);
+        last = Math.min(rows.length - 1, last + OVERSCAN);
+        let html = '';
+        for (let position = first; position <= last; position++) {
+            html += rowHtml(position);
+        }
+        spacer.innerHTML = html;
+
+        // Replace estimates with real heights; re-layout only if something moved
+        let changed = false;
+        for (const element of spacer.children) {
+            const index = Number(element.dataset.index);
+            const height = element.offsetHeight;
+            if (heights[index] !== height) {
+                heights[index] = height;
+                changed = true;
+            }
+        }
+        if (changed) {
+            layout();
+            let position = first;
+            for (const element of spacer.children) {
+                element.style.top = offsets[position++] + 'px';
+            }
+        }
+    }
+
+    let scheduled = false;
+    container.addEventListener('scroll', () => {
+        if (!scheduled) {
+            scheduled = true;
+            requestAnimationFrame(() => { scheduled = false; render(); });
+        }
+    });
+
+    spacer.addEventListener('click', (event) => {
+        const button = event.target.closest('.expand-button');
+        if (!button) return;
+        const index = Number(button.dataset.index);
+        expanded[index] = expanded[index] ? 0 : 1;
+        flatten();
+        render();
+    });
+
+    flatten();
+    if (highlighted !== -1) {
+        // Render once so the rows above have real heights, then jump to the comment
+        const position = rows.indexOf(highlighted);
+        container.scrollTop = offsets[position];
+        render();
+        container.scrollTop = offsets[position];
+    }
+    render();
+    </script>
+"""
+
+def render_comment_viewer(tree, highlight_path=(), height=800, generation=0):
+    """
+    Show a thread in the virtualized viewer. `tree` comes from tree_json();
+    `highlight_path` is the store indexes from a top-level comment down to
+    the comment to highlight, which is expanded and scrolled into view.
+    Changing `generation` reloads the viewer fully collapsed.
+    """
+    components.html(
+        f"<!-- generation {generation} -->"
+        + VIEWER_CSS
+        + f'<script type="application/json" id="comment-tree">{tree}</script>'
+        + f'<script type="application/json" id="highlight-path">{json.dumps(list(highlight_path))}</script>'
+        + f'<div class="comments-container" id="comments" style="height: {height}px">'
+        + '<div class="comments-spacer" id="spacer"></div></div>'
+        + VIEWER_JS,
+        height=height,
+        scrolling=False
+    )
@@ -1,32 +1,260 @@
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
 import psycopg2
+import psycopg2.errors
 import streamlit as st
 from psycopg2.extras import RealDictCursor
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 
-@st.cache_resource
-def get_database_connection():
-    conn = psycopg2.connect(
+import cache
+import prepared
+import rows
+from admission import FairLimiter, QueryRejected, QueryTimeout
+from replicas import DEFAULT_MAX_LAG_SECONDS, ReplicaSet
+from singleflight import SingleFlight
+
+# Budgets per query class: statement_timeout, concurrent queries, and how
+# long a query may wait for a slot before the page gets DatabaseBusy.
+# Cheap lookups get their own slots, so a storm of searches can't slow them.
+QUERY_CLASSES = {
+    "lookup": {"timeout_ms": 5000, "slots": 8, "queue_seconds": 10},
+    "search": {"timeout_ms": 20000, "slots": 3, "queue_seconds": 15},
+    "admin": {"timeout_ms": 120000, "slots": 2, "queue_seconds": 30},
+    # Exports stream from server-side cursors; the timeout is per fetched chunk
+    "export": {"timeout_ms": 60000, "slots": 2, "queue_seconds": 30},
+}
+
+# Classes that only read and may be served by a replica; admin queries
+# (catalog checks, maintenance progress, DDL) always go to the primary
+REPLICA_CLASSES = {"lookup", "search", "export"}
+
+def _connection_settings():
+    """Settings of the primary"""
+    return dict(
         dbname=st.secrets["postgres"]["dbname"],
         user=st.secrets["postgres"]["user"],
         password=st.secrets["postgres"]["password"],
         host=st.secrets["postgres"]["host"],
         port=st.secrets["postgres"]["port"],
         connect_timeout=10,
-        cursor_factory=RealDictCursor
     )
-    conn.set_session(autocommit=True)
+
+def open_connection(cursor_factory=RealDictCursor, autocommit=True):
+    """Open a new connection that is not shared with the rest of the app"""
+    conn = psycopg2.connect(cursor_factory=cursor_factory, **_connection_settings())
+    conn.set_session(autocommit=autocommit)
     return conn
 
-def execute_query(query, params=None):
-    """Execute a query and return results"""
-    conn = get_database_connection()
-    with conn.cursor() as cur:
+@st.cache_resource
+def get_database_connection():
+    return open_connection()
+
+@st.cache_resource
+def get_replica_set():
+    """
+    Connection pools for the primary and any replicas listed under
+    st.secrets["postgres"]["replicas"], shared by every session of this process.
+    Each pool holds up to one connection per query slot, and its connections
+    keep the hot templates prepared (see prepared.py).
+    """
+    primary = {**_connection_settings(), "connection_factory": prepared.PreparingConnection}
+    replicas = [{**primary, **replica} for replica in st.secrets["postgres"].get("replicas", [])]
+    slots = sum(budget["slots"] for budget in QUERY_CLASSES.values())
+    return ReplicaSet(
+        primary, replicas, slots, RealDictCursor,
+        max_lag=st.secrets["postgres"].get("max_replica_lag_seconds", DEFAULT_MAX_LAG_SECONDS)
+    )
+
+@st.cache_resource
+def get_limiters():
+    return {name: FairLimiter(name, budget["slots"]) for name, budget in QUERY_CLASSES.items()}
+
+def _session_key():
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else threading.current_thread().name
+
+@st.cache_resource
+def get_executor():
+    """Worker threads for execute_queries, at most one per query slot"""
+    slots = sum(budget["slots"] for budget in QUERY_CLASSES.values())
+    return ThreadPoolExecutor(max_workers=slots, thread_name_prefix="query")
+
+@contextmanager
+def _budgeted_connection(query_class, read_only, session=None):
+    """
+    Hold a concurrency slot of query_class and a pooled connection (a replica
+    if read_only and one is healthy) with the class's statement_timeout set
+    """
+    budget = QUERY_CLASSES[query_class]
+    limiter = get_limiters()[query_class]
+    limiter.acquire(session or _session_key(), budget["queue_seconds"])
+    try:
+        nodes = get_replica_set()
+        node = nodes.choose(read_only=read_only and query_class in REPLICA_CLASSES)
+        try:
+            conn = node.pool.getconn()
+        except psycopg2.OperationalError as e:
+            if node is nodes.primary:
+                nodes.done(node)
+                raise
+            # Replica unreachable: take it out of rotation and use the primary
+            nodes.mark_failed(node, e)
+            nodes.done(node)
+            node = nodes.choose(read_only=False)
+            try:
+                conn = node.pool.getconn()
+            except Exception:
+                nodes.done(node)
+                raise
+        broken = False
         try:
-            cur.execute(query, params)
-            results = cur.fetchall()
-            return results
-        except Exception as e:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute("SET statement_timeout = %s", (budget["timeout_ms"],))
+            yield conn
+        except psycopg2.errors.QueryCanceled:
+            raise QueryTimeout(
+                "This query took too long and was stopped. "
+                "Try a narrower date range or more specific search terms."
+            )
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            broken = True
+            nodes.mark_failed(node, e)
+            raise
+        finally:
+            nodes.done(node, conn, broken)
+    finally:
+        limiter.release()
+
+def _run_budgeted(query, params, query_class, fetch=True, session=None, row_format="dict"):
+    """Run one statement within its class's concurrency slot and statement_timeout"""
+    with _budgeted_connection(query_class, read_only=fetch, session=session) as conn:
+        with conn.cursor(cursor_factory=rows.cursor_factory(row_format)) as cur:
+            prepared.execute(cur, query, params)
+            return rows.decode(rows.column_names(cur), cur.fetchall(), row_format) if fetch else None
+
+# Identical concurrent queries from different sessions share one execution
+_flights = SingleFlight()
+
+def _execute_shared(query, params, query_class, session=None, row_format="dict"):
+    return _flights.do(
+        ("execute_query", query, params, query_class, row_format),
+        lambda: _run_budgeted(query, params, query_class, session=session, row_format=row_format)
+    )
+
+def execute_query(query, params=None, query_class="lookup", row_format="dict", report_errors=True):
+    """
+    Execute a query and return results (shared read-only with concurrent
+    identical calls). query_class picks the budget in QUERY_CLASSES,
+    row_format the shape of the rows (see rows.py). With
+    report_errors=False failures are only raised, for callers that handle
+    them quietly or show their own message.
+    """
+    try:
+        return _execute_shared(query, params, query_class, row_format=row_format)
+    except QueryRejected as e:
+        if report_errors:
+            st.warning(str(e))
+        raise e
+    except Exception as e:
+        if report_errors:
             st.error(f"Query execution failed: {str(e)}")
-            raise e
+        raise e
+
+def execute_queries(statements, query_class="lookup", row_format="dict"):
+    """
+    Execute independent (query, params) statements at the same time, each on
+    its own pooled connection, and return their results in the same order.
+    A page that needs several queries waits for the slowest one instead of
+    the sum of all their round trips.
+    """
+    # Resolved here: worker threads have no script run context
+    session = _session_key()
+    get_replica_set()
+    get_limiters()
+    try:
+        futures = [
+            get_executor().submit(_execute_shared, query, params, query_class, session, row_format)
+            for query, params in statements
+        ]
+        return [future.result() for future in futures]
+    except QueryRejected as e:
+        st.warning(str(e))
+        raise e
+    except Exception as e:
+        st.error(f"Query execution failed: {str(e)}")
+        raise e
+
+def execute_cached_query(query, params=None, ttl=600, query_class="lookup", row_format="dict"):
+    """
+    execute_query through the persistent cache shared by all app processes.
+    For queries whose results may be up to ttl seconds stale.
+    """
+    if row_format == "namedtuple":
+        # Row classes are made on the fly and can't be pickled into the cache
+        raise ValueError("execute_cached_query supports dict, tuple and columns rows")
+    parts = ("execute_query", query, params, row_format)
+    try:
+        hit, result = cache.get("query", parts)
+        if hit:
+            return result
+    except Exception:
+        pass
+    result = execute_query(query, params, query_class, row_format)
+    if row_format == "dict":
+        result = [dict(row) for row in result]
+    try:
+        cache.put("query", parts, result, ttl)
+    except Exception:
+        pass
+    return result
+
+def iter_query(query, params=None, chunk_size=2000, query_class="search", row_format="tuple", server_side=False,
+               report_errors=True):
+    """
+    Yield the rows of a large result in lists of up to chunk_size, decoded
+    one chunk at a time with fetchmany. The query's slot and connection are
+    held until the generator is exhausted or closed.
+
+    With server_side the rows come from a named (server-side) cursor, so
+    neither the client nor libpq ever holds more than one chunk; the
+    class's statement_timeout then applies to each fetch.
+
+    report_errors is as for execute_query.
+    """
+    try:
+        with _budgeted_connection(query_class, read_only=True) as conn:
+            if server_side:
+                # Named cursors live inside a transaction
+                conn.autocommit = False
+            try:
+                cursor_name = f"iter_{uuid.uuid4().hex}" if server_side else None
+                with conn.cursor(cursor_name, cursor_factory=rows.cursor_factory(row_format)) as cur:
+                    if server_side:
+                        cur.execute(query, params)
+                    else:
+                        prepared.execute(cur, query, params)
+                    while True:
+                        chunk = cur.fetchmany(chunk_size)
+                        if not chunk:
+                            break
+                        # A named cursor only has a description after its first fetch
+                        yield rows.decode(rows.column_names(cur), chunk, row_format)
+            finally:
+                if server_side and not conn.closed:
+                    conn.rollback()
+                    conn.autocommit = True
+    except QueryRejected as e:
+        if report_errors:
+            st.warning(str(e))
+        raise e
+    except Exception as e:
+        if report_errors:
+            st.error(f"Query execution failed: {str(e)}")
+        raise e
 
 def execute_query_single(query, params=None):
     """Execute a query and return a single result"""
@@ -38,3 +266,14 @@ def execute_query_single(query, params=None):
             except Exception as e:
                 st.error(f"Query execution failed: {str(e)}")
                 raise e
+
+def execute_command(query, params=None, query_class="admin"):
+    """Execute a statement that returns no rows (DDL, maintenance)"""
+    try:
+        _run_budgeted(query, params, query_class, fetch=False)
+    except QueryRejected as e:
+        st.warning(str(e))
+        raise e
+    except Exception as e:
+        st.error(f"Query execution failed: {str(e)}")
+        raise e
@@ -0,0 +1,231 @@
+"""
+Streaming export of search results and user histories
+
+Rows are read through a server-side cursor (database.iter_query with
+server_side=True) a chunk at a time and encoded as they arrive, so memory
+stays bounded by CHUNK_ROWS whether an export has a hundred rows or
+millions. Formats: CSV, JSON Lines and, when the optional pyarrow is
+installed, Parquet (one row group per chunk).
+
+st.download_button holds the whole file in the app's memory, so exports
+made in the app stop at APP_MAX_ROWS rows; larger ones are pointed to the
+command line, which streams to a file or standard output.
+
+Usage:
+    python export.py search "chanel caviar" --kind comments --format jsonl -o caviar.jsonl
+    python export.py search '"wallet on chain"' --search-type post_title
+    python export.py user some_author --format csv > some_author_posts.csv
+
+    display_export("user", "some_author")   # download controls on a page
+"""
+
+import argparse
+import csv
+import io
+import json
+import shlex
+import sys
+from datetime import date
+
+import streamlit as st
+
+from database import iter_query
+from queries import (
+    EXPORT_SEARCH_COMMENTS, EXPORT_SEARCH_POSTS, EXPORT_USER_COMMENTS, EXPORT_USER_POSTS, FACET_POST_EXPRESSIONS,
+    build_date_filter,
+)
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+CHUNK_ROWS = 5000
+
+# Largest export offered as a download in the app
+APP_MAX_ROWS = 100000
+
+# (source, kind) -> query; the source value (search terms or author) is the first parameter
+EXPORT_QUERIES = {
+    ("search", "posts"): EXPORT_SEARCH_POSTS,
+    ("search", "comments"): EXPORT_SEARCH_COMMENTS,
+    ("user", "posts"): EXPORT_USER_POSTS,
+    ("user", "comments"): EXPORT_USER_COMMENTS,
+}
+
+FORMATS = {
+    "csv": {"label": "CSV", "mime": "text/csv"},
+    "jsonl": {"label": "JSON Lines", "mime": "application/x-ndjson"},
+    "parquet": {"label": "Parquet", "mime": "application/vnd.apache.parquet"},
+}
+
+def available_formats():
+    return [name for name in FORMATS if name != "parquet" or pyarrow is not None]
+
+def export_chunks(source, kind, value, start_date=None, end_date=None, chunk_size=CHUNK_ROWS,
+                  search_type="everything", report_errors=True):
+    """
+    Matching rows as {column: [values]} chunks, oldest first. Post searches
+    match the fields of search_type (a FACET_POST_EXPRESSIONS key).
+    """
+    date_filter, date_params = build_date_filter(start_date, end_date)
+    formats = {"date_filter": date_filter}
+    if (source, kind) == ("search", "posts"):
+        formats["fts_expression"] = FACET_POST_EXPRESSIONS[search_type]
+    query = EXPORT_QUERIES[(source, kind)].format(**formats)
+    return iter_query(
+        query, (value, *date_params),
+        chunk_size=chunk_size, query_class="export", row_format="columns", server_side=True,
+        report_errors=report_errors
+    )
+
+def limit_rows(chunks, max_rows, state):
+    """Pass chunks through until more than max_rows rows arrive, then set state["over_limit"]"""
+    seen = 0
+    for chunk in chunks:
+        seen += len(next(iter(chunk.values())))
+        if seen > max_rows:
+            state["over_limit"] = True
+            chunks.close()
+            return
+        yield chunk
+
+def write_csv(chunks, sink):
+    text = io.TextIOWrapper(sink, encoding="utf-8", newline="", write_through=True)
+    writer = csv.writer(text)
+    count = 0
+    try:
+        for chunk in chunks:
+            if not count:
+                writer.writerow(chunk.keys())
+            writer.writerows(zip(*chunk.values()))
+            count += len(next(iter(chunk.values())))
+    finally:
+        # Leave sink open for the caller
+        text.detach()
+    return count
+
+def write_jsonl(chunks, sink):
+    count = 0
+    for chunk in chunks:
+        names = list(chunk)
+        lines = [
+            json.dumps(dict(zip(names, row)), ensure_ascii=False, default=str)
+            for row in zip(*chunk.values())
+        ]
+        sink.write(("\n".join(lines) + "\n").encode("utf-8"))
+        count += len(lines)
+    return count
+
+def write_parquet(chunks, sink):
+    if pyarrow is None:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)")
+    writer = None
+    count = 0
+    try:
+        for chunk in chunks:
+            table = pyarrow.table(chunk)
+            if writer is None:
+                writer = pyarrow.parquet.ParquetWriter(sink, table.schema)
+            # Chunks of all-NULL columns infer a different type than the first chunk
+            writer.write_table(table.cast(writer.schema))
+            count += table.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    return count
+
+WRITERS = {"csv": write_csv, "jsonl": write_jsonl, "parquet": write_parquet}
+
+def export(fmt, chunks, sink):
+    """Encode chunks into the binary file object sink; returns the number of rows"""
+    return WRITERS[fmt](chunks, sink)
+
+def cli_command(fmt, source, kind, value, start_date=None, end_date=None, search_type="everything"):
+    """The export.py command line for an export too large for the app"""
+    args = ["python", "export.py", source, value, "--kind", kind, "--format", fmt]
+    if source == "search" and kind == "posts":
+        args += ["--search-type", search_type]
+    if start_date:
+        args += ["--start", start_date.isoformat()]
+    if end_date:
+        args += ["--end", end_date.isoformat()]
+    args += ["-o", f"{source}_{kind}.{fmt}"]
+    return " ".join(shlex.quote(arg) for arg in args)
+
+def display_export(source, value, start_date=None, end_date=None, kinds=("posts", "comments"),
+                   search_type="everything"):
+    """Export controls: pick what and how, then a download button for the file"""
+    with st.expander("Export all results"):
+        col1, col2 = st.columns(2)
+        with col1:
+            kind = st.selectbox("Export", kinds, format_func=str.title, key=f"export_kind_{source}")
+        with col2:
+            fmt = st.selectbox(
+                "Format", available_formats(),
+                format_func=lambda name: FORMATS[name]["label"],
+                key=f"export_format_{source}"
+            )
+        if not st.button("Prepare export", key=f"export_{source}"):
+            return
+        state = {"over_limit": False}
+        sink = io.BytesIO()
+        try:
+            with st.spinner(f"Exporting {kind}..."):
+                chunks = export_chunks(
+                    source, kind, value, start_date, end_date,
+                    search_type=search_type, report_errors=False
+                )
+                count = export(fmt, limit_rows(chunks, APP_MAX_ROWS, state), sink)
+        except Exception as e:
+            st.error(f"Export failed: {str(e)}")
+            return
+        if state["over_limit"]:
+            st.info(
+                f"More than {APP_MAX_ROWS:,} {kind} match, too many to download here. "
+                f"Export them from the command line instead:"
+            )
+            st.code(cli_command(fmt, source, kind, value, start_date, end_date, search_type), language="bash")
+            return
+        if not count:
+            st.info(f"No {kind} to export")
+            return
+        st.download_button(
+            f"Download {count:,} {kind}",
+            data=sink.getvalue(),
+            file_name=f"{source}_{kind}.{fmt}",
+            mime=FORMATS[fmt]["mime"],
+            key=f"export_download_{source}"
+        )
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export archive posts or comments")
+    parser.add_argument("source", choices=["search", "user"], help="export search matches or a user's history")
+    parser.add_argument("value", help="search terms, or the author name")
+    parser.add_argument("--kind", choices=["posts", "comments"], default="posts")
+    parser.add_argument("--format", choices=sorted(WRITERS), default="csv")
+    parser.add_argument(
+        "--search-type", choices=sorted(FACET_POST_EXPRESSIONS), default="everything",
+        help="fields a post search matches"
+    )
+    parser.add_argument("--start", type=date.fromisoformat, help="first day to include (YYYY-MM-DD)")
+    parser.add_argument("--end", type=date.fromisoformat, help="last day to include (YYYY-MM-DD)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_ROWS, help="rows per fetch")
+    parser.add_argument("-o", "--output", help="output file (default: standard output)")
+    args = parser.parse_args(argv)
+
+    chunks = export_chunks(
+        args.source, args.kind, args.value, args.start, args.end, args.chunk_size, args.search_type
+    )
+    if args.output:
+        with open(args.output, "wb") as sink:
+            count = export(args.format, chunks, sink)
+    else:
+        count = export(args.format, chunks, sys.stdout.buffer)
+        sys.stdout.flush()
+    print(f"Exported {count} {args.kind}", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,564 @@
+"""
+Index advisor for the RepLadies Archive
+
+EXPLAINs every query template in queries.py (for every applicable sort order)
+with representative parameters and looks for sequential scans over large
+tables, sorts over large inputs and text search expressions that no index
+matches. Each problem is mapped to concrete CREATE INDEX DDL together with an
+estimated benefit.
+
+Benefits are measured with hypothetical indexes when the hypopg extension is
+installed (btree only), otherwise they are estimated from the cost of the
+offending plan node.
+
+Usage:
+    from index_advisor import run_advisor
+    findings, proposals = run_advisor(conn, sample_parameters(conn))
+"""
+
+from datetime import date, timedelta
+
+from psycopg2.extras import RealDictCursor
+
+import queries
+from queries import (
+    COMMENT_PATH_ORDERS, COMMENTS_FTS_EXPRESSION, FACET_POST_EXPRESSIONS, POSTS_BODY_FTS_EXPRESSION,
+    POSTS_FTS_EXPRESSION, POSTS_TITLE_FTS_EXPRESSION, SORT_ORDERS,
+)
+from search_terms import prefix_pattern
+
+# Tables smaller than this are cheap to scan and sort, so they are ignored
+LARGE_TABLE_ROWS = 10000
+
+# Expressions used by the exact (LIKE) searches in queries.py
+POSTS_EXACT_EXPRESSION = "LOWER(title || ' ' || COALESCE(selftext, ''))"
+COMMENTS_EXACT_EXPRESSION = "LOWER(body)"
+
+# Candidate indexes for the WHERE clause of each template, keyed by table
+FILTER_INDEXES = {
+    "posts_fts": {
+        "name": "submissions_fts_idx",
+        "table": "submissions",
+        "method": "gin",
+        "columns": [POSTS_FTS_EXPRESSION],
+    },
+    "posts_title_fts": {
+        "name": "submissions_title_fts_idx",
+        "table": "submissions",
+        "method": "gin",
+        "columns": [POSTS_TITLE_FTS_EXPRESSION],
+    },
+    "posts_body_fts": {
+        "name": "submissions_body_fts_idx",
+        "table": "submissions",
+        "method": "gin",
+        "columns": [POSTS_BODY_FTS_EXPRESSION],
+    },
+    "comments_fts": {
+        "name": "comments_fts_idx",
+        "table": "comments",
+        "method": "gin",
+        "columns": [COMMENTS_FTS_EXPRESSION],
+    },
+    "posts_exact": {
+        "name": "submissions_text_trgm_idx",
+        "table": "submissions",
+        "method": "gin",
+        "columns": [f"{POSTS_EXACT_EXPRESSION} gin_trgm_ops"],
+        "extension": "pg_trgm",
+    },
+    "comments_exact": {
+        "name": "comments_body_trgm_idx",
+        "table": "comments",
+        "method": "gin",
+        "columns": [f"{COMMENTS_EXACT_EXPRESSION} gin_trgm_ops"],
+        "extension": "pg_trgm",
+    },
+    "submissions_author": {
+        "name": "submissions_author",
+        "table": "submissions",
+        "method": "btree",
+        "columns": ["author"],
+    },
+    "comments_author": {
+        "name": "comments_author",
+        "table": "comments",
+        "method": "btree",
+        "columns": ["author"],
+    },
+    "comments_submission": {
+        "name": "comments_submission_id",
+        "table": "comments",
+        "method": "btree",
+        "columns": ["submission_id"],
+    },
+    "submissions_author_trgm": {
+        "name": "submissions_author_trgm_idx",
+        "table": "submissions",
+        "method": "gin",
+        "columns": ["author gin_trgm_ops"],
+        "extension": "pg_trgm",
+    },
+    "comments_author_trgm": {
+        "name": "comments_author_trgm_idx",
+        "table": "comments",
+        "method": "gin",
+        "columns": ["author gin_trgm_ops"],
+        "extension": "pg_trgm",
+    },
+}
+
+POST_SORTS = ["most_upvotes", "newest", "oldest", "most_comments"]
+COMMENT_SORTS = ["most_upvotes", "newest", "oldest"]
+
+# How to EXPLAIN each template in queries.py (every one needs an entry, see
+# template_names):
+#   sorts   - SORT_ORDERS keys to try (None if the template has no sort_order)
+#   orders  - mapping of those keys to ORDER BY columns (default SORT_ORDERS)
+#   params  - names of the representative values, in placeholder order (or
+#             the %(name)s placeholders of templates that take a dict)
+#   formats - other {fields} of the template and the values to fill in
+#   filters - FILTER_INDEXES keys for the WHERE clause
+#   equality - True if the filter is an equality lookup, so a btree index on
+#              (filter column, sort column) can serve both filter and sort
+TEMPLATE_SPECS = {
+    "GET_POSTS": {
+        "sorts": POST_SORTS,
+        "params": ("limit", "offset"),
+        "tables": ["submissions"],
+        "filters": [],
+    },
+    "GET_POST_BY_ID": {
+        "sorts": None,
+        "params": ("post_id",),
+        "tables": ["submissions"],
+        "filters": [],
+    },
+    "GET_COMMENTS_FOR_POST": {
+        "sorts": COMMENT_SORTS,
+        "orders": COMMENT_PATH_ORDERS,
+        "params": ("post_id",),
+        "tables": ["comments"],
+        "filters": ["comments_submission"],
+        "equality": True,
+    },
+    "GET_COMMENT_SUBTREE": {
+        "sorts": COMMENT_SORTS,
+        "orders": COMMENT_PATH_ORDERS,
+        "params": ("comment_id", "post_id"),
+        "tables": ["comments"],
+        "filters": ["comments_submission"],
+        "equality": True,
+    },
+    "GET_TOP_THREADS_FOR_POST": {
+        "sorts": COMMENT_SORTS,
+        "orders": COMMENT_PATH_ORDERS,
+        "params": ("post_id", "post_id", "threads"),
+        "tables": ["comments"],
+        "filters": ["comments_submission"],
+        "equality": True,
+    },
+    "GET_COMMENT_CONTEXT": {
+        "sorts": COMMENT_SORTS,
+        "orders": COMMENT_PATH_ORDERS,
+        "params": ("comment_id", "post_id", "siblings", "replies"),
+        "tables": ["comments"],
+        "filters": ["comments_submission"],
+        "equality": True,
+    },
+    "SEARCH_POSTS": {
+        "sorts": POST_SORTS,
+        "params": ("term", "limit", "offset"),
+        "tables": ["submissions"],
+        "filters": ["posts_fts"],
+    },
+    "SEARCH_POSTS_EXACT": {
+        "sorts": POST_SORTS,
+        "params": ("term", "limit", "offset"),
+        "tables": ["submissions"],
+        "filters": ["posts_exact"],
+    },
+    "SEARCH_COMMENTS": {
+        "sorts": COMMENT_SORTS,
+        "params": ("term", "limit", "offset"),
+        "tables": ["comments"],
+        "filters": ["comments_fts"],
+    },
+    "SEARCH_FACETS_POSTS": {
+        "sorts": None,
+        "params": ("term",),
+        "formats": {"fts_expression": FACET_POST_EXPRESSIONS["everything"]},
+        "tables": ["submissions"],
+        "filters": ["posts_fts"],
+    },
+    "SEARCH_FACETS_COMMENTS": {
+        "sorts": None,
+        "params": ("term",),
+        "tables": ["comments"],
+        "filters": ["comments_fts"],
+    },
+    "GET_TERM_HINTS": {
+        "sorts": None,
+        "params": ("words",),
+        "tables": ["search_terms", "stats_daily"],
+        "filters": [],
+    },
+    "SUGGEST_TERMS": {
+        "sorts": None,
+        "params": ("lexeme_pattern", "limit"),
+        "tables": ["search_terms"],
+        "filters": [],
+    },
+    "COUNT_POSTS": {
+        "sorts": None,
+        "params": (),
+        "tables": ["submissions"],
+        "filters": [],
+    },
+    "COUNT_SEARCH_RESULTS": {
+        "sorts": None,
+        "params": ("term", "term"),
+        "tables": ["submissions", "comments"],
+        "filters": ["posts_fts", "comments_fts"],
+    },
+    "GET_DATE_BOUNDS": {
+        "sorts": None,
+        "params": (),
+        "tables": ["submissions", "comments"],
+        "filters": [],
+    },
+    "GET_ARCHIVE_BOUNDS": {
+        "sorts": None,
+        "params": (),
+        "tables": ["archive_bounds"],
+        "filters": [],
+    },
+    "GET_USER_POSTS": {
+        "sorts": POST_SORTS,
+        "params": ("author", "limit"),
+        "tables": ["submissions"],
+        "filters": ["submissions_author"],
+        "equality": True,
+    },
+    "GET_USER_COMMENTS": {
+        "sorts": COMMENT_SORTS,
+        "params": ("author", "limit"),
+        "tables": ["comments"],
+        "filters": ["comments_author"],
+        "equality": True,
+    },
+    "SEARCH_USERS": {
+        "sorts": None,
+        "params": ("author_pattern", "author_pattern"),
+        "tables": ["submissions", "comments"],
+        "filters": ["submissions_author_trgm", "comments_author_trgm"],
+    },
+    "COUNT_SEARCH_RESULTS_EXACT": {
+        "sorts": None,
+        "params": ("term", "term"),
+        "tables": ["submissions", "comments"],
+        "filters": ["posts_exact", "comments_exact"],
+    },
+    "GET_STATS_BOUNDS": {
+        "sorts": None,
+        "params": (),
+        "tables": ["stats_daily"],
+        "filters": [],
+    },
+    "GET_DAILY_STATS": {
+        "sorts": None,
+        "params": ("period", "start", "end"),
+        "tables": ["stats_daily"],
+        "filters": [],
+    },
+    "GET_SCORE_HISTOGRAM": {
+        "sorts": None,
+        "params": ("start", "end"),
+        "tables": ["stats_score_histogram"],
+        "filters": [],
+    },
+    "GET_TOP_THREADS": {
+        "sorts": None,
+        "params": ("start", "end", "limit"),
+        "tables": ["stats_top_threads"],
+        "filters": [],
+    },
+    "GET_AUTHOR_SUMMARY": {
+        "sorts": None,
+        "params": ("author",),
+        "tables": ["author_stats", "author_monthly", "author_threads", "submissions"],
+        "filters": [],
+    },
+    "EXPORT_SEARCH_POSTS": {
+        "sorts": None,
+        "params": ("term",),
+        "formats": {"fts_expression": FACET_POST_EXPRESSIONS["everything"]},
+        "tables": ["submissions"],
+        "filters": ["posts_fts"],
+    },
+    "EXPORT_SEARCH_COMMENTS": {
+        "sorts": None,
+        "params": ("term",),
+        "tables": ["comments"],
+        "filters": ["comments_fts"],
+    },
+    "EXPORT_USER_POSTS": {
+        "sorts": None,
+        "params": ("author",),
+        "tables": ["submissions"],
+        "filters": ["submissions_author"],
+    },
+    "EXPORT_USER_COMMENTS": {
+        "sorts": None,
+        "params": ("author",),
+        "tables": ["comments"],
+        "filters": ["comments_author"],
+    },
+}
+
+def template_names():
+    """
+    Every SQL template in queries.py, in file order. Raises if one has no
+    TEMPLATE_SPECS entry, so a new query can't silently go unchecked.
+    """
+    names = [
+        name for name, value in vars(queries).items()
+        if name.isupper() and isinstance(value, str)
+        and value.lstrip().upper().startswith(("SELECT", "WITH"))
+    ]
+    missing = [name for name in names if name not in TEMPLATE_SPECS]
+    if missing:
+        raise KeyError(f"No TEMPLATE_SPECS entry for {', '.join(missing)} - add one to index_advisor.py")
+    stale = sorted(set(TEMPLATE_SPECS) - set(names))
+    if stale:
+        raise KeyError(f"TEMPLATE_SPECS entries for templates not in queries.py: {', '.join(stale)}")
+    return names
+
+def sample_parameters(conn, term="chanel"):
+    """Pick representative parameter values from the archive itself"""
+    samples = {
+        "term": term,
+        "limit": 20,
+        "offset": 0,
+        "post_id": "",
+        "comment_id": "",
+        "author": "",
+        "siblings": 2,
+        "replies": 5,
+        "threads": 10,
+        "period": "month",
+        "start": date.today() - timedelta(days=365),
+        "end": date.today(),
+    }
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        # The busiest thread is the worst case for the comment queries
+        cur.execute("SELECT id FROM submissions ORDER BY num_comments DESC LIMIT 1")
+        row = cur.fetchone()
+        if row:
+            samples["post_id"] = row["id"]
+
+        # Its deepest comment has the longest ancestor chain
+        cur.execute(
+            "SELECT id FROM comments WHERE submission_id = %s ORDER BY depth DESC LIMIT 1",
+            (samples["post_id"],)
+        )
+        row = cur.fetchone()
+        if row:
+            samples["comment_id"] = row["id"]
+
+        cur.execute("""
+            SELECT author FROM comments TABLESAMPLE SYSTEM (1)
+            WHERE author NOT IN ('[deleted]', 'AutoModerator')
+            LIMIT 1
+        """)
+        row = cur.fetchone()
+        if row:
+            samples["author"] = row["author"]
+    return samples
+
+def _parameters(template, spec, samples):
+    """Sample values for a template: a dict for %(name)s placeholders, else a tuple"""
+    if "%(" in template:
+        return {name: samples[name] for name in spec["params"]}
+    return tuple(samples[name] for name in spec["params"])
+
+def index_ddl(index, sort_column=None):
+    """Build CREATE INDEX DDL for a FILTER_INDEXES entry, optionally with a trailing sort column"""
+    columns = list(index["columns"])
+    name = index["name"]
+    if sort_column:
+        columns.append(sort_column)
+        name += "_" + sort_column.lower().replace(" ", "_")
+    if not name.endswith("_idx"):
+        name += "_idx"
+    return name, (
+        f"CREATE INDEX IF NOT EXISTS {name} "
+        f"ON {index['table']} USING {index['method']} ({', '.join(columns)})"
+    )
+
+def _sort_index(table, sort_column):
+    return index_ddl({
+        "name": table,
+        "table": table,
+        "method": "btree",
+        "columns": [],
+    }, sort_column)
+
+def _walk(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from _walk(child)
+
+def _explain(cur, query, params):
+    cur.execute("EXPLAIN (FORMAT JSON) " + query, params)
+    return cur.fetchone()["QUERY PLAN"][0]["Plan"]
+
+def _table_rows(cur, tables):
+    cur.execute(
+        "SELECT relname, reltuples FROM pg_class WHERE relname = ANY(%s) AND relkind IN ('r', 'p')",
+        (list(tables),)
+    )
+    return {row["relname"]: row["reltuples"] for row in cur.fetchall()}
+
+def _text_search_indexes(cur, table):
+    cur.execute("""
+        SELECT indexname, indexdef FROM pg_indexes
+        WHERE tablename = %s AND (indexdef ILIKE '%%to_tsvector%%' OR indexdef ILIKE '%%trgm%%')
+    """, (table,))
+    return cur.fetchall()
+
+def _hypopg_available(cur):
+    cur.execute("SELECT 1 FROM pg_extension WHERE extname = 'hypopg'")
+    return cur.fetchone() is not None
+
+def _hypothetical_cost(cur, ddl, query, params):
+    """Plan cost with a hypothetical index, or None if hypopg cannot model it"""
+    try:
+        cur.execute("SELECT * FROM hypopg_create_index(%s)", (ddl.replace("IF NOT EXISTS ", ""),))
+        return _explain(cur, query, params)["Total Cost"]
+    except Exception:
+        return None
+    finally:
+        cur.execute("SELECT hypopg_reset()")
+
+def _analyze_plan(plan, spec, table_rows):
+    """Find sequential scans and sorts over large inputs in one plan"""
+    problems = []
+    for node in _walk(plan):
+        node_type = node["Node Type"]
+        relation = node.get("Relation Name")
+        if node_type == "Seq Scan" and relation in spec["tables"]:
+            if table_rows.get(relation, 0) >= LARGE_TABLE_ROWS:
+                problems.append({
+                    "issue": "seq_scan",
+                    "table": relation,
+                    "node_cost": node["Total Cost"],
+                    "detail": node.get("Filter", "full table scan"),
+                })
+        elif node_type in ("Sort", "Incremental Sort"):
+            input_rows = sum(child.get("Plan Rows", 0) for child in node.get("Plans", []))
+            if input_rows >= LARGE_TABLE_ROWS:
+                problems.append({
+                    "issue": "large_sort",
+                    "table": next(
+                        (child.get("Relation Name") for child in _walk(node) if child.get("Relation Name")),
+                        spec["tables"][0]
+                    ),
+                    "node_cost": node["Total Cost"] - sum(child["Total Cost"] for child in node.get("Plans", [])),
+                    "detail": f"Sort of ~{int(input_rows)} rows on {', '.join(node.get('Sort Key', []))}",
+                })
+    return problems
+
+def _candidates(problem, spec, sort_column):
+    """Map a plan problem to candidate (name, ddl, extension) tuples"""
+    table = problem["table"]
+    filters = [FILTER_INDEXES[key] for key in spec["filters"] if FILTER_INDEXES[key]["table"] == table]
+
+    if spec.get("equality"):
+        # A btree on (lookup column, sort column) serves both the WHERE and the ORDER BY
+        return [index_ddl(index, sort_column) + (index.get("extension"),) for index in filters]
+    if problem["issue"] == "seq_scan":
+        return [index_ddl(index) + (index.get("extension"),) for index in filters]
+    if problem["issue"] == "large_sort" and not filters and sort_column:
+        return [_sort_index(table, sort_column) + (None,)]
+    return []
+
+def run_advisor(conn, samples):
+    """
+    EXPLAIN every template with every applicable sort order.
+    Returns (findings, proposals): findings is a list of detected problems,
+    proposals maps index name to the proposed DDL and its estimated benefit.
+    """
+    names = template_names()
+    findings = []
+    proposals = {}
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        use_hypopg = _hypopg_available(cur)
+        all_tables = {table for spec in TEMPLATE_SPECS.values() for table in spec["tables"]}
+        table_rows = _table_rows(cur, all_tables)
+        samples = dict(
+            samples,
+            author_pattern=f"%{samples.get('author', '')}%",
+            words=[samples["term"]],
+            lexeme_pattern=prefix_pattern(samples["term"][:3]),
+        )
+
+        for template_name in names:
+            spec = TEMPLATE_SPECS[template_name]
+            template = getattr(queries, template_name)
+            params = _parameters(template, spec, samples)
+            for sort in spec["sorts"] or [None]:
+                sort_column = spec.get("orders", SORT_ORDERS)[sort] if sort else None
+                query = template.format(sort_order=sort_column or "", date_filter="", **spec.get("formats", {}))
+                label = f"{template_name} ({sort})" if sort else template_name
+                try:
+                    plan = _explain(cur, query, params)
+                except Exception as e:
+                    findings.append({"template": label, "issue": "error", "table": "", "detail": str(e)})
+                    continue
+
+                for problem in _analyze_plan(plan, spec, table_rows):
+                    detail = problem["detail"]
+                    if problem["issue"] == "seq_scan" and any(
+                        FILTER_INDEXES[key]["method"] == "gin" for key in spec["filters"]
+                    ):
+                        # The planner ignored every text search index on this table,
+                        # so any that exist were built on a different expression
+                        mismatched = _text_search_indexes(cur, problem["table"])
+                        if mismatched:
+                            problem["issue"] = "mismatched_expression_index"
+                            detail += " | unusable indexes: " + ", ".join(
+                                row["indexname"] for row in mismatched
+                            )
+                    findings.append({
+                        "template": label,
+                        "issue": problem["issue"],
+                        "table": problem["table"],
+                        "detail": detail,
+                    })
+
+                    for name, ddl, extension in _candidates(problem, spec, sort_column):
+                        before = plan["Total Cost"]
+                        after = None
+                        if use_hypopg:
+                            after = _hypothetical_cost(cur, ddl, query, params)
+                        estimate = "hypopg" if after is not None else "upper bound"
+                        if after is None:
+                            after = max(before - problem["node_cost"], 0)
+                        benefit = round(100.0 * (before - after) / before, 1) if before else 0.0
+
+                        proposal = proposals.setdefault(name, {
+                            "index": name,
+                            "ddl": ddl,
+                            "extension": extension,
+                            "templates": [],
+                            "benefit_pct": 0.0,
+                            "estimate": estimate,
+                        })
+                        proposal["templates"].append(label)
+                        if benefit > proposal["benefit_pct"]:
+                            proposal["benefit_pct"] = benefit
+                            proposal["estimate"] = estimate
+
+    ranked = dict(sorted(proposals.items(), key=lambda item: -item[1]["benefit_pct"]))
+    return findings, ranked
@@ -0,0 +1,688 @@
+"""
+Bulk ingest of Reddit dump files for the RepLadies Archive
+
+Streams Pushshift-style NDJSON dumps (.zst, .gz, .bz2, .xz or plain) line by
+line, parses and binary-encodes records in a process pool and writes them
+with COPY ... (FORMAT binary) in large batches. Memory stays bounded by the
+number of batches in flight, whatever the size of the dump.
+
+During a bulk load secondary indexes are dropped (their definitions are kept
+in ingest_deferred_indexes so an interrupted load can be finished with
+`rebuild`) and user triggers are disabled; both are restored once the data
+is in. Tables with a search_vector column are loaded through a temporary
+staging table, so each row is written once with its vector computed instead
+of being rewritten by an UPDATE afterwards.
+
+Incremental loads merge new and edited records into a loaded archive. Each
+batch is copied into a temporary staging table and upserted with
+INSERT ... ON CONFLICT, refreshing the mutable fields and search_vector of
+rows that changed. Derived tables (DERIVED_TABLES) and the per-table
+watermark in ingest_watermarks are updated in the same transaction. Records
+older than the watermark minus a refresh window are skipped while parsing,
+so the work done is proportional to the delta, not the archive.
+
+Usage:
+    python ingest.py bulk submissions RS_2023-01.zst --subreddit RepLadies
+    python ingest.py bulk comments RC_2023-01.zst RC_2023-02.zst --workers 8
+    python ingest.py incremental comments RC_2024-10-18.zst --refresh-days 7
+    python ingest.py rebuild
+"""
+
+import argparse
+import bz2
+import collections
+import gzip
+import io
+import lzma
+import os
+import struct
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import psycopg2
+
+from author_stats import SCHEMA as AUTHOR_STATS_SCHEMA, rebuild_author_stats, refresh_author_stats
+from comment_paths import SCHEMA as COMMENT_PATHS_SCHEMA, rebuild_comment_paths, refresh_comment_paths
+from partitions import ensure_partitions, is_partitioned
+from queries import COMMENTS_FTS_EXPRESSION, POSTS_FTS_EXPRESSION
+from search_terms import SCHEMA as SEARCH_TERMS_SCHEMA, rebuild_search_terms, refresh_search_terms
+from stats import SCHEMA as STATS_SCHEMA, rebuild_stats, refresh_stats
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    import json
+    _loads = json.loads
+
+# Columns written by COPY, in order. search_vector is derived while inserting.
+# Mutable columns are the ones an incremental load refreshes on existing rows.
+TABLES = {
+    "submissions": {
+        "columns": ["id", "author", "title", "selftext", "created_utc", "score", "num_comments"],
+        "mutable": ["author", "selftext", "score", "num_comments"],
+        "search_vector": POSTS_FTS_EXPRESSION,
+    },
+    "comments": {
+        "columns": ["id", "submission_id", "parent_id", "body", "author", "created_utc", "score"],
+        "mutable": ["author", "body", "score"],
+        "search_vector": COMMENTS_FTS_EXPRESSION,
+    },
+}
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS submissions (
+        id text PRIMARY KEY,
+        author text,
+        title text,
+        selftext text,
+        created_utc bigint NOT NULL,
+        score integer,
+        num_comments integer,
+        search_vector tsvector
+    );
+
+    CREATE TABLE IF NOT EXISTS comments (
+        id text PRIMARY KEY,
+        submission_id text NOT NULL,
+        parent_id text,
+        body text,
+        author text,
+        created_utc bigint NOT NULL,
+        score integer,
+        search_vector tsvector
+    );
+
+    CREATE TABLE IF NOT EXISTS ingest_deferred_indexes (
+        index_name text PRIMARY KEY,
+        table_name text NOT NULL,
+        definition text NOT NULL,
+        deferred_at timestamptz NOT NULL DEFAULT now()
+    );
+
+    CREATE TABLE IF NOT EXISTS ingest_watermarks (
+        table_name text PRIMARY KEY,
+        created_utc bigint NOT NULL,
+        last_id text,
+        updated_at timestamptz NOT NULL DEFAULT now()
+    );
+
+    CREATE TABLE IF NOT EXISTS ingest_runs (
+        id bigserial PRIMARY KEY,
+        table_name text NOT NULL,
+        mode text NOT NULL,
+        started_at timestamptz NOT NULL,
+        seconds double precision NOT NULL,
+        rows_read bigint NOT NULL,
+        inserted bigint NOT NULL,
+        updated bigint NOT NULL,
+        skipped bigint NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS archive_bounds (
+        table_name text PRIMARY KEY,
+        min_utc bigint NOT NULL,
+        max_utc bigint NOT NULL
+    );
+"""
+
+COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+COPY_TRAILER = struct.pack("!h", -1)
+
+DEFAULT_BATCH_LINES = 50000
+
+# Binary COPY encoders by PostgreSQL type name: (struct code, Python cast)
+_FIXED_WIDTH = {
+    "int2": ("h", int),
+    "int4": ("i", int),
+    "int8": ("q", int),
+    "float4": ("f", float),
+    "float8": ("d", float),
+}
+_NULL = struct.pack("!i", -1)
+_LENGTH = struct.Struct("!i").pack
+
+def _encoder(type_name):
+    """Build a value -> COPY field bytes function for one column type"""
+    if type_name in _FIXED_WIDTH:
+        code, cast = _FIXED_WIDTH[type_name]
+        packer = struct.Struct("!i" + code)
+        pack, size = packer.pack, packer.size - 4
+        return lambda value: _NULL if value is None else pack(size, cast(value))
+    if type_name in ("text", "varchar", "bpchar", "name"):
+        def encode_text(value):
+            if value is None:
+                return _NULL
+            data = str(value).replace("\x00", "").encode("utf-8")
+            return _LENGTH(len(data)) + data
+        return encode_text
+    if type_name == "bool":
+        return lambda value: _NULL if value is None else b"\x00\x00\x00\x01" + (b"\x01" if value else b"\x00")
+    raise ValueError(f"No binary COPY encoder for column type {type_name}")
+
+def _strip_prefix(fullname):
+    """'t3_abc123' -> 'abc123' (ids in the archive carry no type prefix)"""
+    if fullname and len(fullname) > 3 and fullname[2] == "_":
+        return fullname[3:]
+    return fullname
+
+def _int(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+def extract_record(kind, record):
+    """Map one dump record to a tuple in TABLES[kind]['columns'] order"""
+    if kind == "submissions":
+        return (
+            record.get("id"),
+            record.get("author"),
+            record.get("title") or "",
+            record.get("selftext") or "",
+            _int(record.get("created_utc")),
+            _int(record.get("score")),
+            _int(record.get("num_comments")),
+        )
+    return (
+        record.get("id"),
+        _strip_prefix(record.get("link_id")),
+        _strip_prefix(record.get("parent_id")),
+        record.get("body") or "",
+        record.get("author"),
+        _int(record.get("created_utc")),
+        _int(record.get("score")),
+    )
+
+def parse_batch(kind, lines, type_names, subreddit=None, min_created_utc=None):
+    """
+    Parse NDJSON lines and encode them as binary COPY tuples.
+    Records created before min_created_utc are skipped.
+    Runs in worker processes. Returns (payload, rows, skipped, min_utc, max_utc).
+    """
+    encoders = [_encoder(type_name) for type_name in type_names]
+    field_count = struct.pack("!h", len(encoders))
+    created_index = TABLES[kind]["columns"].index("created_utc")
+    subreddit = subreddit.lower() if subreddit else None
+
+    chunks = []
+    rows = skipped = 0
+    min_utc = max_utc = None
+    for line in lines:
+        try:
+            record = _loads(line)
+        except ValueError:
+            skipped += 1
+            continue
+        if subreddit and (record.get("subreddit") or "").lower() != subreddit:
+            skipped += 1
+            continue
+        values = extract_record(kind, record)
+        created_utc = values[created_index]
+        if not values[0] or created_utc is None:
+            skipped += 1
+            continue
+        if min_created_utc is not None and created_utc < min_created_utc:
+            skipped += 1
+            continue
+
+        chunks.append(field_count)
+        chunks.extend(encode(value) for encode, value in zip(encoders, values))
+        rows += 1
+        min_utc = created_utc if min_utc is None else min(min_utc, created_utc)
+        max_utc = created_utc if max_utc is None else max(max_utc, created_utc)
+    return b"".join(chunks), rows, skipped, min_utc, max_utc
+
+def open_dump(path):
+    """Open a (possibly compressed) NDJSON dump as a stream of text lines"""
+    if path.endswith(".zst"):
+        import zstandard
+        # Pushshift dumps are compressed with a long window
+        reader = zstandard.ZstdDecompressor(max_window_size=2**31).stream_reader(open(path, "rb"))
+        return io.TextIOWrapper(reader, encoding="utf-8", errors="replace")
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rt", encoding="utf-8", errors="replace")
+    if path.endswith(".xz"):
+        return lzma.open(path, "rt", encoding="utf-8", errors="replace")
+    return open(path, "rt", encoding="utf-8", errors="replace")
+
+def read_batches(paths, batch_lines):
+    """Yield lists of at most batch_lines non-empty lines across all dump files"""
+    batch = []
+    for path in paths:
+        with open_dump(path) as lines:
+            for line in lines:
+                if line.strip():
+                    batch.append(line)
+                    if len(batch) >= batch_lines:
+                        yield batch
+                        batch = []
+    if batch:
+        yield batch
+
+def column_types(cur, table, columns):
+    """PostgreSQL type names of the given columns, in order"""
+    cur.execute("""
+        SELECT a.attname, t.typname
+        FROM pg_attribute a
+        JOIN pg_type t ON t.oid = a.atttypid
+        WHERE a.attrelid = %s::regclass AND a.attname = ANY(%s) AND NOT a.attisdropped
+    """, (table, columns))
+    types = dict(cur.fetchall())
+    missing = [column for column in columns if column not in types]
+    if missing:
+        raise ValueError(f"{table} is missing columns: {', '.join(missing)}")
+    return [types[column] for column in columns]
+
+def copy_payload(cur, table, columns, payload):
+    """Write binary-encoded tuples to a table with one COPY"""
+    cur.copy_expert(
+        f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT binary)",
+        io.BytesIO(COPY_HEADER + payload + COPY_TRAILER)
+    )
+
+def parsed_batches(kind, paths, type_names, workers, batch_lines, subreddit=None, min_created_utc=None):
+    """
+    Parse dump files in a process pool, yielding results in input order.
+    At most 2 * workers batches are in flight, which bounds memory use.
+    """
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = collections.deque()
+        for lines in read_batches(paths, batch_lines):
+            pending.append(pool.submit(parse_batch, kind, lines, type_names, subreddit, min_created_utc))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def has_derived_search_vector(cur, table):
+    """True if the table has a search_vector column that ingest must fill itself"""
+    cur.execute("""
+        SELECT attgenerated FROM pg_attribute
+        WHERE attrelid = %s::regclass AND attname = 'search_vector' AND NOT attisdropped
+    """, (table,))
+    row = cur.fetchone()
+    # Generated columns are computed by PostgreSQL on insert
+    return row is not None and not row[0]
+
+def defer_indexes(cur, table):
+    """Drop secondary indexes, remembering their definitions in ingest_deferred_indexes"""
+    cur.execute("""
+        SELECT c.relname, pg_get_indexdef(i.indexrelid)
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE i.indrelid = %s::regclass
+            AND NOT i.indisprimary
+            AND NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conindid = i.indexrelid)
+    """, (table,))
+    deferred = cur.fetchall()
+    for index_name, definition in deferred:
+        cur.execute("""
+            INSERT INTO ingest_deferred_indexes (index_name, table_name, definition)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (index_name) DO NOTHING
+        """, (index_name, table, definition))
+        cur.execute(f'DROP INDEX IF EXISTS "{index_name}"')
+    return [index_name for index_name, _ in deferred]
+
+def rebuild_indexes(conn, table=None, maintenance_work_mem="1GB"):
+    """Recreate indexes dropped by defer_indexes"""
+    with conn.cursor() as cur:
+        cur.execute("SET maintenance_work_mem = %s", (maintenance_work_mem,))
+        cur.execute("""
+            SELECT index_name, definition FROM ingest_deferred_indexes
+            WHERE %s::text IS NULL OR table_name = %s
+            ORDER BY deferred_at
+        """, (table, table))
+        deferred = cur.fetchall()
+    conn.commit()
+
+    for index_name, definition in deferred:
+        started = time.time()
+        with conn.cursor() as cur:
+            # Definitions from partitioned parents read "ON ONLY", which would skip the partitions
+            definition = definition.replace(" ON ONLY ", " ON ", 1)
+            cur.execute(definition.replace(" INDEX ", " INDEX IF NOT EXISTS ", 1))
+            cur.execute("DELETE FROM ingest_deferred_indexes WHERE index_name = %s", (index_name,))
+        conn.commit()
+        print(f"Rebuilt index {index_name} in {time.time() - started:.1f}s")
+
+def primary_key(cur, table):
+    """Primary key columns of a table, in key order"""
+    cur.execute("""
+        SELECT a.attname
+        FROM pg_index i
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+        WHERE i.indrelid = %s::regclass AND i.indisprimary
+        ORDER BY array_position(i.indkey, a.attnum)
+    """, (table,))
+    return [row[0] for row in cur.fetchall()]
+
+def get_watermark(cur, table):
+    """(created_utc, id) of the newest record loaded into a table, or None"""
+    cur.execute("SELECT created_utc, last_id FROM ingest_watermarks WHERE table_name = %s", (table,))
+    return cur.fetchone()
+
+def advance_watermark(cur, table, source="ingest_changed"):
+    """Move the watermark forward to the newest record in source, never backwards"""
+    cur.execute(f"""
+        INSERT INTO ingest_watermarks (table_name, created_utc, last_id)
+        SELECT %s, created_utc, id FROM {source}
+        ORDER BY created_utc DESC, id DESC
+        LIMIT 1
+        ON CONFLICT (table_name) DO UPDATE
+        SET created_utc = EXCLUDED.created_utc, last_id = EXCLUDED.last_id, updated_at = now()
+        WHERE (EXCLUDED.created_utc, EXCLUDED.last_id)
+            > (ingest_watermarks.created_utc, COALESCE(ingest_watermarks.last_id, ''))
+    """, (table,))
+
+def refresh_date_bounds(cur, table):
+    """Widen archive_bounds with the rows changed by the current batch"""
+    cur.execute("""
+        INSERT INTO archive_bounds (table_name, min_utc, max_utc)
+        SELECT %s, MIN(created_utc), MAX(created_utc) FROM ingest_changed
+        HAVING COUNT(*) > 0
+        ON CONFLICT (table_name) DO UPDATE
+        SET min_utc = LEAST(archive_bounds.min_utc, EXCLUDED.min_utc),
+            max_utc = GREATEST(archive_bounds.max_utc, EXCLUDED.max_utc)
+    """, (table,))
+
+def rebuild_date_bounds(cur, table):
+    """Recompute archive_bounds for a whole table"""
+    cur.execute(f"""
+        INSERT INTO archive_bounds (table_name, min_utc, max_utc)
+        SELECT %s, MIN(created_utc), MAX(created_utc) FROM {table}
+        HAVING COUNT(*) > 0
+        ON CONFLICT (table_name) DO UPDATE
+        SET min_utc = EXCLUDED.min_utc, max_utc = EXCLUDED.max_utc
+    """, (table,))
+
+# Tables derived from submissions/comments. refresh(cur, table) runs inside each
+# incremental batch's transaction and sees the batch's rows in the temporary
+# table ingest_changed (id, created_utc, inserted, previous_author and
+# previous_vector - the author and search_vector before an update, NULL for
+# inserts); rebuild(cur, table) recomputes everything after a bulk load.
+DERIVED_TABLES = [
+    {"name": "archive_bounds", "refresh": refresh_date_bounds, "rebuild": rebuild_date_bounds},
+    {
+        "name": "comment_paths",
+        "schema": COMMENT_PATHS_SCHEMA,
+        "refresh": refresh_comment_paths,
+        "rebuild": rebuild_comment_paths,
+    },
+    {"name": "stats", "schema": STATS_SCHEMA, "refresh": refresh_stats, "rebuild": rebuild_stats},
+    {
+        "name": "author_stats",
+        "schema": AUTHOR_STATS_SCHEMA,
+        "refresh": refresh_author_stats,
+        "rebuild": rebuild_author_stats,
+    },
+    {
+        "name": "search_terms",
+        "schema": SEARCH_TERMS_SCHEMA,
+        "refresh": refresh_search_terms,
+        "rebuild": rebuild_search_terms,
+    },
+]
+
+def ensure_schema(cur):
+    """Create the archive tables and the columns/tables every derived table needs"""
+    cur.execute(SCHEMA)
+    for derived in DERIVED_TABLES:
+        if derived.get("schema"):
+            cur.execute(derived["schema"])
+
+def record_run(cur, table, mode, started, rows_read, inserted, updated, skipped):
+    """Store throughput metrics for one ingest run"""
+    cur.execute("""
+        INSERT INTO ingest_runs
+            (table_name, mode, started_at, seconds, rows_read, inserted, updated, skipped)
+        VALUES (%s, %s, to_timestamp(%s), %s, %s, %s, %s, %s)
+    """, (table, mode, started, time.time() - started, rows_read, inserted, updated, skipped))
+
+def _upsert_sql(table, columns, mutable, key, search_vector):
+    """INSERT ... ON CONFLICT from the staging table, recording changed rows in ingest_changed"""
+    stage = f"ingest_stage_{table}"
+    insert_columns = columns + (["search_vector"] if search_vector else [])
+    select_columns = columns + ([search_vector] if search_vector else [])
+    updates = [f"{column} = EXCLUDED.{column}" for column in mutable]
+    if search_vector:
+        updates.append("search_vector = EXCLUDED.search_vector")
+    key_list = ", ".join(key)
+    # DISTINCT ON keeps the last copy of a record that appears twice in a batch
+    # (ON CONFLICT cannot touch the same row twice). xmax = 0 marks fresh inserts.
+    # previous reads the rows as they were before this statement, so refreshers
+    # can tell when a mutable column such as author (or the text) changed.
+    join_key = " AND ".join(f"t.{column} = s.{column}" for column in key)
+    return f"""
+        WITH previous AS (
+            SELECT DISTINCT t.id, t.created_utc, t.author, t.search_vector
+            FROM {table} t
+            JOIN {stage} s ON {join_key}
+        ), upserted AS (
+            INSERT INTO {table} ({', '.join(insert_columns)})
+            SELECT DISTINCT ON ({key_list}) {', '.join(select_columns)}
+            FROM {stage}
+            ORDER BY {key_list}, ctid DESC
+            ON CONFLICT ({key_list}) DO UPDATE
+            SET {', '.join(updates)}
+            WHERE ({', '.join(f'{table}.{column}' for column in mutable)})
+                IS DISTINCT FROM ({', '.join(f'EXCLUDED.{column}' for column in mutable)})
+            RETURNING id, created_utc, (xmax = 0) AS inserted
+        )
+        INSERT INTO ingest_changed (id, created_utc, inserted, previous_author, previous_vector)
+        SELECT u.id, u.created_utc, u.inserted, p.author, p.search_vector
+        FROM upserted u
+        LEFT JOIN previous p ON p.id = u.id AND p.created_utc = u.created_utc
+    """
+
+def incremental_load(conn, kind, paths, workers=None, batch_lines=DEFAULT_BATCH_LINES,
+                     subreddit=None, refresh_days=7):
+    """
+    Merge new and edited records into a loaded table.
+    Records older than the watermark minus refresh_days are skipped.
+    """
+    table = kind
+    columns = TABLES[kind]["columns"]
+    mutable = TABLES[kind]["mutable"]
+    workers = workers or os.cpu_count() or 2
+
+    with conn.cursor() as cur:
+        ensure_schema(cur)
+        type_names = column_types(cur, table, columns)
+        key = primary_key(cur, table)
+        search_vector = TABLES[kind]["search_vector"] if has_derived_search_vector(cur, table) else None
+        watermark = get_watermark(cur, table)
+        partitioned = is_partitioned(cur, table)
+        cur.execute(f"""
+            CREATE TEMP TABLE IF NOT EXISTS ingest_stage_{table}
+            (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS
+        """)
+        cur.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS ingest_changed
+            (id text, created_utc bigint, inserted boolean, previous_author text, previous_vector tsvector)
+            ON COMMIT DELETE ROWS
+        """)
+    conn.commit()
+    upsert = _upsert_sql(table, columns, mutable, key, search_vector)
+
+    min_created_utc = None
+    if watermark:
+        min_created_utc = watermark[0] - refresh_days * 86400
+        print(f"{table}: watermark {time.strftime('%Y-%m-%d %H:%M', time.gmtime(watermark[0]))} "
+              f"(id {watermark[1]}), refreshing from {time.strftime('%Y-%m-%d', time.gmtime(min_created_utc))}")
+
+    started = time.time()
+    rows_read = inserted = updated = skipped = 0
+    for payload, rows, batch_skipped, batch_min, batch_max in parsed_batches(
+        kind, paths, type_names, workers, batch_lines, subreddit, min_created_utc
+    ):
+        skipped += batch_skipped
+        if not rows:
+            continue
+        batch_started = time.time()
+        with conn.cursor() as cur:
+            if partitioned:
+                ensure_partitions(cur, table, batch_min, batch_max)
+            copy_payload(cur, f"ingest_stage_{table}", columns, payload)
+            cur.execute(upsert)
+            cur.execute("SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM ingest_changed")
+            batch_inserted, batch_updated = cur.fetchone()
+            for derived in DERIVED_TABLES:
+                derived["refresh"](cur, table)
+            advance_watermark(cur, table)
+        conn.commit()
+
+        rows_read += rows
+        inserted += batch_inserted
+        updated += batch_updated
+        seconds = time.time() - batch_started
+        print(f"{table}: batch of {rows} in {seconds:.2f}s ({rows / max(seconds, 1e-9):,.0f} rows/s): "
+              f"{batch_inserted} new, {batch_updated} updated, {rows - batch_inserted - batch_updated} unchanged")
+
+    with conn.cursor() as cur:
+        record_run(cur, table, "incremental", started, rows_read, inserted, updated, skipped)
+    conn.commit()
+
+    elapsed = time.time() - started
+    print(f"Merged {rows_read} {table} in {elapsed:.1f}s ({rows_read / max(elapsed, 1e-9):,.0f} rows/s): "
+          f"{inserted} new, {updated} updated, {skipped} skipped")
+    return inserted, updated
+
+def bulk_load(conn, kind, paths, workers=None, batch_lines=DEFAULT_BATCH_LINES,
+              subreddit=None, keep_indexes=False):
+    """Load dump files into an archive table with binary COPY"""
+    table = kind
+    columns = TABLES[kind]["columns"]
+    workers = workers or os.cpu_count() or 2
+
+    with conn.cursor() as cur:
+        ensure_schema(cur)
+        type_names = column_types(cur, table, columns)
+        fill_vectors = has_derived_search_vector(cur, table)
+        partitioned = is_partitioned(cur, table)
+        deferred = [] if keep_indexes else defer_indexes(cur, table)
+        cur.execute(f"ALTER TABLE {table} DISABLE TRIGGER USER")
+        if fill_vectors:
+            # Temp tables write no WAL; rows reach the table once, vector included
+            cur.execute(f"""
+                CREATE TEMP TABLE IF NOT EXISTS ingest_stage_{table}
+                (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS
+            """)
+    conn.commit()
+    column_list = ", ".join(columns)
+    insert_vectors = f"""
+        INSERT INTO {table} ({column_list}, search_vector)
+        SELECT {column_list}, {TABLES[kind]["search_vector"]} FROM ingest_stage_{table}
+    """
+    if deferred:
+        print(f"Deferred indexes on {table}: {', '.join(deferred)}")
+
+    started = time.time()
+    total_rows = total_skipped = 0
+    try:
+        for payload, rows, skipped, batch_min, batch_max in parsed_batches(
+            kind, paths, type_names, workers, batch_lines, subreddit
+        ):
+            total_skipped += skipped
+            if not rows:
+                continue
+            with conn.cursor() as cur:
+                if partitioned:
+                    ensure_partitions(cur, table, batch_min, batch_max)
+                if fill_vectors:
+                    copy_payload(cur, f"ingest_stage_{table}", columns, payload)
+                    cur.execute(insert_vectors)
+                else:
+                    copy_payload(cur, table, columns, payload)
+            conn.commit()
+
+            total_rows += rows
+            elapsed = time.time() - started
+            print(f"{table}: {total_rows} rows ({total_rows / elapsed:,.0f} rows/s), {total_skipped} skipped")
+    finally:
+        conn.rollback()
+        with conn.cursor() as cur:
+            cur.execute(f"ALTER TABLE {table} ENABLE TRIGGER USER")
+        conn.commit()
+
+    rebuild_indexes(conn, table)
+
+    with conn.cursor() as cur:
+        for derived in DERIVED_TABLES:
+            derived["rebuild"](cur, table)
+        advance_watermark(cur, table, source=f"(SELECT id, created_utc FROM {table}) loaded")
+        record_run(cur, table, "bulk", started, total_rows, total_rows, 0, total_skipped)
+    conn.commit()
+
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f"VACUUM (ANALYZE) {table}")
+    conn.autocommit = False
+
+    elapsed = time.time() - started
+    print(f"Loaded {total_rows} {table} in {elapsed:.1f}s ({total_rows / max(elapsed, 1e-9):,.0f} rows/s)")
+    return total_rows
+
+def connect(dsn=None):
+    """Connection for command line use: an explicit DSN, or the app's secrets"""
+    if dsn:
+        return psycopg2.connect(dsn)
+    from database import open_connection
+    return open_connection(cursor_factory=None, autocommit=False)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load Reddit dumps into the archive")
+    parser.add_argument("--dsn", help="libpq connection string (defaults to .streamlit/secrets.toml)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    bulk = commands.add_parser("bulk", help="initial load with COPY and deferred indexes")
+    bulk.add_argument("kind", choices=sorted(TABLES))
+    bulk.add_argument("paths", nargs="+")
+    bulk.add_argument("--subreddit", help="only load records from this subreddit")
+    bulk.add_argument("--workers", type=int, help="parser processes (default: CPU count)")
+    bulk.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_LINES, help="lines per COPY batch")
+    bulk.add_argument("--keep-indexes", action="store_true", help="do not drop secondary indexes")
+
+    incremental = commands.add_parser("incremental", help="merge new and edited records into a loaded archive")
+    incremental.add_argument("kind", choices=sorted(TABLES))
+    incremental.add_argument("paths", nargs="+")
+    incremental.add_argument("--subreddit", help="only load records from this subreddit")
+    incremental.add_argument("--workers", type=int, help="parser processes (default: CPU count)")
+    incremental.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_LINES, help="lines per upsert batch")
+    incremental.add_argument("--refresh-days", type=int, default=7,
+                             help="re-merge records this many days older than the watermark")
+
+    rebuild = commands.add_parser("rebuild", help="recreate indexes deferred by an interrupted load")
+    rebuild.add_argument("table", nargs="?", choices=sorted(TABLES))
+
+    args = parser.parse_args(argv)
+    conn = connect(args.dsn)
+    try:
+        if args.command == "bulk":
+            bulk_load(
+                conn, args.kind, args.paths,
+                workers=args.workers,
+                batch_lines=args.batch_size,
+                subreddit=args.subreddit,
+                keep_indexes=args.keep_indexes
+            )
+        elif args.command == "incremental":
+            incremental_load(
+                conn, args.kind, args.paths,
+                workers=args.workers,
+                batch_lines=args.batch_size,
+                subreddit=args.subreddit,
+                refresh_days=args.refresh_days
+            )
+        elif args.command == "rebuild":
+            rebuild_indexes(conn, args.table)
+    finally:
+        conn.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
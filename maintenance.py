@@ -0,0 +1,278 @@
+"""
+Background maintenance jobs for the RepLadies Archive
+
+Index builds and other maintenance DDL run on a worker thread with their own
+database connection, so they neither block the admin's script run nor tie up
+the connection shared by every page. CREATE/DROP/REINDEX statements are
+rewritten to their CONCURRENTLY forms so writes keep flowing during a build.
+
+PostgreSQL can't build or drop an index on a partitioned table (see
+partitions.py) concurrently. Such a CREATE INDEX becomes an index ON ONLY
+the parent, one concurrent build per partition and an ATTACH PARTITION for
+each, after which the parent index is valid; a partitioned index is dropped
+without CONCURRENTLY.
+
+Usage:
+    from maintenance import get_job_runner
+    job = get_job_runner().submit("Text search indexes", [ddl])
+    job.progress()   # row from pg_stat_progress_create_index, or None
+    job.cancel()
+"""
+
+import queue
+import re
+import threading
+import time
+import uuid
+
+import psycopg2
+import streamlit as st
+
+from database import execute_query, open_connection
+
+PROGRESS_QUERY = """
+    SELECT
+        phase,
+        blocks_done,
+        blocks_total,
+        tuples_done,
+        tuples_total,
+        lockers_done,
+        lockers_total
+    FROM pg_stat_progress_create_index
+    WHERE pid = %s
+"""
+
+INVALID_INDEXES_QUERY = """
+    SELECT
+        c.relname as index,
+        t.relname as table_name,
+        pg_size_pretty(pg_relation_size(c.oid)) as index_size
+    FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indexrelid
+    JOIN pg_class t ON t.oid = i.indrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE NOT i.indisvalid
+        AND n.nspname = 'public'
+"""
+
+_INDEX_DDL = re.compile(
+    r"^\s*(CREATE\s+(?:UNIQUE\s+)?INDEX|DROP\s+INDEX|REINDEX\s+(?:INDEX|TABLE))\s+(?!CONCURRENTLY)",
+    re.IGNORECASE
+)
+_INDEX_NAME = re.compile(
+    r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+(?:CONCURRENTLY\s+)?(?:IF\s+NOT\s+EXISTS\s+)?([\w.\"]+)",
+    re.IGNORECASE
+)
+_CREATE_INDEX = re.compile(
+    r"^\s*CREATE\s+(UNIQUE\s+)?INDEX\s+(?:CONCURRENTLY\s+)?(?:IF\s+NOT\s+EXISTS\s+)?([\w.\"]+)"
+    r"\s+ON\s+(?:ONLY\s+)?([\w.\"]+)(.*)$",
+    re.IGNORECASE | re.DOTALL
+)
+_DROP_INDEX = re.compile(
+    r"^\s*DROP\s+INDEX\s+CONCURRENTLY\s+(IF\s+EXISTS\s+)?([\w.\"]+)\s*$",
+    re.IGNORECASE
+)
+
+def concurrently(statement):
+    """Rewrite CREATE INDEX / DROP INDEX / REINDEX to the non-blocking CONCURRENTLY form"""
+    return _INDEX_DDL.sub(lambda m: f"{m.group(1)} CONCURRENTLY ", statement, count=1)
+
+def created_index_name(statement):
+    """Name of the index a CREATE INDEX statement builds, or None"""
+    match = _INDEX_NAME.search(statement)
+    return match.group(1).strip('"') if match else None
+
+def _relkind(cur, name):
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (name,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+def partition_steps(cur, statement):
+    """
+    The statements that carry out statement: itself, or for a partitioned
+    table the per-partition form that works without blocking writes
+    """
+    create = _CREATE_INDEX.match(statement)
+    if create and _relkind(cur, create.group(3)) == "p":
+        unique, name, table, definition = create.groups()
+        unique = unique or ""
+        name, table = name.strip('"'), table.strip('"')
+        cur.execute("""
+            SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = %s::regclass
+            ORDER BY c.relname
+        """, (table,))
+        # Metadata only: an invalid parent index until every partition is attached
+        steps = [f"CREATE {unique}INDEX IF NOT EXISTS {name} ON ONLY {table}{definition}"]
+        for (partition,) in cur.fetchall():
+            suffix = partition[len(table) + 1:] if partition.startswith(f"{table}_") else partition
+            partition_index = f"{name}_{suffix}"[:63]
+            steps.append(
+                f"CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {partition_index} ON {partition}{definition}"
+            )
+            steps.append(f"ALTER INDEX {name} ATTACH PARTITION {partition_index}")
+        return steps
+
+    drop = _DROP_INDEX.match(statement)
+    if drop and _relkind(cur, drop.group(2)) == "I":
+        return [f"DROP INDEX {drop.group(1) or ''}{drop.group(2)}"]
+    return [statement]
+
+def _drop_if_invalid(cur, index_name):
+    """Drop an index left invalid by a failed or cancelled concurrent build"""
+    cur.execute("""
+        SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE NOT i.indisvalid AND c.relname = %s
+    """, (index_name,))
+    if cur.fetchone():
+        cur.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{index_name}"')
+        return True
+    return False
+
+class MaintenanceJob:
+    """A list of maintenance statements run in order on a dedicated connection"""
+
+    def __init__(self, label, statements):
+        self.id = uuid.uuid4().hex[:8]
+        self.label = label
+        self.statements = [concurrently(statement) for statement in statements]
+        self.status = "queued"
+        self.error = None
+        self.current_statement = None
+        self.cleaned_up = []
+        self.pid = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._conn = None
+        self._cancel_requested = False
+
+    @property
+    def finished(self):
+        return self.status in ("succeeded", "failed", "cancelled")
+
+    def run(self):
+        if self._cancel_requested:
+            self.status = "cancelled"
+            self.finished_at = time.time()
+            return
+
+        self.status = "running"
+        self.started_at = time.time()
+        created = []
+        try:
+            # CONCURRENTLY cannot run inside a transaction block
+            self._conn = open_connection(cursor_factory=None, autocommit=True)
+            self.pid = self._conn.get_backend_pid()
+            with self._conn.cursor() as cur:
+                cur.execute("SET statement_timeout = 0")
+                steps = [step for statement in self.statements for step in partition_steps(cur, statement)]
+                # A partitioned parent's index stays invalid until its partitions are attached,
+                # so only concurrent builds are cleaned up
+                created = [
+                    created_index_name(step) for step in steps
+                    if created_index_name(step) and re.search(r"\bCONCURRENTLY\b", step, re.IGNORECASE)
+                ]
+                # IF NOT EXISTS would silently keep an invalid index from an earlier failed build
+                for name in created:
+                    _drop_if_invalid(cur, name)
+
+                for statement in steps:
+                    if self._cancel_requested:
+                        raise psycopg2.extensions.QueryCanceledError("cancelled before start")
+                    self.current_statement = statement
+                    cur.execute(statement)
+            self.status = "succeeded"
+        except psycopg2.extensions.QueryCanceledError:
+            self.status = "cancelled"
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+        finally:
+            self.current_statement = None
+            if self.status != "succeeded" and self._conn is not None and not self._conn.closed:
+                try:
+                    with self._conn.cursor() as cur:
+                        for name in created:
+                            if _drop_if_invalid(cur, name):
+                                self.cleaned_up.append(name)
+                except Exception as e:
+                    self.error = f"{self.error or ''} (cleanup failed: {e})".strip()
+            if self._conn is not None:
+                self._conn.close()
+            self.finished_at = time.time()
+
+    def cancel(self):
+        """Request cancellation; a running statement is cancelled server side"""
+        self._cancel_requested = True
+        conn = self._conn
+        if self.status == "running" and conn is not None and not conn.closed:
+            conn.cancel()
+
+    def progress(self):
+        """Current pg_stat_progress_create_index row for this job, with a 0-1 fraction"""
+        if self.status != "running" or self.pid is None:
+            return None
+        rows = execute_query(PROGRESS_QUERY, (self.pid,), query_class="admin")
+        if not rows:
+            return None
+        progress = dict(rows[0])
+        if progress["blocks_total"] and "scanning table" in progress["phase"]:
+            progress["fraction"] = progress["blocks_done"] / progress["blocks_total"]
+        elif progress["tuples_total"]:
+            progress["fraction"] = progress["tuples_done"] / progress["tuples_total"]
+        elif progress["lockers_total"]:
+            progress["fraction"] = progress["lockers_done"] / progress["lockers_total"]
+        else:
+            progress["fraction"] = None
+        return progress
+
+class JobRunner:
+    """Runs maintenance jobs one at a time on a background thread"""
+
+    def __init__(self, history=20):
+        self.jobs = []
+        self.history = history
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = threading.Thread(target=self._work, name="maintenance-jobs", daemon=True)
+        self._worker.start()
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            job.run()
+
+    def submit(self, label, statements):
+        job = MaintenanceJob(label, statements)
+        with self._lock:
+            self.jobs.insert(0, job)
+            # Forget old finished jobs, never queued or running ones
+            finished = [j for j in self.jobs if j.finished]
+            for old in finished[self.history:]:
+                self.jobs.remove(old)
+        self._queue.put(job)
+        return job
+
+    def active(self):
+        return [job for job in self.jobs if not job.finished]
+
+@st.cache_resource
+def get_job_runner():
+    """Job runner shared by every session of this app process"""
+    return JobRunner()
+
+def find_invalid_indexes():
+    """Indexes left behind by failed concurrent builds"""
+    return execute_query(INVALID_INDEXES_QUERY, query_class="admin")
+
+def drop_invalid_indexes():
+    """Queue a job that drops every invalid index"""
+    names = [row["index"] for row in find_invalid_indexes()]
+    if not names:
+        return None
+    return get_job_runner().submit(
+        "Drop invalid indexes",
+        [f'DROP INDEX IF EXISTS "{name}"' for name in names]
+    )
@@ -1,9 +1,18 @@
+import calendar
+import re
+import pandas as pd
 import streamlit as st
 import requests
+from api_client import ApiError, get_json
+from database import execute_cached_query, execute_query
+from export import display_export
+from queries import FACET_POST_EXPRESSIONS, GET_TERM_HINTS, SEARCH_FACETS_COMMENTS, SEARCH_FACETS_POSTS, SUGGEST_TERMS
+from search_terms import prefix_pattern
+from singleflight import FlightTimeout
+from snippets import highlight
 from utils import format_date, DARK_THEME_CSS
 from datetime import datetime, date
 from streamlit.runtime.scriptrunner import get_script_run_ctx
-import time
 
 st.set_page_config(
     page_title="Search RepLadies Archive",
@@ -35,9 +44,6 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
-# API endpoint constants
-API_BASE_URL = "https://m6njm571hh.execute-api.us-east-2.amazonaws.com"
-
 # At the top with other session state initializations
 if 'previous_search_type' not in st.session_state:
     st.session_state.previous_search_type = None
@@ -49,13 +55,13 @@ if 'previous_end_date' not in st.session_state:
 @st.cache_data(ttl=3600)  # Cache for 1 hour
 def get_valid_date_range():
     try:
-        response = requests.get(f"{API_BASE_URL}/api/metadata/date_range", timeout=10)
-        if response.status_code == 200:
-            data = response.json()
-            return {
-                'min_date': datetime.strptime(data['earliest_date'], '%Y-%m-%d').date(),
-                'max_date': datetime.strptime(data['latest_date'], '%Y-%m-%d').date()
-            }
+        data = get_json("/api/metadata/date_range", cache_ttl=3600)
+        return {
+            'min_date': datetime.strptime(data['earliest_date'], '%Y-%m-%d').date(),
+            'max_date': datetime.strptime(data['latest_date'], '%Y-%m-%d').date()
+        }
+    except ApiError:
+        pass
     except Exception as e:
         st.error(f"Error fetching date range: {str(e)}")
     
@@ -93,6 +99,11 @@ def scroll_to_top():
     '''
     st.components.v1.html(js, height=0)
 
+@st.cache_data(ttl=300, show_spinner=False)
+def fetch_search(path: str, params: tuple):
+    """Search API call, cached so reruns that don't change a search don't repeat it"""
+    return get_json(path, params=dict(params), timeout=30, cache_ttl=300)
+
 def search_api_posts(query: str, sort: str, search_type: str = "title_body", page: int = 1, limit: int = 20, start_date=None, end_date=None):
     """Search posts using the API"""
     try:
@@ -114,26 +125,12 @@ def search_api_posts(query: str, sort: str, search_type: str = "title_body", pag
         if params.get("start_date") or params.get("end_date"):
             st.caption(f"Date filter: {params.get('start_date', 'any')} to {params.get('end_date', 'any')}")
             
-        response = requests.get(
-            f"{API_BASE_URL}/api/search/posts",
-            params=params,
-            timeout=30
-        )
+        return fetch_search("/api/search/posts", tuple(params.items()))
         
-        if response.status_code != 200:
-            error_msg = response.text
-            try:
-                error_data = response.json()
-                if 'detail' in error_data:
-                    error_msg = error_data['detail']
-            except:
-                pass
-            st.error(f"API Error ({response.status_code}): {error_msg}")
-            return None
-            
-        return response.json()
-        
-    except requests.Timeout:
+    except ApiError as e:
+        st.error(str(e))
+        return None
+    except (requests.Timeout, FlightTimeout):
         st.error("Search took too long. Please try adding a date range or using more specific search terms.")
         return None
     except requests.RequestException as e:
@@ -156,32 +153,296 @@ def search_api_comments(query: str, sort: str, page: int = 1, limit: int = 20, s
         if isinstance(end_date, (datetime, date)):
             params["end_date"] = end_date.strftime("%Y-%m-%d")
             
-        response = requests.get(
-            f"{API_BASE_URL}/api/search/comments",
-            params=params,
-            timeout=30
-        )
-        
-        if response.status_code != 200:
-            error_msg = response.text
-            try:
-                error_data = response.json()
-                if 'detail' in error_data:
-                    error_msg = error_data['detail']
-            except:
-                pass
-            st.error(f"API Error ({response.status_code}): {error_msg}")
-            return None
-            
-        return response.json()
+        return fetch_search("/api/search/comments", tuple(params.items()))
         
-    except requests.Timeout:
+    except ApiError as e:
+        st.error(str(e))
+        return None
+    except (requests.Timeout, FlightTimeout):
         st.error("Search took too long. Please try adding a date range or using more specific search terms.")
         return None
     except requests.RequestException as e:
         st.error(f"API Error: {str(e)}")
         return None
 
+@st.cache_data(ttl=3600, show_spinner=False)
+def get_search_facets(query: str, search_type: str):
+    """Matches per month for a query, cached per query so paging and re-filtering reuse it"""
+    facets = {}
+    if search_type in FACET_POST_EXPRESSIONS:
+        posts_query = SEARCH_FACETS_POSTS.format(fts_expression=FACET_POST_EXPRESSIONS[search_type])
+        for row in execute_cached_query(posts_query, (query,), ttl=3600, query_class="search"):
+            facets.setdefault(row['month'], {'Posts': 0, 'Comments': 0})['Posts'] = row['items']
+    if search_type in ["comments", "everything"]:
+        for row in execute_cached_query(SEARCH_FACETS_COMMENTS, (query,), ttl=3600, query_class="search"):
+            facets.setdefault(row['month'], {'Posts': 0, 'Comments': 0})['Comments'] = row['items']
+    return facets
+
+def set_date_range(start, end):
+    """Button callback: filter to a period, clamped to the archive's date range"""
+    bounds = get_valid_date_range()
+    st.session_state.start_date = max(start, bounds['min_date'])
+    st.session_state.end_date = min(end, bounds['max_date'])
+
+def clear_date_range():
+    st.session_state.start_date = None
+    st.session_state.end_date = None
+
+def display_search_facets(query, search_type):
+    """Sidebar histogram of matches by month, with shortcuts to the busiest months"""
+    include_posts = search_type in FACET_POST_EXPRESSIONS
+    include_comments = search_type in ["comments", "everything"]
+    try:
+        facets = get_search_facets(query, search_type)
+    except Exception as e:
+        st.caption(f"Date histogram unavailable: {str(e)}")
+        return
+    if not facets:
+        return
+    
+    st.subheader("Matches by Month")
+    histogram = pd.DataFrame.from_dict(facets, orient='index').sort_index()
+    st.bar_chart(histogram[[column for column, included in
+                            (('Posts', include_posts), ('Comments', include_comments)) if included]])
+    
+    busiest = sorted(facets.items(), key=lambda item: -sum(item[1].values()))[:5]
+    st.caption("Jump to a busy month:")
+    for month, counts in sorted(busiest):
+        last_day = month.replace(day=calendar.monthrange(month.year, month.month)[1])
+        st.button(
+            f"{month:%B %Y} ({sum(counts.values()):,})",
+            key=f"facet_{month}",
+            on_click=set_date_range,
+            args=(month, last_day),
+            use_container_width=True
+        )
+    if st.session_state.get('start_date') or st.session_state.get('end_date'):
+        st.button("Clear dates", on_click=clear_date_range, use_container_width=True)
+
+# A term in more than this share of posts or comments makes for a slow, broad search
+COMMON_TERM_SHARE = 0.2
+
+@st.cache_data(ttl=600, show_spinner=False)
+def get_term_hints(words: tuple):
+    return execute_query(GET_TERM_HINTS, (list(words),))
+
+@st.cache_data(ttl=600, show_spinner=False)
+def suggest_terms(prefix: str, limit: int = 6):
+    return execute_query(SUGGEST_TERMS, (prefix_pattern(prefix), limit))
+
+def complete_last_word(word):
+    """Button callback: replace the last word of the search box with a suggestion"""
+    words = st.session_state.search_box.split()
+    st.session_state.search_box = " ".join(words[:-1] + [word])
+
+def display_term_hints(query):
+    """How many documents each search term matches, plus completions for the last word"""
+    words = [word for word in re.findall(r"[\w']+", query) if word not in ("AND", "OR", "NOT")]
+    if not words:
+        return
+    try:
+        hints = get_term_hints(tuple(words))
+        suggestions = suggest_terms(words[-1].lower()) if len(words[-1]) >= 3 else []
+    except Exception:
+        # Hints are optional; the search itself still works
+        return
+    
+    notes = []
+    for hint in hints:
+        if not hint['lexeme']:
+            notes.append(f"**{hint['word']}**: ignored (too common)")
+            continue
+        notes.append(f"**{hint['word']}**: {hint['post_docs']:,} posts · {hint['comment_docs']:,} comments")
+        if not hint['post_docs'] and not hint['comment_docs']:
+            st.warning(f"No posts or comments contain '{hint['word']}'.")
+        elif (
+            (hint['total_posts'] and hint['post_docs'] / hint['total_posts'] > COMMON_TERM_SHARE) or
+            (hint['total_comments'] and hint['comment_docs'] / hint['total_comments'] > COMMON_TERM_SHARE)
+        ):
+            st.warning(
+                f"'{hint['word']}' appears in a large share of the archive. "
+                "Add more specific terms or a date range for a faster search."
+            )
+    st.caption(" | ".join(notes))
+    
+    suggestions = [row for row in suggestions if row['lexeme'] != words[-1].lower()]
+    if suggestions:
+        columns = st.columns(len(suggestions))
+        for column, row in zip(columns, suggestions):
+            column.button(
+                f"{row['lexeme']} ({row['post_docs'] + row['comment_docs']:,})",
+                key=f"suggest_{row['lexeme']}",
+                on_click=complete_last_word,
+                args=(row['lexeme'],)
+            )
+
+POST_SORTS = {
+    "most_upvotes": "Most Upvotes",
+    "newest": "Newest First",
+    "oldest": "Oldest First",
+    "most_comments": "Most Comments"
+}
+COMMENT_SORTS = {key: POST_SORTS[key] for key in ["most_upvotes", "newest", "oldest"]}
+
+def reset_pages():
+    st.session_state.posts_page = 1
+    st.session_state.comments_page = 1
+
+def set_page(page_key, page):
+    """Button callback: move one result list to another page"""
+    st.session_state[page_key] = page
+    st.session_state.scroll_to_top = True
+
+def display_pagination(results, page_key):
+    """Previous / Next controls for one result list"""
+    col1, col2, col3 = st.columns([1, 2, 1])
+    current_page = st.session_state.get(page_key, 1)
+    total_pages = results.get('total_pages', 0)
+    
+    with col1:
+        if current_page > 1:
+            st.button("← Previous", key=f"{page_key}_previous",
+                      on_click=set_page, args=(page_key, current_page - 1))
+    with col2:
+        if total_pages > 0:
+            st.write(f"Page {current_page} of {total_pages}")
+        else:
+            st.write(f"Page {current_page}")
+    with col3:
+        if should_show_next_button(results):
+            st.button("Next →", key=f"{page_key}_next",
+                      on_click=set_page, args=(page_key, current_page + 1))
+
+def display_result_range(results):
+    current_start = ((results['page'] - 1) * results['limit']) + 1
+    current_end = min(current_start + len(results['results']) - 1, results['total_results'])
+    st.caption(f"Showing results {current_start} - {current_end} of {results['total_results']}")
+
+# The result lists are fragments: paging or re-sorting one of them reruns
+# only that list, not the page, the sidebar or the other list
+@st.fragment
+def display_post_results(search_query, search_type, start_date, end_date):
+    if st.session_state.pop('scroll_to_top', False):
+        scroll_to_top()
+    sort = st.selectbox(
+        "Sort posts by:",
+        list(POST_SORTS),
+        format_func=POST_SORTS.get,
+        key="post_sort",
+        on_change=set_page,
+        args=("posts_page", 1)
+    )
+    api_search_type = {
+        "post_title": "title",
+        "post_body": "body",
+        "everything": "title_body"
+    }[search_type]
+    
+    try:
+        with st.spinner("Searching posts..."):
+            results = search_api_posts(
+                query=search_query,
+                sort=sort,
+                search_type=api_search_type,
+                page=st.session_state.get('posts_page', 1),
+                start_date=start_date,
+                end_date=end_date
+            )
+    except Exception as e:
+        st.error(f"Search error: {str(e)}")
+        return
+    
+    if not results or not results.get('results'):
+        st.info("No posts found matching your search.")
+        return
+    
+    st.header(f"Posts ({results['total_results']} total)")
+    display_result_range(results)
+    
+    for post in results['results']:
+        st.subheader(post['title'])
+        
+        # Post metadata directly under subheader
+        author_link = format_author_link(post['author'])
+        st.caption(
+            f"Posted by {author_link} | "
+            f"Score: {post.get('score', 0)} | "
+            f"Comments: {post.get('num_comments', 0)} | "
+            f"Posted on: {post['formatted_date']}"
+        )
+        
+        # Highlighted snippet for the rows on this page only
+        snippet, _ = highlight(post['selftext'], search_query)
+        if snippet:
+            st.markdown(snippet)
+        
+        with st.expander("Show Post"):
+            st.markdown(post['selftext'])
+            st.markdown("---")
+            col1, col2 = st.columns([5,1])
+            with col2:
+                st.markdown(f"[💬 View Discussion](/Post_View?post_id={post['id']})")
+    
+    display_pagination(results, 'posts_page')
+
+@st.fragment
+def display_comment_results(search_query, start_date, end_date):
+    if st.session_state.pop('scroll_to_top', False):
+        scroll_to_top()
+    sort = st.selectbox(
+        "Sort comments by:",
+        list(COMMENT_SORTS),
+        format_func=COMMENT_SORTS.get,
+        key="comment_sort",
+        on_change=set_page,
+        args=("comments_page", 1)
+    )
+    
+    try:
+        with st.spinner("Searching comments..."):
+            results = search_api_comments(
+                query=search_query,
+                sort=sort,
+                page=st.session_state.get('comments_page', 1),
+                start_date=start_date,
+                end_date=end_date
+            )
+    except Exception as e:
+        st.error(f"Search error: {str(e)}")
+        return
+    
+    if not results or not results.get('results'):
+        st.info("No comments found matching your search.")
+        return
+    
+    st.header(f"Comments ({results['total_results']} total)")
+    display_result_range(results)
+    
+    for comment in results['results']:
+        st.markdown("---")  # Separator between comments
+        
+        # Comment metadata
+        author_link = format_author_link(comment['author'])
+        st.markdown(
+            f"**Comment by {author_link}** | "
+            f"Score: {comment.get('score', 0)} | "
+            f"Posted on: {comment['formatted_date']}"
+        )
+        
+        # Snippet around the matches and whether there is more to show
+        snippet, needs_expander = highlight(comment['body'], search_query)
+        
+        if needs_expander:
+            st.markdown(snippet)
+            with st.expander("Show full comment"):
+                st.markdown(comment['body'])
+        else:
+            st.markdown(snippet)
+        
+        st.markdown(f"[View full discussion →](/Post_View?post_id={comment['submission_id']}&comment_id={comment['id']})")
+    
+    display_pagination(results, 'comments_page')
+
 # Add this helper function at the top with your other imports and helper functions
 def should_show_next_button(results):
     """
@@ -206,22 +467,6 @@ def format_author_link(author):
         return '[deleted]'
     return f"[u/{author}](/Profile_View?author={author})"
 
-def get_preview(text, max_length=2000):
-    """Get a preview of text, cutting at the nearest sentence or word boundary"""
-    if len(text) <= max_length:
-        return text, False
-    
-    # Try to find the end of a sentence within the preview length
-    preview = text[:max_length]
-    sentence_end = max([preview.rfind('. '), preview.rfind('! '), preview.rfind('? ')])
-    
-    if sentence_end > max_length // 2:  # If we found a sentence end in a reasonable spot
-        preview = text[:sentence_end + 1]
-    else:  # Fall back to word boundary
-        preview = text[:max_length].rsplit(' ', 1)[0]
-    
-    return f"{preview}...", True
-
 # Sidebar controls
 with st.sidebar:
     st.subheader("Search Options")
@@ -239,53 +484,9 @@ with st.sidebar:
     
     # Reset page when search type changes
     if st.session_state.previous_search_type != search_type:
-        st.session_state.page = 1
+        reset_pages()
         st.session_state.previous_search_type = search_type
     
-    # Show different sort options based on search type
-    if search_type == "everything":
-        st.subheader("Sort Options")
-        col1, col2 = st.columns(2)
-        with col1:
-            post_sort = st.selectbox(
-                "Sort Posts by:",
-                ["most_upvotes", "newest", "oldest", "most_comments"],
-                format_func=lambda x: {
-                    "most_upvotes": "Most Upvotes",
-                    "newest": "Newest First",
-                    "oldest": "Oldest First",
-                    "most_comments": "Most Comments"
-                }[x]
-            )
-        with col2:
-            comment_sort = st.selectbox(
-                "Sort Comments by:",
-                ["most_upvotes", "newest", "oldest"],
-                format_func=lambda x: {
-                    "most_upvotes": "Most Upvotes",
-                    "newest": "Newest First",
-                    "oldest": "Oldest First"
-                }[x]
-            )
-    else:
-        # Single sort option for other search types
-        sort_options = (
-            ["most_upvotes", "newest", "oldest", "most_comments"]
-            if search_type in ["post_title", "post_body"]
-            else ["most_upvotes", "newest", "oldest"]
-        )
-        
-        sort_by = st.selectbox(
-            "Sort by:",
-            sort_options,
-            format_func=lambda x: {
-                "most_upvotes": "Most Upvotes",
-                "newest": "Newest First",
-                "oldest": "Oldest First",
-                "most_comments": "Most Comments"
-            }[x]
-        )
-    
     # Date range picker
     st.subheader("Date Range")
     date_range = get_valid_date_range()
@@ -313,12 +514,14 @@ with st.sidebar:
     # Check if dates changed
     if (st.session_state.previous_start_date != start_date or 
         st.session_state.previous_end_date != end_date):
-        st.session_state.page = 1
+        reset_pages()
         st.session_state.previous_start_date = start_date
         st.session_state.previous_end_date = end_date
 
 # Main search interface
 search_query = st.text_input("Enter your search terms", key="search_box")
+if search_query:
+    display_term_hints(search_query)
 
 # Add this near your search input, before the search box
 with st.expander("💡 Search Tips - Boolean Operators (AND, OR, NOT)"):
@@ -338,157 +541,25 @@ if not search_query:
 if search_query:
     # Check if this is a new search by comparing with previous search
     if 'previous_search' not in st.session_state or st.session_state.previous_search != search_query:
-        st.session_state.page = 1  # Reset to page 1
+        reset_pages()
         st.session_state.previous_search = search_query  # Store current search
     
-    try:
-        post_results = None
-        comment_results = None
-        
-        # Handle post searches
-        if search_type in ["post_title", "post_body", "everything"]:
-            with st.spinner("Searching posts..."):
-                api_search_type = {
-                    "post_title": "title",
-                    "post_body": "body",
-                    "everything": "title_body"
-                }[search_type]
-                
-                post_results = search_api_posts(
-                    query=search_query,
-                    sort=post_sort if search_type == "everything" else sort_by,
-                    search_type=api_search_type,
-                    page=st.session_state.get('page', 1),
-                    start_date=start_date,
-                    end_date=end_date
-                )
-
-        # Handle comment searches
-        if search_type in ["comments", "everything"]:
-            with st.spinner("Searching comments..."):
-                comment_results = search_api_comments(
-                    query=search_query,
-                    sort=comment_sort if search_type == "everything" else sort_by,
-                    page=st.session_state.get('page', 1),
-                    start_date=start_date,
-                    end_date=end_date
-                )
-
-        # Display results with proper messaging
-        no_results = True
-        
-        if search_type in ["post_title", "post_body", "everything"]:
-            if post_results and post_results.get('results'):
-                no_results = False
-                st.header(f"Posts ({post_results['total_results']} total)")
-                
-                current_start = ((post_results['page'] - 1) * post_results['limit']) + 1
-                current_end = min(current_start + len(post_results['results']) - 1, post_results['total_results'])
-                st.caption(f"Showing results {current_start} - {current_end} of {post_results['total_results']}")
-                
-                for post in post_results['results']:
-                    st.subheader(post['title'])
-                    
-                    # Post metadata directly under subheader
-                    author_link = format_author_link(post['author'])
-                    st.caption(
-                        f"Posted by {author_link} | "
-                        f"Score: {post.get('score', 0)} | "
-                        f"Comments: {post.get('num_comments', 0)} | "
-                        f"Posted on: {post['formatted_date']}"
-                    )
-                    
-                    with st.expander("Show Post"):
-                        st.markdown(post['selftext'])
-                        st.markdown("---")
-                        col1, col2 = st.columns([5,1])
-                        with col2:
-                            st.markdown(f"[💬 View Discussion](/Post_View?post_id={post['id']})")
-        
-        if search_type in ["comments", "everything"]:
-            if comment_results and comment_results.get('results'):
-                no_results = False
-                st.header(f"Comments ({comment_results['total_results']} total)")
-                
-                current_start = ((comment_results['page'] - 1) * comment_results['limit']) + 1
-                current_end = min(current_start + len(comment_results['results']) - 1, comment_results['total_results'])
-                st.caption(f"Showing results {current_start} - {current_end} of {comment_results['total_results']}")
-                
-                for comment in comment_results['results']:
-                    st.markdown("---")  # Separator between comments
-                    
-                    # Comment metadata
-                    author_link = format_author_link(comment['author'])
-                    st.markdown(
-                        f"**Comment by {author_link}** | "
-                        f"Score: {comment.get('score', 0)} | "
-                        f"Posted on: {comment['formatted_date']}"
-                    )
-                    
-                    # Get preview and determine if we need an expander
-                    preview, needs_expander = get_preview(comment['body'])
-                    
-                    if needs_expander:
-                        st.markdown(preview)
-                        with st.expander("Show full comment"):
-                            st.markdown(comment['body'])
-                    else:
-                        st.markdown(comment['body'])
-                    
-                    st.markdown(f"[View full discussion →](/Post_View?post_id={comment['submission_id']}&comment_id={comment['id']})")
-        
-        if no_results:
-            if search_type == "comments":
-                st.info("No comments found matching your search.")
-            elif search_type in ["post_title", "post_body"]:
-                st.info("No posts found matching your search.")
-            else:  # everything
-                st.info("No posts or comments found matching your search.")
-
-        # Pagination controls
-        if search_query and (post_results or comment_results):
-            col1, col2, col3 = st.columns([1, 2, 1])
-            current_page = st.session_state.get('page', 1)
-            
-            # Get total pages for both result types
-            post_total_pages = post_results.get('total_pages', 0) if post_results else 0
-            comment_total_pages = comment_results.get('total_pages', 0) if comment_results else 0
-            max_total_pages = max(post_total_pages, comment_total_pages)
-            
-            with col1:
-                if current_page > 1:
-                    if st.button("← Previous"):
-                        scroll_to_top()
-                        st.session_state.page = current_page - 1
-                        time.sleep(0.2)
-                        st.rerun()
-            
-            with col2:
-                if max_total_pages > 0:
-                    st.write(f"Page {current_page} of {max_total_pages}")
-                else:
-                    st.write(f"Page {current_page}")
-            
-            with col3:
-                show_next = False
-                
-                if search_type in ["post_title", "post_body"]:
-                    show_next = should_show_next_button(post_results)
-                elif search_type == "comments":
-                    show_next = should_show_next_button(comment_results)
-                else:  # everything
-                    # Show next if either posts or comments have more pages
-                    show_next = (should_show_next_button(post_results) or 
-                                should_show_next_button(comment_results))
-                
-                if show_next:
-                    if st.button("Next →"):
-                        scroll_to_top()
-                        st.session_state.page = current_page + 1
-                        time.sleep(0.2)
-                        st.rerun()
-
-    except Exception as e:
-        st.error(f"Search error: {str(e)}")
+    with st.sidebar:
+        display_search_facets(search_query, search_type)
+    
+    if search_type in ["post_title", "post_body", "everything"]:
+        display_post_results(search_query, search_type, start_date, end_date)
+    if search_type in ["comments", "everything"]:
+        display_comment_results(search_query, start_date, end_date)
+    
+    # Exports match the same fields as the search type
+    display_export(
+        "search", search_query, start_date, end_date,
+        kinds=[kind for kind, shown in [
+            ("posts", search_type in ["post_title", "post_body", "everything"]),
+            ("comments", search_type in ["comments", "everything"]),
+        ] if shown],
+        search_type=search_type if search_type in FACET_POST_EXPRESSIONS else "everything"
+    )
 else:
     st.info("Enter search terms above to begin") 
@@ -1,11 +1,11 @@
 import streamlit as st
-import streamlit.components.v1 as components
-import requests
+from api_client import get_json, stream_results
+from comment_store import CommentStore
+from comment_viewer import render_comment_viewer, tree_json
+from database import execute_query
+from queries import GET_COMMENT_CONTEXT, GET_COMMENT_SUBTREE, COMMENT_PATH_ORDERS
 from utils import format_date, DARK_THEME_CSS
 
-# API endpoint constants
-API_BASE_URL = "https://m6njm571hh.execute-api.us-east-2.amazonaws.com"
-
 st.set_page_config(page_title="Post View", page_icon="👜", layout="wide")
 st.markdown(DARK_THEME_CSS, unsafe_allow_html=True)
 
@@ -30,253 +30,120 @@ def format_comment_html(comment, level, is_highlighted=False):
     </div>
     """
 
-def display_nested_comments(comments, highlight_comment_id=None):
-    """Display comments in a nested structure with expanders"""
-    print(f"Total comments to process: {len(comments)}")
-    
-    comment_dict = {}
-    top_level_comments = []
-    
-    # Build comment dictionary and identify top-level comments
-    for comment in comments:
-        comment_dict[comment['id']] = {
-            'data': comment,
-            'replies': []
-        }
-        if comment['parent_id'] == post_id:
-            top_level_comments.append(comment['id'])
-            print(f"Found top level comment: {comment['id']} with author: {comment['author']}")
-        elif comment['parent_id'] in comment_dict:
-            comment_dict[comment['parent_id']]['replies'].append(comment['id'])
-            print(f"Found nested reply: {comment['id']} under parent: {comment['parent_id']}")
-    
-    print(f"Number of top-level comments: {len(top_level_comments)}")
-    print(f"Total number of reply relationships: {sum(len(c['replies']) for c in comment_dict.values())}")
-    
-    # Build HTML for nested comments
-    def build_comment_html(comment_id, level=0):
-        if comment_id not in comment_dict:
-            print(f"Warning: Comment {comment_id} not found in dictionary")
-            return ""
-        
-        comment = comment_dict[comment_id]['data']
-        replies = comment_dict[comment_id]['replies']
-        
-        if replies:
-            print(f"Building HTML for comment {comment_id} with {len(replies)} replies at level {level}")
-        
-        is_highlighted = comment['id'] == highlight_comment_id
-        level_label = {
-            0: "Reply to Original Post (Level 1)",
-            1: "Reply to Original Comment (Level 2)",
-        }.get(level, f"Level {level + 1} Reply")
-        
-        if is_highlighted:
-            level_label += " 🔍 (Comment From Search)"
-        
-        # Add expand/collapse button if there are replies
-        expand_button = ""
-        replies_html = ""
-        if replies:
-            expand_button = f"""
-                <button onclick="toggleReplies('{comment['id']}')" class="expand-button" id="button-{comment['id']}">
-                    [+] {len(replies)} {'reply' if len(replies) == 1 else 'replies'}
-                </button>
-            """
-            replies_html = f"""
-                <div class="replies" id="replies-{comment['id']}" style="display: none;">
-                    {''.join(build_comment_html(reply_id, level + 1) for reply_id in replies)}
-                </div>
-            """
-        
-        return f"""
-            <div class="comment {' nested-comment' if level > 0 else ''}" data-level="{level}">
-                <div class="comment-header">
-                    <div class="author-line">
-                        <span class="author">u/{comment['author']}</span>
-                        <span class="level-label">- {level_label}</span>
-                    </div>
-                    <div class="metadata">Score: {comment['score']} | Posted on: {comment['formatted_date']}</div>
-                </div>
-                <div class="comment-body">{comment['body'].strip()}</div>
-                {expand_button if replies else ''}
-                <div class="replies" id="replies-{comment['id']}" style="display: none;">
-                    {''.join(build_comment_html(reply_id, level + 1) for reply_id in replies)}
-                </div>
-            </div>
-        """
-    
-    # Add JavaScript for expand/collapse functionality
-    js_code = """
-        <script>
-        function toggleReplies(commentId) {
-            const replies = document.getElementById('replies-' + commentId);
-            const button = document.getElementById('button-' + commentId);
-            if (replies.style.display === 'none') {
-                replies.style.display = 'block';
-                button.textContent = button.textContent.replace('[+]', '[-]').replace('Show', 'Hide');
-            } else {
-                replies.style.display = 'none';
-                button.textContent = button.textContent.replace('[-]', '[+]').replace('Hide', 'Show');
-            }
-        }
-        </script>
+@st.cache_resource(ttl=600, max_entries=32, show_spinner="Loading comments...")
+def load_comment_store(post_id, sort):
     """
-    
-    # Update CSS to be included in COMMENTS_CSS
-    updated_css = COMMENTS_CSS.replace(
-        "</style>",
-        """
-        .comments-container {
-            color: white;
-            max-width: 1200px;
-            margin: 0 auto;
-        }
-        .comment {
-            margin-left: calc(var(--level) * 55px);
-            margin-bottom: 1.4em;
-            padding: 18px 22px;
-            border-left: 3px solid #555;
-            position: relative;
-            line-height: 1.6;
-        }
-        .comment[data-level="0"] { 
-            margin-left: 0; 
-            margin-bottom: 2em;
-            border-left: 3px solid #666;
-        }
-        .nested-comment {
-            background-color: rgba(255, 255, 255, 0.015);
-            margin-left: 52px;
-        }
-        .comment[data-level="2"] {
-            background-color: rgba(255, 255, 255, 0.022);
-        }
-        .comment[data-level="3"] {
-            background-color: rgba(255, 255, 255, 0.029);
-        }
-        .comment-header {
-            margin-bottom: 1em;
-            padding-bottom: 8px;
-            border-bottom: 1px solid rgba(255, 255, 255, 0.08);
-        }
-        .author-line {
-            display: flex;
-            align-items: center;
-            gap: 8px;
-            margin-bottom: 4px;
-        }
-        .author {
-            color: #fff;
-            font-weight: 500;
-            font-size: 0.95em;
-        }
-        .level-label {
-            color: #888;
-            font-style: italic;
-            font-size: 0.9em;
-        }
-        .metadata {
-            color: #777;
-            font-size: 0.85em;
-        }
-        .comment-body {
-            margin: 0;
-            padding: 5px 0 10px 0;
-            white-space: pre-wrap;
-            font-size: 0.95em;
-            color: rgba(255, 255, 255, 0.9);
-            letter-spacing: 0.2px;
-            word-spacing: 0.5px;
-        }
-        button.expand-button {
-            background: none;
-            border: none;
-            color: #888;
-            cursor: pointer;
-            font-size: 0.85em;
-            padding: 6px 0;
-            margin-top: 8px;
-            font-family: monospace;
-            letter-spacing: 0.5px;
-            opacity: 0.9;
-            margin-left: -3px;
-        }
-        .replies {
-            margin-top: 14px;
-            position: relative;
-            border-left: 3px solid #555;
-            margin-left: -3px;
-            padding-left: 3px;
-        }
-        .replies::before {
-            display: none;
-        }
-        </style>
+    Fetch a thread's comments and pack them into a CommentStore.
+    Built once per (post, sort) and shared read-only by every session.
+    Comments are decoded from the response stream and packed as they
+    arrive, so the full JSON document is never held in memory.
     """
+    results = stream_results(
+        f"/api/posts/{post_id}/comments",
+        params={
+            "sort": sort,
+            "limit": 10000  # High limit to ensure we get all comments
+        },
+        timeout=10
     )
-    
-    comments_html = "".join(build_comment_html(comment_id) for comment_id in top_level_comments)
-    
-    components.html(
-        updated_css + js_code + 
-        f'<div class="comments-container">{comments_html}</div>',
+    store = CommentStore.build(results, post_id)
+    return store, results.meta.get('total_comments', len(store))
+
+@st.cache_resource(ttl=600, max_entries=32)
+def load_comment_tree(post_id, sort, _store):
+    """Compact JSON tree of a cached CommentStore for the comment viewer"""
+    return tree_json(_store)
+
+def display_nested_comments(store, sort, highlight_comment_id=None):
+    """Display comments in the virtualized, expandable comment viewer"""
+    tree = load_comment_tree(store.post_id, sort, store)
+    highlight_path = store.ancestors(highlight_comment_id) if highlight_comment_id else []
+    render_comment_viewer(
+        tree,
+        highlight_path,
         height=800,
-        scrolling=True
+        generation=st.session_state.get("collapse_generation", 0)
+    )
+
+def display_context_comment(comment, level, label_suffix=""):
+    """Display one comment of the highlighted thread context"""
+    level_label = {
+        0: "Reply to Original Post (Level 1)",
+        1: "Reply to Original Comment (Level 2)",
+    }.get(level, f"Level {level + 1} Reply")
+    level_label += label_suffix
+    
+    st.markdown(
+        f"""
+        <div style="margin-left: {level * 40}px; padding: 10px; border-left: 2px solid #666;">
+            <p><strong>u/{comment['author']}</strong> - <em>{level_label}</em><br>
+            Score: {comment['score']} | Posted on: {format_date(comment['created_utc'])}</p>
+            <p>{comment['body']}</p>
+        </div>
+        """,
+        unsafe_allow_html=True
     )
 
-COMMENTS_CSS = """
-    <style>
-        .comments-container {
-            color: white;
-            max-width: 1200px;
-            margin: 0 auto;
-        }
-        .comment {
-            margin-left: calc(var(--level) * 55px);
-            margin-bottom: 1.4em;
-            padding: 18px 22px;
-            border-left: 3px solid #555;
-            position: relative;
-        }
-        .comment[data-level="0"] { 
-            margin-left: 0; 
-            margin-bottom: 2em;
-            border-left: 3px solid #666;
-        }
-        .nested-comment {
-            background-color: rgba(255, 255, 255, 0.015);
-        }
-        .comment-header {
-            margin-bottom: 1em;
-            padding-bottom: 8px;
-            border-bottom: 1px solid rgba(255, 255, 255, 0.08);
-        }
-        .metadata {
-            color: #777;
-            font-size: 0.85em;
-        }
-        .comment-body {
-            margin: 0;
-            padding: 5px 0 10px 0;
-            white-space: pre-wrap;
-            color: rgba(255, 255, 255, 0.9);
-        }
-        button.expand-button {
-            background: none;
-            border: none;
-            color: #888;
-            cursor: pointer;
-            font-size: 0.85em;
-            padding: 6px 0;
-            margin-top: 8px;
-        }
-        .replies {
-            margin-top: 14px;
-            position: relative;
-        }
-    </style>
-"""
+CONTEXT_REPLIES = 5
+
+def show_all_replies(comment_id):
+    st.session_state[f"all_replies_{comment_id}"] = True
+
+def display_comment_context(post_id, comment_id, sort):
+    """
+    Show the ancestor chain of a comment with a few siblings and replies,
+    fetched with one query instead of downloading the whole thread. All of
+    its replies can then be loaded as one subtree range scan.
+    Returns False if the comment was not found.
+    """
+    try:
+        rows = execute_query(
+            GET_COMMENT_CONTEXT.format(sort_order=COMMENT_PATH_ORDERS[sort]),
+            {"comment_id": comment_id, "post_id": post_id, "siblings": 2, "replies": CONTEXT_REPLIES},
+            report_errors=False
+        )
+    except Exception:
+        # Fall back to the full thread, without an error box
+        return False
+    chain = sorted(
+        (row for row in rows if row['role'] == 'ancestor'),
+        key=lambda row: -row['distance']
+    )
+    if not chain:
+        return False
+    
+    # Rows come back in thread order within each role
+    by_role = {}
+    for row in rows:
+        by_role.setdefault(row['role'], []).append(row)
+    target_level = len(chain) - 1
+    
+    st.header("Comment Thread Context")
+    for level, comment in enumerate(chain[:-1]):
+        display_context_comment(comment, level)
+    for comment in reversed(by_role.get('sibling_before', [])):
+        display_context_comment(comment, target_level)
+    display_context_comment(chain[-1], target_level, " 🔍 (Comment From Search)")
+    replies = by_role.get('reply', [])
+    if st.session_state.get(f"all_replies_{comment_id}"):
+        # The subtree starts with the comment itself, and carries each reply's depth
+        for comment in execute_query(
+            GET_COMMENT_SUBTREE.format(sort_order=COMMENT_PATH_ORDERS[sort]), (comment_id, post_id)
+        )[1:]:
+            display_context_comment(comment, comment['depth'])
+    else:
+        for comment in replies:
+            display_context_comment(comment, target_level + 1)
+        if len(replies) == CONTEXT_REPLIES:
+            st.button(
+                "Show All Replies", key=f"show_all_replies_{comment_id}",
+                on_click=show_all_replies, args=(comment_id,)
+            )
+    for comment in by_role.get('sibling_after', []):
+        display_context_comment(comment, target_level)
+    
+    st.divider()
+    return True
 
 # Get post and comment IDs from URL parameters
 params = st.query_params
@@ -287,54 +154,58 @@ if not post_id:
     st.error("No post ID provided in the URL.")
     st.stop()
 
-# Add sort dropdown in sidebar
-with st.sidebar:
-    st.header("Comment Controls")
+@st.cache_data(ttl=600, show_spinner=False)
+def load_post(post_id):
+    return get_json(f"/api/posts/{post_id}", cache_ttl=600)
+
+@st.fragment
+def display_comment_panel(post_id, num_comments, highlight_comment_id=None):
+    """
+    Comment controls and comments. Runs as a fragment, so changing the sort,
+    collapsing or loading the full thread only reruns this panel.
+    """
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        comment_sort = st.selectbox(
+            "Sort comments by",
+            ["most_upvotes", "newest", "oldest"],
+            format_func=lambda x: {
+                "most_upvotes": "Most Upvotes",
+                "newest": "Newest",
+                "oldest": "Oldest"
+            }[x],
+            key="comment_sort"
+        )
+    with col2:
+        if st.button("Collapse All", use_container_width=True):
+            st.session_state.collapse_generation = st.session_state.get("collapse_generation", 0) + 1
     
-    # Sort dropdown
-    comment_sort = st.selectbox(
-        "Sort comments by",
-        ["most_upvotes", "newest", "oldest"],
-        format_func=lambda x: {
-            "most_upvotes": "Most Upvotes",
-            "newest": "Newest",
-            "oldest": "Oldest"
-        }[x]
-    )
+    try:
+        # If there's a highlighted comment, show its thread first and only load
+        # the full thread when asked for
+        show_full_thread = True
+        if highlight_comment_id:
+            if display_comment_context(post_id, highlight_comment_id, comment_sort):
+                full_thread_key = f"full_thread_{post_id}"
+                if not st.session_state.get(full_thread_key):
+                    if st.button(f"Load All {num_comments} Comments"):
+                        st.session_state[full_thread_key] = True
+                show_full_thread = st.session_state.get(full_thread_key, False)
+        
+        if show_full_thread:
+            store, total_comments = load_comment_store(post_id, comment_sort)
+            
+            if len(store):
+                # Display all comments
+                st.header(f"All Comments ({total_comments})")
+                display_nested_comments(store, comment_sort, highlight_comment_id)
     
-    # Just collapse all button
-    st.divider()
-    st.subheader("Comment Display")
-    if st.button("Collapse All"):
-        st.components.v1.html(
-            """
-            <script>
-            function collapseAll() {
-                var container = document.querySelector('.comments-container');
-                if (container) {
-                    var allReplies = container.getElementsByClassName('replies');
-                    for (var i = 0; i < allReplies.length; i++) {
-                        allReplies[i].style.display = 'none';
-                    }
-                    
-                    var allButtons = container.getElementsByClassName('expand-button');
-                    for (var i = 0; i < allButtons.length; i++) {
-                        var button = allButtons[i];
-                        var numReplies = button.textContent.match(/\d+/)[0];
-                        button.textContent = `[+] Show ${numReplies} ${numReplies === '1' ? 'reply' : 'replies'}`;
-                    }
-                }
-            }
-            collapseAll();
-            </script>
-            """,
-            height=0
-        )
+    except Exception as e:
+        st.error(f"Error loading comments: {str(e)}")
 
 try:
-    # Fetch post
-    response = requests.get(f"{API_BASE_URL}/api/posts/{post_id}", timeout=10)
-    post = response.json()
+    # Fetch post (cached, so reruns of the page don't refetch it)
+    post = load_post(post_id)
     
     # Display post
     st.title(post['title'])
@@ -347,60 +218,7 @@ try:
     )
     st.divider()
     
-    # Fetch comments with sort
-    response = requests.get(
-        f"{API_BASE_URL}/api/posts/{post_id}/comments",
-        params={
-            "sort": comment_sort,
-            "limit": 10000  # High limit to ensure we get all comments
-        },
-        timeout=10
-    )
-    comments_data = response.json()
-    
-    if comments_data and comments_data['results']:
-        # If there's a highlighted comment, show its thread first
-        if highlight_comment_id:
-            comment_dict = {comment['id']: comment for comment in comments_data['results']}
-            highlighted_chain = []
-            current_comment = comment_dict.get(highlight_comment_id)
-            
-            while current_comment:
-                highlighted_chain.insert(0, current_comment)
-                if current_comment['parent_id'] == post_id:
-                    break
-                current_comment = comment_dict.get(current_comment['parent_id'])
-            
-            if highlighted_chain:
-                st.header("Comment Thread Context")
-                
-                for i, comment in enumerate(highlighted_chain):
-                    is_highlighted = comment['id'] == highlight_comment_id
-                    level_label = {
-                        0: "Reply to Original Post (Level 1)",
-                        1: "Reply to Original Comment (Level 2)",
-                    }.get(i, f"Level {i + 1} Reply")
-                    
-                    if is_highlighted:
-                        level_label += " 🔍 (Comment From Search)"
-                        
-                    container = st.container()
-                    container.markdown(
-                        f"""
-                        <div style="margin-left: {i * 40}px; padding: 10px; border-left: 2px solid #666;">
-                            <p><strong>u/{comment['author']}</strong> - <em>{level_label}</em><br>
-                            Score: {comment['score']} | Posted on: {comment['formatted_date']}</p>
-                            <p>{comment['body']}</p>
-                        </div>
-                        """,
-                        unsafe_allow_html=True
-                    )
-                
-                st.divider()
-        
-        # Display all comments
-        st.header(f"All Comments ({comments_data['total_comments']})")
-        display_nested_comments(comments_data['results'], highlight_comment_id)
+    display_comment_panel(post_id, post['num_comments'], highlight_comment_id)
 
 except Exception as e:
     st.error(f"Error loading post: {str(e)}")
@@ -1,6 +1,8 @@
+import pandas as pd
 import streamlit as st
-from database import execute_query
-from queries import GET_USER_POSTS, GET_USER_COMMENTS, SEARCH_USERS, SORT_ORDERS
+from database import execute_queries, execute_query
+from export import display_export
+from queries import GET_AUTHOR_SUMMARY, GET_USER_POSTS, GET_USER_COMMENTS, SEARCH_USERS, SORT_ORDERS
 from utils import format_date, DARK_THEME_CSS
 
 st.set_page_config(
@@ -38,9 +40,57 @@ if search_query:
     except Exception as e:
         st.error(f"Error searching users: {str(e)}")
 
+# Posts/comments listed per tab; prolific authors would otherwise mean unbounded queries
+PROFILE_LIMIT = 200
+
+def display_profile_header(summary):
+    """Activity summary from the author_stats aggregates"""
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Posts", f"{summary['post_count']:,}")
+    col2.metric("Comments", f"{summary['comment_count']:,}")
+    col3.metric(
+        "Total score",
+        f"{summary['post_score'] + summary['comment_score']:,}",
+        help=f"Posts: {summary['post_score']:,} | Comments: {summary['comment_score']:,}"
+    )
+    activity_count = summary['post_count'] + summary['comment_count']
+    col4.metric(
+        "Average score",
+        f"{(summary['post_score'] + summary['comment_score']) / activity_count:.1f}" if activity_count else "-"
+    )
+    if summary['first_utc']:
+        st.caption(
+            f"Active from {format_date(summary['first_utc'])} "
+            f"to {format_date(summary['last_utc'])}"
+        )
+    
+    col1, col2 = st.columns([3, 2])
+    with col1:
+        if summary['monthly']:
+            monthly = pd.DataFrame(summary['monthly']).set_index('month')
+            st.bar_chart(monthly.rename(columns={'posts': 'Posts', 'comments': 'Comments'}))
+    with col2:
+        if summary['threads']:
+            st.markdown("**Most active threads**")
+            for thread in summary['threads'][:5]:
+                st.markdown(
+                    f"[{thread['title'] or thread['submission_id']}](/Post_View?post_id={thread['submission_id']}) "
+                    f"- {thread['comments']} comments"
+                )
+
 if username:
     st.write(f"## u/{username}'s Profile")
     
+    # Header from precomputed aggregates, before any posts are fetched
+    summary = None
+    try:
+        rows = execute_query(GET_AUTHOR_SUMMARY, (username,))
+        if rows:
+            summary = rows[0]
+            display_profile_header(summary)
+    except Exception as e:
+        st.error(f"Error loading profile summary: {str(e)}")
+    
     # Sorting controls
     col1, col2 = st.columns(2)
     with col1:
@@ -66,17 +116,20 @@ if username:
         )
 
     try:
+        # Both lists are fetched together so the page waits for one round trip
+        posts, comments = execute_queries([
+            (GET_USER_POSTS.format(sort_order=SORT_ORDERS[post_sort]), (username, PROFILE_LIMIT)),
+            (GET_USER_COMMENTS.format(sort_order=SORT_ORDERS[comment_sort]), (username, PROFILE_LIMIT)),
+        ], query_class="search")
+
         # Create tabs for posts and comments
         posts_tab, comments_tab = st.tabs(["Posts", "Comments"])
         
         with posts_tab:
-            posts = execute_query(
-                GET_USER_POSTS.format(sort_order=SORT_ORDERS[post_sort]), 
-                (username,)
-            )
-            
             if posts:
-                st.write(f"### Posts ({len(posts)})")
+                st.write(f"### Posts ({summary['post_count'] if summary else len(posts)})")
+                if len(posts) == PROFILE_LIMIT:
+                    st.caption(f"Showing the first {PROFILE_LIMIT} posts in this order")
                 for post in posts:
                     with st.container():
                         st.markdown(f"### {post['title']}")
@@ -100,13 +153,10 @@ if username:
                 st.info("No posts found")
         
         with comments_tab:
-            comments = execute_query(
-                GET_USER_COMMENTS.format(sort_order=SORT_ORDERS[comment_sort]), 
-                (username,)
-            )
-            
             if comments:
-                st.write(f"### Comments ({len(comments)})")
+                st.write(f"### Comments ({summary['comment_count'] if summary else len(comments)})")
+                if len(comments) == PROFILE_LIMIT:
+                    st.caption(f"Showing the first {PROFILE_LIMIT} comments in this order")
                 for comment in comments:
                     st.markdown(
                         f"""<div style='padding: 8px; border-left: 2px solid #ccc;'>
@@ -125,5 +175,8 @@ if username:
                 
     except Exception as e:
         st.error(f"Error loading profile data: {str(e)}")
+
+    # The lists are capped; exports cover the whole history
+    display_export("user", username)
 else:
     st.info("Enter a username to view their profile")
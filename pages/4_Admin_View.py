@@ -1,5 +1,13 @@
+import time
+
 import streamlit as st
-from database import execute_query
+from psycopg2.extensions import cursor as TupleCursor
+import cache
+import prepared
+from database import QUERY_CLASSES, execute_queries, execute_query, get_database_connection, get_limiters, get_replica_set
+from index_advisor import FILTER_INDEXES, index_ddl, run_advisor, sample_parameters
+from maintenance import drop_invalid_indexes, find_invalid_indexes, get_job_runner
+from partitions import PARTITIONED_TABLES, check_pruning, ensure_partitions, is_partitioned, list_partitions
 from utils import DARK_THEME_CSS
 
 st.set_page_config(
@@ -10,6 +18,10 @@ st.set_page_config(
 
 st.markdown(DARK_THEME_CSS, unsafe_allow_html=True)
 
+def admin_query(query, params=None):
+    """execute_query with the admin budget: longer statement_timeout, its own slots"""
+    return execute_query(query, params, query_class="admin")
+
 st.title("Admin View")
 
 # Password protection - access nested secret
@@ -43,7 +55,7 @@ def check_indexes():
     ORDER BY indexname;
     """
     try:
-        results = execute_query(query)
+        results = admin_query(query)
         if not results:
             st.warning("No indexes found on submissions table")
             return
@@ -66,7 +78,7 @@ def check_table_stats():
     ORDER BY n_live_tup DESC;
     """
     try:
-        results = execute_query(query)
+        results = admin_query(query)
         if results:
             st.dataframe(results)
     except Exception as e:
@@ -94,13 +106,14 @@ def check_search_vector():
     """
     
     try:
+        structure, samples = execute_queries(
+            [(structure_query, None), (sample_query, None)], query_class="admin"
+        )
         st.subheader("Search Vector Structure")
-        structure = execute_query(structure_query)
         if structure:
             st.dataframe(structure)
             
         st.subheader("Sample Search Vectors")
-        samples = execute_query(sample_query)
         if samples:
             for sample in samples:
                 with st.expander(f"Post: {sample['title'][:50]}..."):
@@ -108,6 +121,379 @@ def check_search_vector():
     except Exception as e:
         st.error(f"Error checking search vector: {str(e)}")
 
+def check_top_statements(order_by="total", limit=20):
+    """Show the most expensive statements recorded by pg_stat_statements"""
+    # PostgreSQL 13 renamed total_time/mean_time to total_exec_time/mean_exec_time
+    if get_database_connection().server_version >= 130000:
+        total_col, mean_col = "total_exec_time", "mean_exec_time"
+    else:
+        total_col, mean_col = "total_time", "mean_time"
+    order_col = total_col if order_by == "total" else mean_col
+
+    query = f"""
+    SELECT 
+        calls,
+        round({total_col}::numeric, 1) as total_ms,
+        round({mean_col}::numeric, 2) as mean_ms,
+        rows,
+        round(100.0 * shared_blks_hit / NULLIF(shared_blks_hit + shared_blks_read, 0), 2) as hit_pct,
+        query
+    FROM pg_stat_statements
+    WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+    ORDER BY {order_col} DESC
+    LIMIT %s;
+    """
+    try:
+        installed = admin_query(
+            "SELECT 1 FROM pg_extension WHERE extname = 'pg_stat_statements'"
+        )
+        if not installed:
+            st.info(
+                "pg_stat_statements is not installed. Add it to "
+                "shared_preload_libraries and run CREATE EXTENSION pg_stat_statements."
+            )
+            return
+
+        results = admin_query(query, (limit,))
+        if results:
+            st.dataframe(results, use_container_width=True)
+        else:
+            st.info("No statements recorded yet")
+    except Exception as e:
+        st.error(f"Error checking statements: {str(e)}")
+
+def check_cache_hit_ratios():
+    """Check buffer cache hit ratios for the database and each table"""
+    database_query = """
+    SELECT 
+        round(100.0 * blks_hit / NULLIF(blks_hit + blks_read, 0), 2) as hit_pct,
+        stats_reset
+    FROM pg_stat_database
+    WHERE datname = current_database();
+    """
+
+    table_query = """
+    SELECT 
+        relname as table_name,
+        heap_blks_read,
+        heap_blks_hit,
+        round(100.0 * heap_blks_hit / NULLIF(heap_blks_hit + heap_blks_read, 0), 2) as heap_hit_pct,
+        idx_blks_read,
+        idx_blks_hit,
+        round(100.0 * idx_blks_hit / NULLIF(idx_blks_hit + idx_blks_read, 0), 2) as index_hit_pct
+    FROM pg_statio_user_tables
+    WHERE schemaname = 'public'
+    ORDER BY heap_blks_read + COALESCE(idx_blks_read, 0) DESC;
+    """
+    try:
+        database = admin_query(database_query)
+        if database:
+            st.metric("Database cache hit ratio", f"{database[0]['hit_pct']}%")
+            st.caption(f"Statistics collected since {database[0]['stats_reset'] or 'cluster start'}")
+
+        results = admin_query(table_query)
+        if results:
+            st.dataframe(results, use_container_width=True)
+    except Exception as e:
+        st.error(f"Error checking cache hit ratios: {str(e)}")
+
+def check_scan_usage():
+    """Compare sequential scans with index scans for each table and index"""
+    table_query = """
+    SELECT 
+        relname as table_name,
+        seq_scan,
+        seq_tup_read,
+        idx_scan,
+        idx_tup_fetch,
+        round(100.0 * idx_scan / NULLIF(seq_scan + idx_scan, 0), 2) as index_scan_pct,
+        n_live_tup as row_count
+    FROM pg_stat_user_tables
+    WHERE schemaname = 'public'
+    ORDER BY seq_tup_read DESC;
+    """
+
+    index_query = """
+    SELECT 
+        relname as table_name,
+        indexrelname as index,
+        idx_scan,
+        idx_tup_read,
+        idx_tup_fetch,
+        pg_size_pretty(pg_relation_size(indexrelid)) as index_size
+    FROM pg_stat_user_indexes
+    WHERE schemaname = 'public'
+    ORDER BY idx_scan DESC;
+    """
+    try:
+        st.subheader("Tables")
+        tables = admin_query(table_query)
+        if tables:
+            st.dataframe(tables, use_container_width=True)
+
+        st.subheader("Indexes")
+        indexes = admin_query(index_query)
+        if indexes:
+            st.dataframe(indexes, use_container_width=True)
+    except Exception as e:
+        st.error(f"Error checking scan usage: {str(e)}")
+
+def check_unused_indexes():
+    """Find indexes that have never been scanned and indexes that duplicate each other"""
+    unused_query = """
+    SELECT 
+        s.relname as table_name,
+        s.indexrelname as index,
+        s.idx_scan,
+        pg_size_pretty(pg_relation_size(s.indexrelid)) as index_size
+    FROM pg_stat_user_indexes s
+    JOIN pg_index i ON i.indexrelid = s.indexrelid
+    WHERE s.schemaname = 'public'
+        AND s.idx_scan = 0
+        AND NOT i.indisunique
+        AND NOT i.indisprimary
+    ORDER BY pg_relation_size(s.indexrelid) DESC;
+    """
+
+    # Same table, columns, operator classes, expressions and predicate
+    duplicate_query = """
+    SELECT 
+        i.indrelid::regclass::text as table_name,
+        array_agg(i.indexrelid::regclass::text ORDER BY i.indexrelid::regclass::text) as indexes,
+        pg_size_pretty(sum(pg_relation_size(i.indexrelid))::bigint) as total_size
+    FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = 'public'
+    GROUP BY 
+        i.indrelid,
+        i.indkey::text,
+        i.indclass::text,
+        i.indcollation::text,
+        COALESCE(pg_get_expr(i.indexprs, i.indrelid), ''),
+        COALESCE(pg_get_expr(i.indpred, i.indrelid), '')
+    HAVING count(*) > 1;
+    """
+    try:
+        st.subheader("Unused Indexes")
+        unused = admin_query(unused_query)
+        if unused:
+            st.dataframe(unused, use_container_width=True)
+            st.caption("Scan counts are cumulative since the last statistics reset")
+        else:
+            st.success("Every index has been used at least once")
+
+        st.subheader("Duplicate Indexes")
+        duplicates = admin_query(duplicate_query)
+        if duplicates:
+            st.dataframe(duplicates, use_container_width=True)
+        else:
+            st.success("No duplicate indexes found")
+    except Exception as e:
+        st.error(f"Error checking index usage: {str(e)}")
+
+def check_bloat():
+    """Estimate table and btree index bloat from planner statistics"""
+    # Expected size is rebuilt from reltuples and the average column widths in
+    # pg_stats: 24 byte page header, 24 byte tuple header + 4 byte line pointer
+    # per heap row, 8 byte index tuple header + 4 byte line pointer per index row.
+    # Numbers are estimates - run ANALYZE first for meaningful results.
+    query = """
+    WITH settings AS (
+        SELECT current_setting('block_size')::numeric as bs
+    ),
+    tables AS (
+        SELECT 
+            'table' as kind,
+            c.relname as object,
+            c.relname as table_name,
+            c.relpages,
+            ceil(c.reltuples * (24 + 4 + COALESCE(sum((1 - s.null_frac) * s.avg_width), 0))
+                 / (settings.bs - 24)) as expected_pages
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        CROSS JOIN settings
+        LEFT JOIN pg_stats s ON s.schemaname = n.nspname AND s.tablename = c.relname
+        WHERE n.nspname = 'public' AND c.relkind IN ('r', 'm')
+        GROUP BY c.relname, c.relpages, c.reltuples, settings.bs
+    ),
+    indexes AS (
+        SELECT 
+            'index' as kind,
+            ic.relname as object,
+            tc.relname as table_name,
+            ic.relpages,
+            ceil(ic.reltuples * (8 + 4 + COALESCE(sum(s.avg_width), 0))
+                 / ((settings.bs - 24 - 16) * 0.9)) + 1 as expected_pages
+        FROM pg_index i
+        JOIN pg_class ic ON ic.oid = i.indexrelid
+        JOIN pg_class tc ON tc.oid = i.indrelid
+        JOIN pg_namespace n ON n.oid = tc.relnamespace
+        JOIN pg_am am ON am.oid = ic.relam
+        CROSS JOIN settings
+        JOIN pg_attribute a ON a.attrelid = tc.oid AND a.attnum = ANY (i.indkey)
+        LEFT JOIN pg_stats s ON s.schemaname = n.nspname 
+            AND s.tablename = tc.relname 
+            AND s.attname = a.attname
+        WHERE n.nspname = 'public' 
+            AND am.amname = 'btree' 
+            AND i.indexprs IS NULL
+        GROUP BY ic.relname, tc.relname, ic.relpages, ic.reltuples, settings.bs
+    )
+    SELECT 
+        kind,
+        object,
+        table_name,
+        pg_size_pretty((relpages * settings.bs)::bigint) as actual_size,
+        pg_size_pretty((greatest(relpages - expected_pages, 0) * settings.bs)::bigint) as estimated_bloat,
+        round(100.0 * greatest(relpages - expected_pages, 0) / NULLIF(relpages, 0), 1) as bloat_pct
+    FROM (SELECT * FROM tables UNION ALL SELECT * FROM indexes) objects
+    CROSS JOIN settings
+    ORDER BY greatest(relpages - expected_pages, 0) DESC;
+    """
+    try:
+        results = admin_query(query)
+        if results:
+            st.dataframe(results, use_container_width=True)
+            st.caption("Estimates only (GIN and expression indexes are not included). Run ANALYZE first for accurate numbers.")
+    except Exception as e:
+        st.error(f"Error estimating bloat: {str(e)}")
+
+def check_active_queries(min_seconds=5):
+    """List long-running queries with an option to cancel them"""
+    query = """
+    SELECT 
+        pid,
+        usename as user,
+        application_name,
+        state,
+        wait_event_type,
+        wait_event,
+        EXTRACT(EPOCH FROM now() - query_start)::int as runtime_s,
+        query
+    FROM pg_stat_activity
+    WHERE datname = current_database()
+        AND state <> 'idle'
+        AND pid <> pg_backend_pid()
+        AND query_start < now() - make_interval(secs => %s)
+    ORDER BY query_start;
+    """
+    try:
+        results = admin_query(query, (min_seconds,))
+        if not results:
+            st.success(f"No queries running longer than {min_seconds} seconds")
+            return
+
+        for activity in results:
+            col1, col2 = st.columns([5, 1])
+            with col1:
+                st.markdown(
+                    f"**PID {activity['pid']}** | "
+                    f"Running for {activity['runtime_s']}s | "
+                    f"State: {activity['state']} | "
+                    f"Waiting on: {activity['wait_event_type'] or '-'} {activity['wait_event'] or ''}"
+                )
+                st.code(activity['query'], language="sql")
+            with col2:
+                if st.button("Cancel", key=f"cancel_{activity['pid']}"):
+                    cancelled = admin_query(
+                        "SELECT pg_cancel_backend(%s) as cancelled", (activity['pid'],)
+                    )
+                    if cancelled and cancelled[0]['cancelled']:
+                        st.success(f"Cancel requested for PID {activity['pid']}")
+                    else:
+                        st.warning(f"PID {activity['pid']} could not be cancelled")
+    except Exception as e:
+        st.error(f"Error checking active queries: {str(e)}")
+
+def apply_index(proposal):
+    """Queue a background build of a proposed index, installing its extension first if needed"""
+    statements = [proposal['ddl']]
+    if proposal['extension']:
+        statements.insert(0, f"CREATE EXTENSION IF NOT EXISTS {proposal['extension']}")
+    get_job_runner().submit(f"Create {proposal['index']}", statements)
+    st.success(f"Index {proposal['index']} queued - follow its progress under Maintenance Jobs")
+
+@st.fragment(run_every=2)
+def show_maintenance_jobs():
+    """Live status of background maintenance jobs"""
+    runner = get_job_runner()
+    if not runner.jobs:
+        st.info("No maintenance jobs have been run")
+        return
+
+    for job in runner.jobs:
+        with st.container(border=True):
+            col1, col2 = st.columns([5, 1])
+            with col1:
+                st.markdown(f"**{job.label}** | Status: {job.status}")
+                if job.status == "running":
+                    progress = job.progress()
+                    if progress and progress['fraction'] is not None:
+                        st.progress(progress['fraction'], text=progress['phase'])
+                    elif progress:
+                        st.caption(progress['phase'])
+                    if job.current_statement:
+                        st.code(job.current_statement, language="sql")
+                if job.finished and job.started_at:
+                    st.caption(f"Took {job.finished_at - job.started_at:.1f}s")
+                if job.error:
+                    st.error(job.error)
+                if job.cleaned_up:
+                    st.caption("Dropped invalid indexes: " + ", ".join(job.cleaned_up))
+            with col2:
+                if not job.finished and st.button("Cancel", key=f"cancel_job_{job.id}"):
+                    job.cancel()
+
+def show_advisor_results(findings, proposals):
+    """Show plan problems and the indexes proposed to fix them"""
+    st.subheader("Plan Findings")
+    if findings:
+        st.dataframe(findings, use_container_width=True)
+    else:
+        st.success("No sequential scans or large sorts found")
+
+    st.subheader("Proposed Indexes")
+    if not proposals:
+        st.info("No indexes to propose")
+        return
+
+    for name, proposal in proposals.items():
+        with st.expander(f"{name} - up to {proposal['benefit_pct']}% cheaper ({proposal['estimate']})"):
+            st.code(proposal['ddl'], language="sql")
+            if proposal['extension']:
+                st.caption(f"Requires the {proposal['extension']} extension")
+            st.write("Helps: " + ", ".join(proposal['templates']))
+            if st.button("Apply", key=f"apply_{name}"):
+                apply_index(proposal)
+
+def check_partitions(table):
+    """Show the monthly partitions of a table and whether date filters prune them"""
+    try:
+        conn = get_database_connection()
+        # partitions.py reads rows by position
+        with conn.cursor(cursor_factory=TupleCursor) as cur:
+            if not is_partitioned(cur, table):
+                st.info(f"{table} is not partitioned. Run `python partitions.py migrate {table}` to migrate it.")
+                return
+
+            partitions = list_partitions(cur, table)
+            st.dataframe(partitions, use_container_width=True)
+
+            # A one-month filter should touch a single partition
+            now = int(time.time())
+            scanned, total = check_pruning(cur, table, now - 30 * 86400, now)
+            if scanned <= 2:
+                st.success(f"Date filters are pruned: a 30 day range scans {scanned} of {total} partitions")
+            else:
+                st.warning(f"Date filters are not pruned: a 30 day range scans {scanned} of {total} partitions")
+
+            if st.button("Create Upcoming Partitions", key=f"partitions_{table}"):
+                created = ensure_partitions(cur, table, now, now + 3 * 31 * 86400)
+                st.success(f"Created: {', '.join(created)}" if created else "All upcoming partitions exist")
+    except Exception as e:
+        st.error(f"Error checking partitions: {str(e)}")
+
 # Database Stats Section
 col1, col2 = st.columns(2)
 
@@ -121,31 +507,168 @@ with col2:
     if st.button("Check Indexes"):
         check_indexes()
 
+def check_query_budgets():
+    """Slots in use, queued queries and rejections per query class (this process)"""
+    limiters = get_limiters()
+    st.dataframe([
+        {
+            "class": name,
+            "statement_timeout_ms": budget["timeout_ms"],
+            "slots": budget["slots"],
+            "active": limiters[name].active,
+            "waiting": limiters[name].waiting(),
+            "rejected": limiters[name].rejected,
+        }
+        for name, budget in QUERY_CLASSES.items()
+    ])
+
+def check_replicas():
+    """Health, replication lag and connections in use per database node"""
+    nodes = get_replica_set()
+    if not nodes.replicas:
+        st.caption("No read replicas configured; every query runs on the primary.")
+        return
+    st.dataframe(nodes.status())
+    if nodes.fallbacks:
+        st.caption(f"Reads sent to the primary because no replica was healthy: {nodes.fallbacks:,}")
+
+def check_prepared_statements():
+    """Prepared statement reuse and estimated server time saved (this process)"""
+    rows = prepared.stats.rows()
+    if not rows:
+        st.caption("No prepared statements have run yet.")
+        return
+    st.metric("Estimated parse/plan time saved", f"{sum(row['saved_ms'] for row in rows) / 1000:,.1f} s")
+    st.dataframe(rows)
+
+def check_response_cache():
+    """Hit rates and sizes of the persistent response cache shared by all app processes"""
+    try:
+        st.caption(f"{cache.CACHE_PATH} (limit {cache.MAX_BYTES // 1024 // 1024} MB)")
+        stats = cache.stats()
+        if stats:
+            st.dataframe(stats)
+        else:
+            st.info("The response cache is empty")
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("Evict Expired Entries"):
+                cache.evict()
+                st.rerun()
+        with col2:
+            if st.button("Clear Response Cache"):
+                cache.clear()
+                st.rerun()
+    except Exception as e:
+        st.error(f"Error checking response cache: {str(e)}")
+
+# Performance Section
+st.header("Performance")
+
+if st.toggle("Show performance dashboard", key="show_performance"):
+    (statements_tab, cache_tab, scans_tab, 
+     unused_tab, bloat_tab, activity_tab, response_cache_tab) = st.tabs([
+        "Top Statements", "Cache Hit Ratios", "Scans & Index Usage",
+        "Unused & Duplicate Indexes", "Bloat", "Active Queries", "Response Cache"
+    ])
+
+    with statements_tab:
+        statement_order = st.radio(
+            "Order by",
+            ["total", "mean"],
+            format_func=lambda x: {
+                "total": "Total Time",
+                "mean": "Mean Time"
+            }[x],
+            horizontal=True
+        )
+        check_top_statements(statement_order)
+
+    with cache_tab:
+        check_cache_hit_ratios()
+
+    with scans_tab:
+        check_scan_usage()
+
+    with unused_tab:
+        check_unused_indexes()
+
+    with bloat_tab:
+        check_bloat()
+
+    with activity_tab:
+        min_seconds = st.number_input("Running longer than (seconds)", min_value=0, value=5)
+        check_active_queries(min_seconds)
+        st.subheader("Query Budgets")
+        check_query_budgets()
+        st.subheader("Read Replicas")
+        check_replicas()
+        st.subheader("Prepared Statements")
+        check_prepared_statements()
+
+    with response_cache_tab:
+        check_response_cache()
+
 # Index Management
 st.header("Index Management")
 
 with st.expander("Add Text Search Indexes"):
-    st.warning("⚠️ Creating indexes may take several minutes and temporarily slow down the database")
+    st.info("Indexes are built in the background with CREATE INDEX CONCURRENTLY, so writes are not blocked")
     if st.button("Create Text Search Indexes"):
+        # Same expressions as the search, facet and export queries, so the planner can use them
+        queries = [
+            index_ddl(FILTER_INDEXES[key])[1]
+            for key in ["posts_fts", "posts_title_fts", "posts_body_fts", "comments_fts"]
+        ]
+        get_job_runner().submit("Text search indexes", queries)
+        st.success("Index build queued - follow its progress under Maintenance Jobs")
+
+with st.expander("Invalid Indexes"):
+    st.write("Failed concurrent builds can leave invalid indexes that slow down writes without being used.")
+    try:
+        invalid = find_invalid_indexes()
+        if invalid:
+            st.dataframe(invalid, use_container_width=True)
+            if st.button("Drop Invalid Indexes"):
+                drop_invalid_indexes()
+                st.success("Cleanup queued")
+        else:
+            st.success("No invalid indexes")
+    except Exception as e:
+        st.error(f"Error checking invalid indexes: {str(e)}")
+
+st.subheader("Maintenance Jobs")
+show_maintenance_jobs()
+
+# Partitioning
+st.header("Partitions")
+
+for partition_table in PARTITIONED_TABLES:
+    with st.expander(f"Partitions of {partition_table}"):
+        check_partitions(partition_table)
+
+# Index Advisor
+st.header("Index Advisor")
+
+with st.expander("Analyze Query Templates"):
+    st.write(
+        "EXPLAINs every query in queries.py with every sort order and proposes "
+        "indexes for sequential scans, large sorts and mismatched expression indexes."
+    )
+    advisor_term = st.text_input("Representative search term", value="chanel")
+    if st.button("Run Index Advisor"):
         try:
-            queries = [
-                """
-                CREATE INDEX IF NOT EXISTS submissions_selftext_tsv_idx 
-                ON submissions USING gin(to_tsvector('english', selftext));
-                """,
-                """
-                CREATE INDEX IF NOT EXISTS submissions_title_tsv_idx 
-                ON submissions USING gin(to_tsvector('english', title));
-                """
-            ]
-            
-            for query in queries:
-                with st.spinner("Creating indexes... This may take a few minutes"):
-                    execute_query(query)
-            st.success("Indexes created successfully!")
-            
+            with st.spinner("Explaining query templates..."):
+                conn = get_database_connection()
+                st.session_state.advisor_results = run_advisor(
+                    conn, sample_parameters(conn, advisor_term)
+                )
         except Exception as e:
-            st.error(f"Error creating indexes: {str(e)}")
+            st.error(f"Error running index advisor: {str(e)}")
+
+    if "advisor_results" in st.session_state:
+        show_advisor_results(*st.session_state.advisor_results)
 
 if st.button("Check Search Vector"):
     check_search_vector()
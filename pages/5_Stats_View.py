@@ -0,0 +1,118 @@
+import pandas as pd
+import streamlit as st
+from database import execute_cached_query
+from queries import GET_DAILY_STATS, GET_SCORE_HISTOGRAM, GET_STATS_BOUNDS, GET_TOP_THREADS
+from stats import SCORE_BUCKETS
+from utils import DARK_THEME_CSS
+
+st.set_page_config(
+    page_title="Archive Statistics",
+    page_icon="👜",
+    layout="wide"
+)
+
+st.markdown(DARK_THEME_CSS, unsafe_allow_html=True)
+
+st.title("Archive Statistics")
+
+TABLE_LABELS = {"submissions": "Posts", "comments": "Comments"}
+
+def bucket_label(bucket):
+    """Score range of a stats_score_histogram bucket"""
+    if bucket == 0:
+        return "≤ 0"
+    if bucket == SCORE_BUCKETS - 1:
+        return f"{2 ** (bucket - 1)}+"
+    return f"{2 ** (bucket - 1)}–{2 ** bucket - 1}"
+
+# Rollups only change when ingest.py runs, so a few minutes of caching is safe.
+# Chart data comes back column-wise, which is what the DataFrames are built from.
+@st.cache_data(ttl=600)
+def get_bounds():
+    return execute_cached_query(GET_STATS_BOUNDS)[0]
+
+@st.cache_data(ttl=600)
+def get_activity(period, start, end):
+    return execute_cached_query(
+        GET_DAILY_STATS, {"period": period, "start": start, "end": end}, row_format="columns"
+    )
+
+@st.cache_data(ttl=600)
+def get_score_histogram(start, end):
+    return execute_cached_query(GET_SCORE_HISTOGRAM, {"start": start, "end": end}, row_format="columns")
+
+@st.cache_data(ttl=600)
+def get_top_threads(start, end, limit=20):
+    return execute_cached_query(GET_TOP_THREADS, {"start": start, "end": end, "limit": limit})
+
+try:
+    bounds = get_bounds()
+    if not bounds['min_day']:
+        st.info("No statistics yet. They are computed when data is loaded with ingest.py.")
+        st.stop()
+
+    # Controls
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        date_range = st.date_input(
+            "Date range",
+            value=(bounds['min_day'], bounds['max_day']),
+            min_value=bounds['min_day'],
+            max_value=bounds['max_day']
+        )
+    with col2:
+        period = st.selectbox(
+            "Group by",
+            ["month", "week", "day"],
+            format_func=str.title
+        )
+    if len(date_range) != 2:
+        st.stop()
+    start, end = date_range
+
+    activity = pd.DataFrame(get_activity(period, start, end))
+    if activity.empty:
+        st.info("No activity in this date range.")
+        st.stop()
+    activity['table_name'] = activity['table_name'].map(TABLE_LABELS)
+
+    # Totals
+    totals = activity.groupby('table_name')['items'].sum()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Posts", f"{int(totals.get('Posts', 0)):,}")
+    col2.metric("Comments", f"{int(totals.get('Comments', 0)):,}")
+    col3.metric(
+        "Comments per post",
+        f"{totals.get('Comments', 0) / totals['Posts']:.1f}" if totals.get('Posts') else "-"
+    )
+
+    st.header("Activity")
+    st.subheader("Posts and comments")
+    st.line_chart(activity.pivot(index='period', columns='table_name', values='items'))
+
+    st.subheader("Active authors (daily average)")
+    st.line_chart(activity.pivot(index='period', columns='table_name', values='avg_daily_authors'))
+
+    st.header("Score Distribution")
+    histogram = pd.DataFrame(get_score_histogram(start, end))
+    if not histogram.empty:
+        histogram = histogram.pivot(index='bucket', columns='table_name', values='items').fillna(0)
+        histogram = histogram.rename(columns=TABLE_LABELS)
+        histogram.index = [bucket_label(bucket) for bucket in histogram.index]
+        st.bar_chart(histogram)
+
+    st.header("Most Discussed Posts")
+    st.caption("Ranked over the whole months in the selected range")
+    for thread in get_top_threads(start, end):
+        col1, col2 = st.columns([4, 1])
+        with col1:
+            st.markdown(f"**{thread['title']}**")
+            st.caption(
+                f"u/{thread['author']} | Score: {thread['score']} | "
+                f"Comments: {thread['num_comments']} | {thread['month']:%B %Y}"
+            )
+        with col2:
+            st.link_button("View Discussion", f"/Post_View?post_id={thread['submission_id']}")
+
+except Exception as e:
+    st.error(f"Error loading statistics: {str(e)}")
@@ -0,0 +1,296 @@
+"""
+Monthly range partitioning of the archive tables on created_utc
+
+Migrates submissions/comments to declarative range partitions (one per
+calendar month) and keeps enough partitions in place for new data. Every
+query that filters created_utc against constants or parameters (see
+queries.build_date_filter) then only touches the matching months, and index
+builds, VACUUM and GIN pending-list cleanup work on one small partition at a
+time.
+
+The primary key of a partitioned table must include the partition key, so it
+becomes (id, created_utc). created_utc never changes for a record, which keeps
+ingest's ON CONFLICT upserts working.
+
+Functions here take cursors that return plain tuples (cursor_factory=None).
+
+Usage:
+    python partitions.py migrate comments
+    python partitions.py swap comments
+    python partitions.py maintain --months-ahead 3
+    python partitions.py drop-old comments
+"""
+
+import argparse
+import calendar
+import re
+import sys
+import time
+from datetime import datetime, timezone
+
+PARTITIONED_TABLES = ["submissions", "comments"]
+
+def month_start(utc):
+    """Epoch seconds of the first instant of the month containing utc"""
+    moment = datetime.fromtimestamp(utc, tz=timezone.utc)
+    return calendar.timegm((moment.year, moment.month, 1, 0, 0, 0))
+
+def next_month(utc):
+    moment = datetime.fromtimestamp(utc, tz=timezone.utc)
+    year, month = (moment.year + 1, 1) if moment.month == 12 else (moment.year, moment.month + 1)
+    return calendar.timegm((year, month, 1, 0, 0, 0))
+
+def partition_name(table, utc):
+    moment = datetime.fromtimestamp(utc, tz=timezone.utc)
+    return f"{table}_y{moment.year}m{moment.month:02d}"
+
+def month_ranges(min_utc, max_utc):
+    """(start, end) epoch bounds of every month overlapping [min_utc, max_utc]"""
+    start = month_start(min_utc)
+    while start <= max_utc:
+        end = next_month(start)
+        yield start, end
+        start = end
+
+def is_partitioned(cur, table):
+    cur.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+    row = cur.fetchone()
+    return bool(row and row[0])
+
+def ensure_partitions(cur, table, min_utc, max_utc):
+    """Create any missing monthly partitions covering [min_utc, max_utc]"""
+    created = []
+    for start, end in month_ranges(min_utc, max_utc):
+        name = partition_name(table, start)
+        cur.execute("SELECT to_regclass(%s) IS NULL", (name,))
+        if cur.fetchone()[0]:
+            cur.execute(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)",
+                (start, end)
+            )
+            created.append(name)
+    return created
+
+def list_partitions(cur, table):
+    """Partitions of a table (dicts) with their bounds, row estimates and sizes"""
+    cur.execute("""
+        SELECT
+            c.relname as partition,
+            pg_get_expr(c.relpartbound, c.oid) as bounds,
+            c.reltuples::bigint as row_estimate,
+            pg_size_pretty(pg_total_relation_size(c.oid)) as total_size
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass
+        ORDER BY c.relname
+    """, (table,))
+    columns = [column.name for column in cur.description]
+    return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+def check_pruning(cur, table, start_utc, end_utc):
+    """
+    EXPLAIN a date-filtered scan and report how many partitions it touches.
+    Returns (partitions scanned, total partitions).
+    """
+    cur.execute(
+        f"EXPLAIN (FORMAT JSON) SELECT id FROM {table} WHERE created_utc >= %s AND created_utc < %s",
+        (start_utc, end_utc)
+    )
+    plan = cur.fetchone()[0]
+    plan = plan[0]["Plan"] if isinstance(plan, list) else plan
+
+    scanned = set()
+    def walk(node):
+        if node.get("Relation Name"):
+            scanned.add(node["Relation Name"])
+        for child in node.get("Plans", []):
+            walk(child)
+    walk(plan)
+
+    cur.execute("SELECT count(*) FROM pg_inherits WHERE inhparent = %s::regclass", (table,))
+    return len(scanned), cur.fetchone()[0]
+
+def _secondary_indexes(cur, table):
+    cur.execute("""
+        SELECT c.relname, pg_get_indexdef(i.indexrelid), i.indisunique
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE i.indrelid = %s::regclass AND NOT i.indisprimary
+    """, (table,))
+    return cur.fetchall()
+
+def migrate(conn, table, months_ahead=3):
+    """
+    Copy a plain table into a new partitioned {table}_partitioned, month by month.
+    Months that already have rows in their partition are skipped, so an
+    interrupted migration can simply be run again. Run `swap` afterwards.
+    """
+    target = f"{table}_partitioned"
+    with conn.cursor() as cur:
+        if is_partitioned(cur, table):
+            print(f"{table} is already partitioned")
+            return
+        cur.execute(f"SELECT MIN(created_utc), MAX(created_utc) FROM {table}")
+        min_utc, max_utc = cur.fetchone()
+        if min_utc is None:
+            min_utc = max_utc = int(time.time())
+        max_utc = max(max_utc, int(time.time())) + months_ahead * 31 * 86400
+
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {target} (
+                LIKE {table} INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING STORAGE,
+                PRIMARY KEY (id, created_utc)
+            ) PARTITION BY RANGE (created_utc)
+        """)
+        ensure_partitions(cur, target, min_utc, max_utc)
+    conn.commit()
+
+    started = time.time()
+    for start, end in month_ranges(min_utc, max_utc):
+        name = partition_name(target, start)
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT EXISTS (SELECT 1 FROM {name})")
+            if cur.fetchone()[0]:
+                continue
+            cur.execute(
+                f"INSERT INTO {target} SELECT * FROM {table} WHERE created_utc >= %s AND created_utc < %s",
+                (start, end)
+            )
+            copied = cur.rowcount
+        conn.commit()
+        if copied:
+            print(f"{name}: {copied} rows ({time.time() - started:.0f}s elapsed)")
+
+    # Indexes created on the parent cascade to every partition
+    with conn.cursor() as cur:
+        for index_name, definition, unique in _secondary_indexes(cur, table):
+            if unique:
+                print(f"Skipping unique index {index_name}: it would have to include created_utc")
+                continue
+            definition = re.sub(
+                rf"\bON (ONLY )?(public\.)?{table}\b", f"ON {target}", definition, count=1
+            )
+            definition = definition.replace(f"INDEX {index_name} ", f"INDEX IF NOT EXISTS {index_name}_p ", 1)
+            print(f"Creating {index_name}_p")
+            cur.execute(definition)
+        cur.execute(f"ANALYZE {target}")
+    conn.commit()
+    print(f"Migrated {table} in {time.time() - started:.0f}s - run `swap {table}` once it is verified")
+
+def _copied_columns(cur, table):
+    """Columns migrate copies (generated columns are recomputed, not copied)"""
+    cur.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s AND is_generated = 'NEVER'
+        ORDER BY ordinal_position
+    """, (table,))
+    return [row[0] for row in cur.fetchall()]
+
+def sync_changes(cur, table, target):
+    """
+    Bring target in line with table: rows inserted, deleted or edited (score,
+    body...) since their month was copied. Returns (inserted, deleted, updated).
+    """
+    columns = _copied_columns(cur, table)
+    column_list = ", ".join(columns)
+    match = "t.id = o.id AND t.created_utc = o.created_utc"
+    cur.execute(f"""
+        INSERT INTO {target} ({column_list})
+        SELECT {column_list} FROM {table} o
+        WHERE NOT EXISTS (SELECT 1 FROM {target} t WHERE {match})
+    """)
+    inserted = cur.rowcount
+    cur.execute(f"""
+        DELETE FROM {target} t
+        WHERE NOT EXISTS (SELECT 1 FROM {table} o WHERE {match})
+    """)
+    deleted = cur.rowcount
+    changed = [column for column in columns if column not in ("id", "created_utc")]
+    cur.execute(f"""
+        UPDATE {target} t
+        SET ({", ".join(changed)}) = ({", ".join(f"o.{column}" for column in changed)})
+        FROM {table} o
+        WHERE {match}
+            AND ({", ".join(f"t.{column}" for column in changed)})
+                IS DISTINCT FROM ({", ".join(f"o.{column}" for column in changed)})
+    """)
+    return inserted, deleted, cur.rowcount
+
+def swap(conn, table):
+    """
+    Atomically replace a table with its migrated partitioned copy. Writes are
+    blocked while the rows changed since migrate copied them are brought over.
+    """
+    target = f"{table}_partitioned"
+    with conn.cursor() as cur:
+        cur.execute(f"LOCK TABLE {table} IN SHARE MODE")
+        inserted, deleted, updated = sync_changes(cur, table, target)
+        if inserted or deleted or updated:
+            print(f"Synced changes since migrate: {inserted} inserted, {deleted} deleted, {updated} updated")
+        cur.execute(f"SELECT count(*) FROM {table}")
+        old_count = cur.fetchone()[0]
+        cur.execute(f"SELECT count(*) FROM {target}")
+        new_count = cur.fetchone()[0]
+        if old_count != new_count:
+            conn.rollback()
+            raise RuntimeError(
+                f"{table} has {old_count} rows but {target} has {new_count}; run migrate again"
+            )
+        cur.execute(f"ALTER TABLE {table} RENAME TO {table}_unpartitioned")
+        cur.execute(f"ALTER TABLE {target} RENAME TO {table}")
+        # Partition names follow the parent so ensure_partitions finds them
+        for partition in list_partitions(cur, table):
+            name = partition["partition"]
+            cur.execute(f"ALTER TABLE {name} RENAME TO {name.replace(target, table, 1)}")
+    conn.commit()
+    print(f"{table} is now partitioned; the old table is kept as {table}_unpartitioned")
+
+def drop_old(conn, table):
+    with conn.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {table}_unpartitioned")
+    conn.commit()
+
+def maintain(conn, months_ahead=3):
+    """Make sure every partitioned table has partitions for the coming months"""
+    now = int(time.time())
+    with conn.cursor() as cur:
+        for table in PARTITIONED_TABLES:
+            if is_partitioned(cur, table):
+                created = ensure_partitions(cur, table, now, now + months_ahead * 31 * 86400)
+                for name in created:
+                    print(f"Created partition {name}")
+    conn.commit()
+
+def main(argv=None):
+    from ingest import connect
+
+    parser = argparse.ArgumentParser(description="Manage monthly partitions of the archive tables")
+    parser.add_argument("--dsn", help="libpq connection string (defaults to .streamlit/secrets.toml)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in [
+        ("migrate", "copy a table into a partitioned copy"),
+        ("swap", "replace a table with its partitioned copy"),
+        ("drop-old", "drop the pre-partitioning table after a swap"),
+    ]:
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("table", choices=PARTITIONED_TABLES)
+    command = commands.add_parser("maintain", help="create partitions for the coming months")
+    command.add_argument("--months-ahead", type=int, default=3)
+
+    args = parser.parse_args(argv)
+    conn = connect(args.dsn)
+    try:
+        if args.command == "migrate":
+            migrate(conn, args.table)
+        elif args.command == "swap":
+            swap(conn, args.table)
+        elif args.command == "drop-old":
+            drop_old(conn, args.table)
+        elif args.command == "maintain":
+            maintain(conn, args.months_ahead)
+    finally:
+        conn.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
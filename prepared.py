@@ -0,0 +1,198 @@
+"""
+Server-side prepared statements for the hot query templates
+
+Every variant of the templates in PREPARED_TEMPLATES (one per sort order
+and, for searches, per date filter shape) gets a fixed statement name.
+When execute() sees one of those exact SQL texts it runs EXECUTE by name,
+PREPAREing it first if this connection hasn't yet, so Postgres parses the
+statement once per connection instead of on every call. Any other SQL runs
+as before.
+
+plan_cache_mode (PostgreSQL 12+) is chosen per template: full-text searches
+force custom plans, because how selective a term is decides the best plan;
+simple lookups leave it to the server ("auto"), which switches to a reused
+generic plan once that looks no worse.
+
+Usage:
+    conn = psycopg2.connect(..., connection_factory=PreparingConnection)
+    execute(conn.cursor(), GET_POSTS.format(sort_order=SORT_ORDERS["newest"]), (20, 0))
+"""
+
+import re
+import threading
+import time
+from datetime import date
+
+import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+
+from queries import (
+    GET_POSTS, GET_USER_COMMENTS, GET_USER_POSTS, SEARCH_COMMENTS, SEARCH_POSTS, SORT_ORDERS, build_date_filter,
+)
+
+POST_SORTS = ["most_upvotes", "newest", "oldest", "most_comments"]
+COMMENT_SORTS = ["most_upvotes", "newest", "oldest"]
+
+# name prefix -> (template, sort orders, plan_cache_mode)
+PREPARED_TEMPLATES = {
+    "get_posts": (GET_POSTS, POST_SORTS, "auto"),
+    "search_posts": (SEARCH_POSTS, POST_SORTS, "force_custom_plan"),
+    "search_comments": (SEARCH_COMMENTS, COMMENT_SORTS, "force_custom_plan"),
+    "get_user_posts": (GET_USER_POSTS, POST_SORTS, "auto"),
+    "get_user_comments": (GET_USER_COMMENTS, COMMENT_SORTS, "auto"),
+}
+
+# {date_filter} shapes: the SQL only depends on which bounds are set
+_SOME_DAY = date(2000, 1, 1)
+DATE_FILTERS = {
+    "all": build_date_filter()[0],
+    "from": build_date_filter(_SOME_DAY, None)[0],
+    "until": build_date_filter(None, _SOME_DAY)[0],
+    "between": build_date_filter(_SOME_DAY, _SOME_DAY)[0],
+}
+
+class Statement:
+    __slots__ = ("name", "sql", "plan_mode", "param_count")
+
+    def __init__(self, name, query, plan_mode):
+        # psycopg2 placeholders -> PREPARE's $n parameters
+        counter = iter(range(1, query.count("%s") + 1))
+        self.sql = re.sub(r"%s|%%", lambda m: f"${next(counter)}" if m.group() == "%s" else "%", query)
+        self.name = name
+        self.plan_mode = plan_mode
+        self.param_count = query.count("%s")
+
+def _build_statements():
+    statements = {}
+    for prefix, (template, sorts, plan_mode) in PREPARED_TEMPLATES.items():
+        for sort in sorts:
+            if "{date_filter}" in template:
+                for shape, date_filter in DATE_FILTERS.items():
+                    query = template.format(sort_order=SORT_ORDERS[sort], date_filter=date_filter)
+                    statements[query] = Statement(f"{prefix}_{sort}_{shape}", query, plan_mode)
+            else:
+                query = template.format(sort_order=SORT_ORDERS[sort])
+                statements[query] = Statement(f"{prefix}_{sort}", query, plan_mode)
+    return statements
+
+# Exact SQL text -> Statement
+STATEMENTS = _build_statements()
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """A connection that remembers which statements it has prepared"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.plan_mode = None
+
+class PreparedStats:
+    """Per-statement counters for this process, for the Admin page"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rows = {}
+
+    def _row(self, statement):
+        return self._rows.setdefault(statement.name, {
+            "statement": statement.name,
+            "plan_cache_mode": statement.plan_mode,
+            "prepares": 0,
+            "executions": 0,
+            "prepare_ms": 0.0,
+            "planning_ms": None,
+        })
+
+    def prepared(self, statement, prepare_ms, planning_ms):
+        with self._lock:
+            row = self._row(statement)
+            row["prepares"] += 1
+            row["prepare_ms"] += prepare_ms
+            if planning_ms is not None:
+                row["planning_ms"] = planning_ms
+
+    def needs_planning_ms(self, statement):
+        """Planning time only feeds the force_generic_plan estimate, and is measured once per process"""
+        if statement.plan_mode != "force_generic_plan":
+            return False
+        with self._lock:
+            row = self._rows.get(statement.name)
+            return row is None or row["planning_ms"] is None
+
+    def executed(self, statement):
+        with self._lock:
+            self._row(statement)["executions"] += 1
+
+    def rows(self):
+        """
+        Counters plus an estimate of the server time saved: every execution
+        after the first on a connection skips parsing (measured as the PREPARE
+        time), and with force_generic_plan skips planning too (measured with
+        EXPLAIN of the first call in this process). "auto" may also skip planning once the
+        server settles on a generic plan; that isn't counted.
+        """
+        with self._lock:
+            rows = [dict(row) for row in self._rows.values()]
+        for row in rows:
+            reuses = row["executions"] - row["prepares"]
+            parse_ms = row["prepare_ms"] / row["prepares"] if row["prepares"] else 0.0
+            saved = reuses * parse_ms
+            if row["plan_cache_mode"] == "force_generic_plan" and row["planning_ms"]:
+                saved += reuses * row["planning_ms"]
+            row["reuses"] = reuses
+            row["saved_ms"] = round(saved, 1)
+            row["prepare_ms"] = round(parse_ms, 3)
+        return sorted(rows, key=lambda row: row["saved_ms"], reverse=True)
+
+stats = PreparedStats()
+
+def _planning_ms(cur, query, params):
+    """Planning time of the unprepared query, i.e. what each call used to pay"""
+    cur.execute("EXPLAIN (SUMMARY ON, FORMAT JSON) " + query, params)
+    plan = cur.fetchone()
+    plan = plan["QUERY PLAN"] if isinstance(plan, dict) else plan[0]
+    return plan[0].get("Planning Time")
+
+def _prepare(cur, statement, query, params):
+    started = time.perf_counter()
+    cur.execute(f"PREPARE {statement.name} AS {statement.sql}")
+    prepare_ms = (time.perf_counter() - started) * 1000
+    cur.connection.prepared.add(statement.name)
+    planning_ms = _planning_ms(cur, query, params) if stats.needs_planning_ms(statement) else None
+    stats.prepared(statement, prepare_ms, planning_ms)
+
+def _set_plan_mode(cur, statement):
+    conn = cur.connection
+    if conn.server_version >= 120000 and conn.plan_mode != statement.plan_mode:
+        cur.execute("SET plan_cache_mode = %s", (statement.plan_mode,))
+        conn.plan_mode = statement.plan_mode
+
+def execute(cur, query, params=None):
+    """cur.execute(query, params), by name if query is a prepared template"""
+    statement = STATEMENTS.get(query)
+    conn = cur.connection
+    if statement is None or not isinstance(conn, PreparingConnection) or not isinstance(params, (tuple, list)):
+        cur.execute(query, params)
+        return
+
+    execute_sql = f"EXECUTE {statement.name}"
+    if statement.param_count:
+        execute_sql += " (" + ", ".join(["%s"] * statement.param_count) + ")"
+    _set_plan_mode(cur, statement)
+    if statement.name not in conn.prepared:
+        _prepare(cur, statement, query, params)
+    try:
+        cur.execute(execute_sql, params)
+    except psycopg2.errors.InvalidSqlStatementName:
+        # Deallocated behind our back, e.g. by DISCARD ALL
+        conn.prepared.discard(statement.name)
+        _prepare(cur, statement, query, params)
+        cur.execute(execute_sql, params)
+    except psycopg2.errors.FeatureNotSupported:
+        # The tables changed shape since PREPARE ("cached plan must not change result type")
+        cur.execute(f"DEALLOCATE {statement.name}")
+        conn.prepared.discard(statement.name)
+        _prepare(cur, statement, query, params)
+        cur.execute(execute_sql, params)
+    stats.executed(statement)
@@ -10,6 +10,7 @@ Usage:
     query = GET_POSTS.format(sort_order=SORT_ORDERS['newest'])
 """
 
+from datetime import date, datetime, timedelta, timezone
 from typing import Dict, TypedDict
 
 class SortOrders(TypedDict):
@@ -26,6 +27,42 @@ SORT_ORDERS: SortOrders = {
     "most_comments": "num_comments DESC"
 }
 
+# Text search expressions - indexes and search_vector columns must use exactly
+# these expressions for the planner to match them against the queries below
+POSTS_FTS_EXPRESSION = "to_tsvector('english', title || ' ' || COALESCE(selftext, ''))"
+POSTS_TITLE_FTS_EXPRESSION = "to_tsvector('english', title)"
+POSTS_BODY_FTS_EXPRESSION = "to_tsvector('english', COALESCE(selftext, ''))"
+COMMENTS_FTS_EXPRESSION = "to_tsvector('english', body)"
+
+def build_date_filter(start_date=None, end_date=None):
+    """
+    Build the {date_filter} clause for the search and count queries.
+
+    Compares the raw created_utc column with epoch parameters (end date
+    inclusive), so the planner can prune monthly partitions and use btree
+    indexes on created_utc. Returns (sql, params); params go right after the
+    search term in the query's parameter tuple.
+    """
+    clauses = []
+    params = []
+    if isinstance(start_date, (datetime, date)):
+        start = datetime(start_date.year, start_date.month, start_date.day, tzinfo=timezone.utc)
+        clauses.append("AND created_utc >= %s")
+        params.append(int(start.timestamp()))
+    if isinstance(end_date, (datetime, date)):
+        end = datetime(end_date.year, end_date.month, end_date.day, tzinfo=timezone.utc) + timedelta(days=1)
+        clauses.append("AND created_utc < %s")
+        params.append(int(end.timestamp()))
+    return " ".join(clauses), tuple(params)
+
+# Comment sort orders as materialized thread paths (see comment_paths.py).
+# Ordering by these yields display order: parents first, replies nested under them.
+COMMENT_PATH_ORDERS: Dict[str, str] = {
+    "most_upvotes": "path_top",
+    "newest": "path_new",
+    "oldest": "path_old"
+}
+
 # Main post queries
 GET_POSTS = """
     SELECT id, author, title, selftext, created_utc, num_comments, score
@@ -40,14 +77,80 @@ GET_POST_BY_ID = """
     WHERE id = %s
 """
 
-# Comment queries
+# Comment queries - sort_order is a COMMENT_PATH_ORDERS value, so rows come
+# back in thread display order with their depth
 GET_COMMENTS_FOR_POST = """
-    SELECT id, parent_id, body, author, created_utc, score
+    SELECT id, parent_id, body, author, created_utc, score, depth
     FROM comments 
     WHERE submission_id = %s 
     ORDER BY {sort_order}
 """
 
+# Params: (comment_id, post_id) - the comment and all of its replies
+GET_COMMENT_SUBTREE = """
+    SELECT c.id, c.parent_id, c.body, c.author, c.created_utc, c.score, c.depth
+    FROM comments c
+    JOIN comments target ON target.id = %s
+    WHERE c.submission_id = %s
+        AND c.{sort_order} >= target.{sort_order}
+        AND c.{sort_order} < target.{sort_order} || '0'
+    ORDER BY c.{sort_order}
+"""
+
+# Params: (post_id, post_id, thread_count) - the first N top-level comments with all replies
+GET_TOP_THREADS_FOR_POST = """
+    SELECT id, parent_id, body, author, created_utc, score, depth
+    FROM comments
+    WHERE submission_id = %s
+        AND {sort_order} < COALESCE((
+            SELECT {sort_order} FROM comments
+            WHERE submission_id = %s AND depth = 0
+            ORDER BY {sort_order}
+            OFFSET %s LIMIT 1
+        ), '~')
+    ORDER BY {sort_order}
+"""
+
+# Deep-link context for one comment: its ancestor chain (distance 0 is the
+# comment itself), a window of siblings either side of it and its first
+# replies. sort_order is a COMMENT_PATH_ORDERS value.
+# Params: {"comment_id", "post_id", "siblings", "replies"}
+GET_COMMENT_CONTEXT = """
+    WITH RECURSIVE ancestors AS (
+        SELECT id, parent_id, body, author, created_utc, score, {sort_order} AS path, 0 AS distance
+        FROM comments
+        WHERE id = %(comment_id)s AND submission_id = %(post_id)s
+        UNION ALL
+        SELECT c.id, c.parent_id, c.body, c.author, c.created_utc, c.score, c.{sort_order}, a.distance + 1
+        FROM comments c
+        JOIN ancestors a ON c.id = a.parent_id
+        WHERE a.parent_id <> %(post_id)s AND c.submission_id = %(post_id)s
+    ),
+    target AS (
+        SELECT parent_id, path FROM ancestors WHERE distance = 0
+    )
+    SELECT 'ancestor' as role, id, parent_id, body, author, created_utc, score, distance
+    FROM ancestors
+    UNION ALL
+    (SELECT 'sibling_before', c.id, c.parent_id, c.body, c.author, c.created_utc, c.score, NULL
+     FROM comments c, target t
+     WHERE c.submission_id = %(post_id)s AND c.parent_id = t.parent_id AND c.{sort_order} < t.path
+     ORDER BY c.{sort_order} DESC
+     LIMIT %(siblings)s)
+    UNION ALL
+    (SELECT 'sibling_after', c.id, c.parent_id, c.body, c.author, c.created_utc, c.score, NULL
+     FROM comments c, target t
+     WHERE c.submission_id = %(post_id)s AND c.parent_id = t.parent_id AND c.{sort_order} > t.path
+     ORDER BY c.{sort_order}
+     LIMIT %(siblings)s)
+    UNION ALL
+    (SELECT 'reply', c.id, c.parent_id, c.body, c.author, c.created_utc, c.score, NULL
+     FROM comments c
+     WHERE c.submission_id = %(post_id)s AND c.parent_id = %(comment_id)s
+     ORDER BY c.{sort_order}
+     LIMIT %(replies)s)
+"""
+
 # Search queries
 SEARCH_POSTS = """
     SELECT id, author, title, selftext, created_utc, num_comments, score
@@ -61,7 +164,7 @@ SEARCH_POSTS = """
 SEARCH_POSTS_EXACT = """
     SELECT title, selftext, author, created_utc, id, score, num_comments
     FROM submissions 
-    WHERE LOWER(title || ' ' || selftext) LIKE '%%' || LOWER(%s) || '%%'
+    WHERE LOWER(title || ' ' || COALESCE(selftext, '')) LIKE '%%' || LOWER(%s) || '%%'
     {date_filter}
     ORDER BY {sort_order}
     LIMIT %s OFFSET %s
@@ -76,6 +179,61 @@ SEARCH_COMMENTS = """
     LIMIT %s OFFSET %s
 """
 
+# Month histograms of search matches across the whole archive, one
+# aggregate pass per table. websearch_to_tsquery reads AND / OR / NOT and
+# quotes like the search API does. Posts are matched on the same fields as
+# the search type, each expression with its own GIN index (see
+# index_advisor.FILTER_INDEXES).
+FACET_POST_EXPRESSIONS: Dict[str, str] = {
+    "post_title": POSTS_TITLE_FTS_EXPRESSION,
+    "post_body": POSTS_BODY_FTS_EXPRESSION,
+    "everything": POSTS_FTS_EXPRESSION,
+}
+
+# Format with fts_expression=FACET_POST_EXPRESSIONS[search_type]
+SEARCH_FACETS_POSTS = """
+    SELECT 
+        date_trunc('month', to_timestamp(created_utc) AT TIME ZONE 'UTC')::date as month,
+        COUNT(*) as items
+    FROM submissions 
+    WHERE {fts_expression} @@ websearch_to_tsquery('english', %s)
+    GROUP BY 1
+    ORDER BY 1
+"""
+
+SEARCH_FACETS_COMMENTS = f"""
+    SELECT 
+        date_trunc('month', to_timestamp(created_utc) AT TIME ZONE 'UTC')::date as month,
+        COUNT(*) as items
+    FROM comments 
+    WHERE {COMMENTS_FTS_EXPRESSION} @@ websearch_to_tsquery('english', %s)
+    GROUP BY 1
+    ORDER BY 1
+"""
+
+# Search-box helpers over the search_terms dictionary (see search_terms.py).
+# Words are stemmed like the full-text index; stop words get no lexeme.
+GET_TERM_HINTS = """
+    SELECT 
+        w.word,
+        (ts_lexize('english_stem', lower(w.word)))[1] as lexeme,
+        COALESCE(t.post_docs, 0) as post_docs,
+        COALESCE(t.comment_docs, 0) as comment_docs,
+        (SELECT SUM(items) FROM stats_daily WHERE table_name = 'submissions') as total_posts,
+        (SELECT SUM(items) FROM stats_daily WHERE table_name = 'comments') as total_comments
+    FROM unnest(%s::text[]) WITH ORDINALITY AS w(word, position)
+    LEFT JOIN search_terms t ON t.lexeme = (ts_lexize('english_stem', lower(w.word)))[1]
+    ORDER BY w.position
+"""
+
+SUGGEST_TERMS = """
+    SELECT lexeme, post_docs, comment_docs
+    FROM search_terms
+    WHERE lexeme LIKE %s
+    ORDER BY post_docs + comment_docs DESC
+    LIMIT %s
+"""
+
 # Count queries for pagination
 COUNT_POSTS = "SELECT COUNT(*) FROM submissions"
 
@@ -103,12 +261,22 @@ GET_DATE_BOUNDS = """
     ) dates
 """
 
+# Same bounds from the archive_bounds table kept up to date by ingest.py,
+# without scanning both tables
+GET_ARCHIVE_BOUNDS = """
+    SELECT 
+        MIN(min_utc) as min_date,
+        MAX(max_utc) as max_date
+    FROM archive_bounds
+"""
+
 # Add these missing queries for profile view
 GET_USER_POSTS = """
     SELECT title, selftext, created_utc, id, score, num_comments
     FROM submissions 
     WHERE author = %s
     ORDER BY {sort_order}
+    LIMIT %s
 """
 
 GET_USER_COMMENTS = """
@@ -116,6 +284,7 @@ GET_USER_COMMENTS = """
     FROM comments 
     WHERE author = %s
     ORDER BY {sort_order}
+    LIMIT %s
 """
 
 SEARCH_USERS = """
@@ -141,3 +310,97 @@ COUNT_SEARCH_RESULTS_EXACT = """
          WHERE LOWER(body) LIKE '%%' || LOWER(%s) || '%%'
          {date_filter}) as comment_count
 """ 
+
+# Statistics, read from the rollup tables maintained by stats.py
+GET_STATS_BOUNDS = """
+    SELECT MIN(day) as min_day, MAX(day) as max_day
+    FROM stats_daily
+"""
+
+GET_DAILY_STATS = """
+    SELECT 
+        date_trunc(%(period)s, day)::date as period,
+        table_name,
+        SUM(items)::bigint as items,
+        SUM(score_sum)::bigint as score_sum,
+        ROUND(AVG(active_authors))::integer as avg_daily_authors
+    FROM stats_daily
+    WHERE day >= %(start)s AND day <= %(end)s
+    GROUP BY 1, 2
+    ORDER BY 1
+"""
+
+GET_SCORE_HISTOGRAM = """
+    SELECT bucket, table_name, SUM(items)::bigint as items
+    FROM stats_score_histogram
+    WHERE month >= date_trunc('month', %(start)s::date) AND month <= %(end)s
+    GROUP BY bucket, table_name
+    ORDER BY bucket
+"""
+
+# Each month keeps its own top threads, so the top N of any range of whole
+# months is among them
+GET_TOP_THREADS = """
+    SELECT month, submission_id, title, author, score, num_comments
+    FROM stats_top_threads
+    WHERE month >= date_trunc('month', %(start)s::date) AND month <= %(end)s
+    ORDER BY num_comments DESC NULLS LAST, score DESC NULLS LAST
+    LIMIT %(limit)s
+"""
+
+# Profile header: the author's aggregates, monthly activity and most active
+# threads (see author_stats.py) in one round trip
+GET_AUTHOR_SUMMARY = """
+    SELECT 
+        s.*,
+        (SELECT json_agg(json_build_object(
+                    'month', m.month, 'posts', m.posts, 'comments', m.comments
+                ) ORDER BY m.month)
+         FROM author_monthly m
+         WHERE m.author = s.author) as monthly,
+        (SELECT json_agg(json_build_object(
+                    'submission_id', t.submission_id, 'title', p.title,
+                    'comments', t.comments, 'score', t.score
+                ) ORDER BY t.comments DESC)
+         FROM author_threads t
+         LEFT JOIN submissions p ON p.id = t.submission_id
+         WHERE t.author = s.author) as threads
+    FROM author_stats s
+    WHERE s.author = %s
+"""
+
+# Exports (see export.py): every matching row in date order, no LIMIT - these
+# are read through a server-side cursor, never with fetchall(). Search exports
+# match the same fields (fts_expression=FACET_POST_EXPRESSIONS[search_type])
+# and query syntax as the search on screen.
+EXPORT_SEARCH_POSTS = """
+    SELECT id, author, title, selftext, created_utc, score, num_comments
+    FROM submissions
+    WHERE {fts_expression} @@ websearch_to_tsquery('english', %s)
+    {date_filter}
+    ORDER BY created_utc
+"""
+
+EXPORT_SEARCH_COMMENTS = f"""
+    SELECT id, submission_id, parent_id, author, body, created_utc, score
+    FROM comments
+    WHERE {COMMENTS_FTS_EXPRESSION} @@ websearch_to_tsquery('english', %s)
+    {{date_filter}}
+    ORDER BY created_utc
+"""
+
+EXPORT_USER_POSTS = """
+    SELECT id, author, title, selftext, created_utc, score, num_comments
+    FROM submissions
+    WHERE author = %s
+    {date_filter}
+    ORDER BY created_utc
+"""
+
+EXPORT_USER_COMMENTS = """
+    SELECT id, submission_id, parent_id, author, body, created_utc, score
+    FROM comments
+    WHERE author = %s
+    {date_filter}
+    ORDER BY created_utc
+"""
@@ -0,0 +1,155 @@
+"""
+Read-replica routing for the archive database
+
+The primary comes from st.secrets["postgres"]; read replicas are optional
+entries under it that override whichever connection settings differ:
+
+    [postgres]
+    host = "db-primary"
+    ...
+    max_replica_lag_seconds = 30
+
+    [[postgres.replicas]]
+    host = "db-replica-1"
+
+    [[postgres.replicas]]
+    host = "db-replica-2"
+    port = 5433
+
+Reads are spread over the healthy replicas, least busy first. A replica is
+healthy if it answered its last check and is no more than
+max_replica_lag_seconds behind. A background thread checks every replica
+each CHECK_INTERVAL seconds, and picking a node only reads the last result,
+so a slow or unreachable replica never stalls a request. With no healthy replica,
+reads fall back to the primary. Everything else - admin queries, DDL and
+maintenance - always runs on the primary.
+"""
+
+import threading
+import time
+
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+
+CHECK_INTERVAL = 5
+DEFAULT_MAX_LAG_SECONDS = 30
+
+# A replica with nothing left to replay is caught up however old its last
+# transaction is; otherwise lag is the age of the last replayed transaction
+LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN NULL
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+class Node:
+    def __init__(self, name, settings, pool_size, cursor_factory):
+        self.name = name
+        self.settings = settings
+        self.pool_size = pool_size
+        self.cursor_factory = cursor_factory
+        self.in_use = 0
+        self.healthy = True
+        self.lag = None
+        self.error = None
+        self.checked_at = 0.0
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self):
+        # Created on first use, so a replica that is down at startup
+        # doesn't keep the app from starting
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadedConnectionPool(
+                    1, self.pool_size, cursor_factory=self.cursor_factory, **self.settings
+                )
+            return self._pool
+
+    def check(self, max_lag):
+        """Refresh healthy/lag with a short-lived connection"""
+        try:
+            conn = psycopg2.connect(**{**self.settings, "connect_timeout": 3})
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(LAG_QUERY)
+                    lag = cur.fetchone()[0]
+            finally:
+                conn.close()
+            self.lag = None if lag is None else float(lag)
+            self.error = None if lag is not None else "Not in recovery (is this a replica?)"
+            self.healthy = lag is not None and self.lag <= max_lag
+        except psycopg2.Error as e:
+            self.lag = None
+            self.error = str(e).strip()
+            self.healthy = False
+        self.checked_at = time.monotonic()
+
+    def status(self):
+        return {
+            "node": self.name,
+            "host": f"{self.settings['host']}:{self.settings['port']}",
+            "healthy": self.healthy,
+            "lag_seconds": self.lag,
+            "in_use": self.in_use,
+            "error": self.error,
+        }
+
+class ReplicaSet:
+    def __init__(self, primary_settings, replica_settings, pool_size, cursor_factory, max_lag=DEFAULT_MAX_LAG_SECONDS):
+        self.primary = Node("primary", primary_settings, pool_size, cursor_factory)
+        self.replicas = [
+            Node(f"replica-{number}", settings, pool_size, cursor_factory)
+            for number, settings in enumerate(replica_settings, 1)
+        ]
+        self.max_lag = max_lag
+        self.fallbacks = 0
+        self._turn = 0
+        self._lock = threading.Lock()
+        if self.replicas:
+            self._checker = threading.Thread(target=self._check_health, name="replica-checks", daemon=True)
+            self._checker.start()
+
+    def _check_health(self):
+        while True:
+            for node in self.replicas:
+                node.check(self.max_lag)
+            time.sleep(CHECK_INTERVAL)
+
+    def choose(self, read_only):
+        """The node a statement should run on, with its in_use count taken"""
+        node = self.primary
+        if read_only and self.replicas:
+            with self._lock:
+                healthy = [replica for replica in self.replicas if replica.healthy]
+                if healthy:
+                    # Rotate the starting point so idle replicas share the load too
+                    self._turn += 1
+                    start = self._turn % len(healthy)
+                    node = min(healthy[start:] + healthy[:start], key=lambda replica: replica.in_use)
+                else:
+                    self.fallbacks += 1
+        with self._lock:
+            node.in_use += 1
+        return node
+
+    def done(self, node, conn=None, broken=False):
+        """Give back what choose() took, and conn if one was checked out"""
+        try:
+            if conn is not None:
+                node.pool.putconn(conn, close=broken or conn.closed)
+        finally:
+            with self._lock:
+                node.in_use -= 1
+
+    def mark_failed(self, node, error):
+        """Take a replica out of rotation until its next check"""
+        if node is not self.primary:
+            node.healthy = False
+            node.error = str(error).strip()
+
+    def status(self):
+        return [node.status() for node in [self.primary, *self.replicas]]
@@ -0,0 +1,47 @@
+"""
+Result row formats for database queries
+
+RealDictCursor builds a new dict per row, repeating every column name.
+For large reads the other formats decode from plain tuples instead:
+
+- "dict"        one dict per row (default, what the pages index by name)
+- "tuple"       plain tuples in column order
+- "namedtuple"  tuples with attribute access; one class per column list,
+                shared by every row and every query with those columns
+- "columns"     {column: [values]} - one list per column, for pandas/charts
+
+Usage:
+    rows = execute_query(GET_USER_POSTS..., params, row_format="namedtuple")
+    rows[0].title
+"""
+
+from collections import namedtuple
+from functools import lru_cache
+
+from psycopg2.extensions import cursor as TupleCursor
+from psycopg2.extras import RealDictCursor
+
+ROW_FORMATS = ("dict", "tuple", "namedtuple", "columns")
+
+def cursor_factory(row_format):
+    if row_format not in ROW_FORMATS:
+        raise ValueError(f"Unknown row format {row_format!r}, expected one of {ROW_FORMATS}")
+    return RealDictCursor if row_format == "dict" else TupleCursor
+
+def column_names(cur):
+    return tuple(column.name for column in cur.description)
+
+@lru_cache(maxsize=256)
+def row_type(columns):
+    """The namedtuple class for a column list (columns that aren't identifiers get _0, _1...)"""
+    return namedtuple("Row", columns, rename=True)
+
+def decode(columns, rows, row_format):
+    """Turn fetched tuples into row_format; dict rows are already decoded"""
+    if row_format in ("dict", "tuple"):
+        return rows
+    if row_format == "namedtuple":
+        return list(map(row_type(columns)._make, rows))
+    if not rows:
+        return {name: [] for name in columns}
+    return {name: list(values) for name, values in zip(columns, zip(*rows))}
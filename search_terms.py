@@ -0,0 +1,72 @@
+"""
+Term dictionary for search-box autocomplete and term hints
+
+search_terms holds every lexeme of the full-text index with the number of
+posts and comments containing it (ts_stat over search_vector). The lexeme
+column uses the "C" collation, so its primary key serves prefix lookups
+(LIKE 'pre%') directly.
+
+Kept current by ingest.py (see DERIVED_TABLES): an incremental batch adds
+the lexemes of newly inserted records, and for edited records whose text
+changed subtracts the lexemes of the old version before adding the new
+ones. A bulk load rebuilds a table's counts from scratch.
+"""
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS search_terms (
+        lexeme text COLLATE "C" PRIMARY KEY,
+        post_docs integer NOT NULL DEFAULT 0,
+        comment_docs integer NOT NULL DEFAULT 0
+    );
+"""
+
+COUNT_COLUMNS = {"submissions": "post_docs", "comments": "comment_docs"}
+
+def _add_counts(cur, table, vectors_sql):
+    """Add ts_stat document counts of the given tsvector query to a table's column"""
+    column = COUNT_COLUMNS[table]
+    cur.execute(f"""
+        INSERT INTO search_terms (lexeme, {column})
+        SELECT word, ndoc FROM ts_stat(%s)
+        ON CONFLICT (lexeme) DO UPDATE
+        SET {column} = search_terms.{column} + EXCLUDED.{column}
+    """, (vectors_sql,))
+
+def _subtract_counts(cur, table, vectors_sql):
+    """Take ts_stat document counts back off a table's column, dropping lexemes no record has"""
+    column = COUNT_COLUMNS[table]
+    cur.execute(f"""
+        UPDATE search_terms
+        SET {column} = GREATEST(search_terms.{column} - s.ndoc, 0)
+        FROM ts_stat(%s) s
+        WHERE search_terms.lexeme = s.word
+        RETURNING search_terms.lexeme, search_terms.post_docs + search_terms.comment_docs
+    """, (vectors_sql,))
+    unused = [lexeme for lexeme, docs in cur.fetchall() if docs == 0]
+    if unused:
+        cur.execute("DELETE FROM search_terms WHERE lexeme = ANY(%s)", (unused,))
+
+def refresh_search_terms(cur, table):
+    """
+    Ingest hook: count the lexemes of the records inserted by the current
+    batch, and move the counts of edited records from their old text to the new
+    """
+    changed = f"""
+        FROM ingest_changed ch
+        JOIN {table} t ON t.id = ch.id AND t.created_utc = ch.created_utc
+        WHERE (ch.inserted OR t.search_vector IS DISTINCT FROM ch.previous_vector)
+    """
+    _subtract_counts(cur, table, f"SELECT ch.previous_vector {changed} AND ch.previous_vector IS NOT NULL")
+    _add_counts(cur, table, f"SELECT t.search_vector {changed} AND t.search_vector IS NOT NULL")
+
+def rebuild_search_terms(cur, table):
+    """Ingest hook: recount a table's lexemes from scratch after a bulk load"""
+    column = COUNT_COLUMNS[table]
+    cur.execute(f"UPDATE search_terms SET {column} = 0 WHERE {column} <> 0")
+    _add_counts(cur, table, f"SELECT search_vector FROM {table} WHERE search_vector IS NOT NULL")
+    cur.execute("DELETE FROM search_terms WHERE post_docs = 0 AND comment_docs = 0")
+
+def prefix_pattern(prefix):
+    """LIKE pattern matching lexemes that start with prefix"""
+    escaped = prefix.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return escaped + "%"
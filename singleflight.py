@@ -0,0 +1,75 @@
+"""
+Single-flight request coalescing
+
+Streamlit runs every session in its own thread of the same process, so when
+many sessions ask for the same thread or search at once they can share one
+backend call: the first caller for a key runs it, concurrent callers with
+the same key wait for that call and get its result (or its exception).
+Nothing is cached once the call finishes - caching is st.cache_* and
+cache.py's job - so this only collapses simultaneous identical requests.
+
+Results are shared between sessions and must be treated as read-only.
+
+Usage:
+    flights = SingleFlight()
+    data = flights.do(("get_json", path, params), lambda: fetch(path, params), timeout=30)
+"""
+
+import threading
+
+class FlightTimeout(TimeoutError):
+    """A coalesced call took longer than the waiting caller's timeout"""
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+    def do(self, key, function, timeout=None):
+        """
+        Run function() once per key at a time. Callers that find the key in
+        flight wait up to timeout seconds (None = as long as it takes) and
+        raise FlightTimeout if it has not finished by then.
+        """
+        key = repr(key)
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+
+        if not leader:
+            if not call.done.wait(timeout):
+                raise FlightTimeout(f"Still waiting for an identical request after {timeout}s")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self):
+        """Number of distinct calls currently running"""
+        with self._lock:
+            return len(self._calls)
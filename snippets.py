@@ -0,0 +1,75 @@
+"""
+Match-highlighted snippets for search results
+
+Search results come from the search API with their full text. highlight()
+is only ever called for the rows of the page being displayed (at most a
+page of ~20 rows), never for every match: it picks the window of each text
+with the most query matches and bolds them.
+
+Usage:
+    snippet, truncated = highlight(comment['body'], "chanel caviar")
+"""
+
+import re
+
+OPERATORS = {"AND", "OR", "NOT"}
+
+def query_terms(query):
+    """Search words of a query, without boolean operators"""
+    return [word.lower() for word in re.findall(r"\w+", query) if word not in OPERATORS and len(word) > 1]
+
+def highlight(text, query, max_length=400, context=120):
+    """
+    Cut the part of text with the most query matches, bold the matches.
+    Returns (snippet, truncated). Words that merely start with a term
+    ("bag" -> "bags") count as matches, roughly like the stemmed index.
+    """
+    text = (text or "").strip()
+    terms = query_terms(query)
+    matches = []
+    if terms:
+        pattern = re.compile(r"\b(?:" + "|".join(re.escape(term) for term in terms) + r")\w*", re.IGNORECASE)
+        matches = [(match.start(), match.end()) for match in pattern.finditer(text)]
+
+    if len(text) <= max_length:
+        start, end = 0, len(text)
+    elif not matches:
+        start, end = 0, max_length
+    else:
+        # The window starting shortly before a match that covers the most matches
+        best_start, best_count = 0, -1
+        for match_start, _ in matches:
+            window_start = max(0, match_start - context)
+            count = sum(1 for s, e in matches if s >= window_start and e <= window_start + max_length)
+            if count > best_count:
+                best_start, best_count = window_start, count
+        start = best_start
+        end = min(len(text), start + max_length)
+
+    # Snap to word boundaries
+    if start > 0:
+        space = text.find(" ", start)
+        if space != -1 and space < start + context:
+            start = space + 1
+    if end < len(text):
+        space = text.rfind(" ", start, end)
+        if space > start:
+            end = space
+
+    pieces = []
+    position = start
+    for match_start, match_end in matches:
+        if match_start < start or match_end > end:
+            continue
+        pieces.append(text[position:match_start])
+        pieces.append(f"**{text[match_start:match_end]}**")
+        position = match_end
+    pieces.append(text[position:end])
+
+    snippet = "".join(pieces)
+    truncated = start > 0 or end < len(text)
+    if start > 0:
+        snippet = "..." + snippet
+    if end < len(text):
+        snippet += "..."
+    return snippet, truncated
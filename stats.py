@@ -0,0 +1,144 @@
+"""
+Rollup tables behind the Stats View
+
+- stats_daily: items, active authors and score totals per table per UTC day
+- stats_score_histogram: score distribution per table per month, in
+  power-of-two buckets (0 = score <= 0, k = 2^(k-1) <= score < 2^k)
+- stats_top_threads: the most commented posts of each month
+
+Together they hold a few thousand rows per table-year, so every chart on
+the Stats View reads rollups instead of running COUNT(*)/GROUP BY over the
+archive. They are kept current by ingest.py (see DERIVED_TABLES): an
+incremental batch recomputes only the days and months it touched, using a
+created_utc range scan; a bulk load rebuilds them in one pass per table.
+"""
+
+SCORE_BUCKETS = 16
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS stats_daily (
+        table_name text NOT NULL,
+        day date NOT NULL,
+        items integer NOT NULL,
+        active_authors integer NOT NULL,
+        score_sum bigint NOT NULL,
+        PRIMARY KEY (table_name, day)
+    );
+
+    CREATE TABLE IF NOT EXISTS stats_score_histogram (
+        table_name text NOT NULL,
+        month date NOT NULL,
+        bucket smallint NOT NULL,
+        items integer NOT NULL,
+        PRIMARY KEY (table_name, month, bucket)
+    );
+
+    CREATE TABLE IF NOT EXISTS stats_top_threads (
+        month date NOT NULL,
+        rank smallint NOT NULL,
+        submission_id text NOT NULL,
+        title text,
+        author text,
+        score integer,
+        num_comments integer,
+        PRIMARY KEY (month, rank)
+    );
+
+    CREATE INDEX IF NOT EXISTS submissions_created_utc_idx ON submissions (created_utc);
+    CREATE INDEX IF NOT EXISTS comments_created_utc_idx ON comments (created_utc);
+"""
+
+TOP_THREADS_PER_MONTH = 10
+
+DAY = "(DATE '1970-01-01' + (created_utc / 86400)::int)"
+MONTH = "date_trunc('month', to_timestamp(created_utc) AT TIME ZONE 'UTC')::date"
+BUCKET = (
+    "CASE WHEN COALESCE(score, 0) <= 0 THEN 0 "
+    f"ELSE LEAST({SCORE_BUCKETS - 1}, floor(log(2, score::numeric))::int + 1) END"
+)
+
+def _range(start, end):
+    """WHERE clause for a created_utc range, or none for the whole table"""
+    if start is None:
+        return "", {}
+    return "WHERE created_utc >= %(start)s AND created_utc < %(end)s", {"start": start, "end": end}
+
+def _recompute_daily(cur, table, start=None, end=None):
+    """Replace the stats_daily rows of the UTC days in [start, end)"""
+    condition, params = _range(start, end)
+    params["table"] = table
+    day_filter = (
+        "AND day >= DATE '1970-01-01' + (%(start)s / 86400)::int "
+        "AND day < DATE '1970-01-01' + (%(end)s / 86400)::int"
+    ) if condition else ""
+    cur.execute(f"DELETE FROM stats_daily WHERE table_name = %(table)s {day_filter}", params)
+    cur.execute(f"""
+        INSERT INTO stats_daily (table_name, day, items, active_authors, score_sum)
+        SELECT %(table)s, {DAY}, count(*),
+            count(DISTINCT author) FILTER (WHERE author IS NOT NULL AND author <> '[deleted]'),
+            COALESCE(sum(score), 0)
+        FROM {table}
+        {condition}
+        GROUP BY 2
+    """, params)
+
+def _recompute_monthly(cur, table, start=None, end=None):
+    """Replace the histogram and top-thread rows of the months in [start, end)"""
+    condition, params = _range(start, end)
+    params["table"] = table
+    month_filter = (
+        "AND month >= (to_timestamp(%(start)s) AT TIME ZONE 'UTC')::date "
+        "AND month < (to_timestamp(%(end)s) AT TIME ZONE 'UTC')::date"
+    ) if condition else ""
+
+    cur.execute(f"DELETE FROM stats_score_histogram WHERE table_name = %(table)s {month_filter}", params)
+    cur.execute(f"""
+        INSERT INTO stats_score_histogram (table_name, month, bucket, items)
+        SELECT %(table)s, {MONTH}, {BUCKET}, count(*)
+        FROM {table}
+        {condition}
+        GROUP BY 2, 3
+    """, params)
+
+    if table != "submissions":
+        return
+    cur.execute(f"DELETE FROM stats_top_threads WHERE true {month_filter}", params)
+    cur.execute(f"""
+        INSERT INTO stats_top_threads (month, rank, submission_id, title, author, score, num_comments)
+        SELECT month, rank, id, title, author, score, num_comments
+        FROM (
+            SELECT {MONTH} AS month, id, title, author, score, num_comments,
+                row_number() OVER (
+                    PARTITION BY {MONTH}
+                    ORDER BY num_comments DESC NULLS LAST, score DESC NULLS LAST, id
+                ) AS rank
+            FROM {table}
+            {condition}
+        ) ranked
+        WHERE rank <= {TOP_THREADS_PER_MONTH}
+    """, params)
+
+def refresh_stats(cur, table):
+    """
+    Ingest hook: recompute the rollups touched by the current batch - whole
+    UTC days for stats_daily, whole months for the monthly rollups
+    """
+    cur.execute("""
+        SELECT
+            MIN(created_utc) / 86400 * 86400,
+            (MAX(created_utc) / 86400 + 1) * 86400,
+            extract(epoch FROM date_trunc('month', to_timestamp(MIN(created_utc)) AT TIME ZONE 'UTC'))::bigint,
+            extract(epoch FROM date_trunc('month', to_timestamp(MAX(created_utc)) AT TIME ZONE 'UTC')
+                + interval '1 month')::bigint
+        FROM ingest_changed
+    """)
+    day_start, day_end, month_start, month_end = cur.fetchone()
+    if day_start is None:
+        return
+    _recompute_daily(cur, table, day_start, day_end)
+    _recompute_monthly(cur, table, month_start, month_end)
+
+def rebuild_stats(cur, table):
+    """Ingest hook: recompute every rollup of a table after a bulk load"""
+    _recompute_daily(cur, table)
+    _recompute_monthly(cur, table)